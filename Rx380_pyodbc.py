@@ -3,11 +3,11 @@ import minimalmodbus
 import csv
 import logging
 from datetime import datetime
-from pyexcel_ods3 import save_data, get_data
-from collections import OrderedDict, deque
 import signal
-import struct
 from pathlib import Path
+from device_profile import DEFAULT_PROFILE, load_profile
+from ring_buffer import SampleRing
+from spreadsheet_export import SpreadsheetExporter
 import pyodbc
 
 # Set up logging
@@ -25,6 +25,16 @@ class GracefulKiller:
     def exit_gracefully(self, *args):
         self.kill_now = True
 
+# Register map shared with the watchdog (profiles/rx380.json), decoded a block at a time.
+# The values this script has always logged; the max/min line voltages of the
+# full profile would cost two more requests and change the CSV columns.
+RX380_PROFILE = load_profile(DEFAULT_PROFILE, fields=[
+    'voltage_l1', 'voltage_l2', 'voltage_l3', 'voltage_l12', 'voltage_l23', 'voltage_l31',
+    'current_l1', 'current_l2', 'current_l3', 'current_ln',
+    'total_real_power', 'total_apparent_power', 'total_reactive_power', 'total_power_factor', 'frequency',
+    'total_real_energy', 'total_reactive_energy', 'total_apparent_energy',
+])
+
 class RX380:
     def __init__(self, port='/dev/ttyUSB0', slave_address=1):
         self.instrument = minimalmodbus.Instrument(port, slave_address)
@@ -34,71 +44,22 @@ class RX380:
         self.instrument.serial.stopbits = 1
         self.instrument.serial.timeout = 1
         self.instrument.mode = minimalmodbus.MODE_RTU
+        self.profile = RX380_PROFILE
 
-    async def read_scaled_value(self, register_address, scale_factor):
-        try:
-            raw_value = await asyncio.to_thread(self.instrument.read_registers, register_address, 2, functioncode=4)
-            value = (raw_value[0] << 16 | raw_value[1]) * scale_factor
-            return value
-        except Exception as e:
-            logging.error(f"Error reading scaled value from register {register_address}: {e}")
-            raise
-
-    async def read_float(self, register_address):
-        try:
-            raw_value = await asyncio.to_thread(self.instrument.read_long, register_address, functioncode=4)
-            return struct.unpack('>f', struct.pack('>I', raw_value))[0]
-        except Exception as e:
-            logging.error(f"Error reading float from register {register_address}: {e}")
-            raise
-
-    async def read_long(self, register_address, signed=True):
-        try:
-            return await asyncio.to_thread(self.instrument.read_long, register_address, functioncode=4, signed=signed)
-        except Exception as e:
-            logging.error(f"Error reading long from register {register_address}: {e}")
-            raise
-
-    async def read_register(self, register_address, number_of_decimals, signed):
+    async def read_block(self, block):
         try:
-            return await asyncio.to_thread(self.instrument.read_register, register_address, number_of_decimals=number_of_decimals, signed=signed, functioncode=4)
+            registers = await asyncio.to_thread(self.instrument.read_registers, block.start, block.count,
+                                                functioncode=self.profile.function_code)
+            return block.decode_registers(registers)
         except Exception as e:
-            logging.error(f"Error reading register {register_address}: {e}")
+            logging.error(f"Error reading registers {block.start}-{block.end - 1}: {e}")
             raise
 
     async def read_data(self):
-        data = {}
+        data = dict.fromkeys(self.profile.field_names)
         try:
-            # Read phase voltages (L-N)
-            data['voltage_l1'] = await self.read_scaled_value(4034, 0.1)  # V
-            data['voltage_l2'] = await self.read_scaled_value(4036, 0.1)  # V
-            data['voltage_l3'] = await self.read_scaled_value(4038, 0.1)  # V
-
-            # Read line voltages (L-L)
-            data['voltage_l12'] = await self.read_scaled_value(4028, 0.1)  # V
-            data['voltage_l23'] = await self.read_scaled_value(4030, 0.1)  # V
-            data['voltage_l31'] = await self.read_scaled_value(4032, 0.1)  # V
-
-            # Read current
-            data['current_l1'] = await self.read_scaled_value(4020, 0.001)  # A
-            data['current_l2'] = await self.read_scaled_value(4022, 0.001)  # A
-            data['current_l3'] = await self.read_scaled_value(4024, 0.001)  # A
-            data['current_ln'] = await self.read_scaled_value(4026, 0.001)  # A
-
-            # Read power
-            data['total_real_power'] = await self.read_long(4012)  # W
-            data['total_apparent_power'] = await self.read_long(4014, signed=False)  # VA
-            data['total_reactive_power'] = await self.read_long(4016)  # VAR
-
-            # Read power factor and frequency
-            data['total_power_factor'] = await self.read_register(4018, 3, True)
-            data['frequency'] = await self.read_register(4019, 2, False)  # Hz
-
-            # Read energy
-            data['total_real_energy'] = await self.read_long(4002, signed=False)  # kWh
-            data['total_reactive_energy'] = await self.read_long(4010, signed=False)  # kVARh
-            data['total_apparent_energy'] = await self.read_long(4006, signed=False)  # kVAh
-
+            for block in self.profile.read_plan:
+                data.update(await self.read_block(block))
             return data
         except Exception as e:
             logging.error(f"Error reading data: {e}")
@@ -106,9 +67,11 @@ class RX380:
 
 class DataManager:
     def __init__(self, buffer_size=720):  # 720 * 5 minutes = 60 hours of data
-        self.buffer = deque(maxlen=buffer_size)
+        self.buffer = SampleRing(RX380_PROFILE.field_names, buffer_size)
         self.folder_path = Path.home() / "Desktop" / "PUA_Office" / "PUA" / "rx380_daily_logs"
         self.folder_path.mkdir(parents=True, exist_ok=True)
+        # Each finished day's CSV is exported to ODS once, in a separate process.
+        self.exporter = SpreadsheetExporter(self.folder_path, logger=logging.getLogger())
         self.db_config = {
             'server': '192.168.0.226',
             'database': 'Power_Usage_Alumac',
@@ -127,36 +90,17 @@ class DataManager:
 
         try:
             with open(filename, 'a', newline='') as csvfile:
-                fieldnames = ['timestamp'] + list(self.buffer[0].keys() - {'timestamp'})
+                fieldnames = ['timestamp'] + list(self.buffer.fields)
                 writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
 
                 if not file_exists:
                     writer.writeheader()
 
-                writer.writerows(self.buffer)
+                writer.writerows(self.buffer.to_samples(self.buffer.snapshot()))
             logging.info(f"Data saved to CSV: {filename}")
         except Exception as e:
             logging.error(f"Error saving to CSV: {e}")
 
-    async def save_to_ods(self):
-        filename = self.folder_path / f"rx380_data_{datetime.now().strftime('%Y-%m-%d')}.ods"
-
-        try:
-            if filename.is_file():
-                sheet_data = await asyncio.to_thread(get_data, str(filename))
-                sheet = sheet_data["Sheet1"]
-            else:
-                sheet = [['timestamp'] + list(self.buffer[0].keys() - {'timestamp'})]
-
-            for data in self.buffer:
-                row_data = [data['timestamp']] + [data[key] for key in sheet[0][1:]]
-                sheet.append(row_data)
-
-            await asyncio.to_thread(save_data, str(filename), OrderedDict([("Sheet1", sheet)]))
-            logging.info(f"Data saved to ODS: {filename}")
-        except Exception as e:
-            logging.error(f"Error saving to ODS: {e}")
-
     async def save_to_sql(self, data):
         conn_str = (f"DRIVER={self.db_config['driver']};"
                     f"SERVER={self.db_config['server']};"
@@ -197,18 +141,16 @@ class DataManager:
                 await asyncio.to_thread(conn.close)
 
     async def save_data(self):
-        tasks = [
-            self.save_to_csv(),
-            self.save_to_ods()
-        ]
+        tasks = [self.save_to_csv()]
+        self.exporter.check_rollover()
         
         # Save the last data point to SQL Server
         if self.buffer:
-            tasks.append(self.save_to_sql(self.buffer[-1]))
+            tasks.append(self.save_to_sql(self.buffer.last()))
         
         await asyncio.gather(*tasks)
 
-async def user_input_handler(killer):
+async def user_input_handler(killer, data_manager):
     while not killer.kill_now:
         user_input = await asyncio.to_thread(input)
         user_input = user_input.lower()
@@ -221,6 +163,9 @@ async def user_input_handler(killer):
         elif user_input == 'r':
             print("Resuming...")
             killer.pause = False
+        elif user_input == 'e':
+            print("Exporting today's log to ODS...")
+            data_manager.exporter.export()
 
 async def main():
     rx380 = RX380(slave_address=1)
@@ -228,9 +173,9 @@ async def main():
     killer = GracefulKiller()
 
     logging.info("Starting RX380 data logging")
-    print("RX380 data logging started. Press 'q' to quit, 'w' to pause, 'r' to resume.")
+    print("RX380 data logging started. Press 'q' to quit, 'w' to pause, 'r' to resume, 'e' to export today's ODS.")
 
-    input_task = asyncio.create_task(user_input_handler(killer))
+    input_task = asyncio.create_task(user_input_handler(killer, data_manager))
 
     try:
         while not killer.kill_now:
@@ -271,6 +216,7 @@ async def main():
     finally:
         input_task.cancel()
         await data_manager.save_data()  # Save any remaining data
+        await data_manager.exporter.close()
         logging.info("Shutting down RX380 data logging")
         print("Shutting down RX380 data logging")
 
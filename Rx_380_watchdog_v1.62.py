@@ -1,36 +1,177 @@
 #!/usr/bin/env python3
 import asyncio
 import csv
+import functools
 import json
 import logging
-import minimalmodbus
+import time
 import pymssql
 from pathlib import Path
 from datetime import datetime, timedelta
-import aiofiles
+
+from acquisition import Acquisition, next_batch, port_configs
+from bus_scheduler import BusScheduler, slave_name
+from compression import Compressor
+from csv_writer import DailyCsvWriter
+from device_profile import DEFAULT_PROFILE, load_profile
+from energy_delta import EnergyDeltas
+from http_api import QueryApi
+from live_stream import LiveStream
+from metrics import REGISTRY, SIZE_BUCKETS, monitor_loop_lag
+from modbus_rtu import ModbusCRCError, ModbusExceptionResponse, ModbusTimeout, RtuTransport
+from modbus_tcp import ModbusTcpTransport
+from mqtt_sink import MqttPublisher
+from ring_buffer import RecentSamples
+from rollups import RESOLUTIONS, ROLLUP_COLUMNS, ROLLUP_KEYS, RollupEngine, forward_rollups
+from sample_log import SampleLogStore, record_dtype
+from sql_bulk import ENERGY_DELTA_COLUMNS, METER_COLUMNS, SQL_COLUMNS, BulkWriter, MergeWriter
+from sql_pool import ConnectionPool
+from sql_spool import SpoolForwarder, SqlSpool
+from tracing import TRACER, install_signal_handlers, sample_id
 
 # -------------------------------------------------------------------------------
 # Configuration
 # -------------------------------------------------------------------------------
 config = {
     "modbus": {
-        "port": "/dev/ttyUSB0",
-        "slave_address": 1,
-        "baudrate": 19200
+        "baudrate": 19200,
+        "profile": str(DEFAULT_PROFILE),
+        "schedule": "round_robin",
+        # "fixed" polls every meter each data_save_interval; "adaptive" gives each
+        # meter its own interval between min_interval and max_interval seconds,
+        # shorter while its power/current change fast (see adaptive_polling.py).
+        "polling": {"mode": "fixed", "min_interval": 1, "max_interval": 60},
+        "ports": [
+            {
+                "port": "/dev/ttyUSB0",
+                "slaves": [
+                    {"address": 1, "name": "office", "table_name": "Office_Readings"}
+                ]
+            }
+            # Meters behind an RS485-to-Ethernet gateway:
+            # {"host": "192.168.0.50", "tcp_port": 502, "max_in_flight": 1, "slaves": [...]}
+        ]
     },
     "database": {
         "server": "192.168.0.226",
         "database": "Power_Usage_Alumac",
         "user": "sa",
-        "password": "password"
+        "password": "password",
+        "table_name": "Office_Readings",
+        "pool_size": 2,
+        "checkout_timeout": 10,
+        "batch_size": 500,
+        "rollup_table": "Rollups",
+        # Also insert the meter name, so meters can share a table (needs the
+        # Meter column and index from sql_bulk.py).
+        "meter_column": False,
+        # Also insert the per-interval energy deltas (needs the columns from energy_delta.py).
+        "energy_delta_columns": False
+    },
+    "spool": {
+        "path": str(Path.home() / "rx380_spool.sqlite3"),
+        "max_mb": 200,
+        "batch_size": 500,
+        "max_rows_per_second": 2000,
+        "retry_interval": 30
     },
     "csv": {
-        "log_folder": str(Path.home() / "Desktop" / "PUA_P7Oven" / "PUA" / "rx380_daily_logs")
+        "log_folder": str(Path.home() / "Desktop" / "PUA_P7Oven" / "PUA" / "rx380_daily_logs"),
+        "flush_rows": 100,
+        "flush_interval": 5,
+        "fsync": False
+    },
+    "archive": {
+        # Typed Parquet day files (needs pyarrow); see parquet_archive.read_archive.
+        "enabled": False,
+        "folder": str(Path.home() / "Desktop" / "PUA_P7Oven" / "PUA" / "rx380_daily_logs"),
+        "compression": "zstd"
+    },
+    "history": {
+        # Local fixed-width sample log per meter for fast time lookups; see sample_log.
+        "enabled": True,
+        "folder": str(Path.home() / "rx380_history")
+    },
+    "http_api": {
+        # Latest readings and time ranges over HTTP for dashboards, served from
+        # memory and the history logs (see http_api.py).
+        "enabled": False,
+        "host": "127.0.0.1",
+        "port": 8380,
+        # Server-sent events of new samples and rollup buckets on /stream. Each
+        # client keeps at most stream_queue unsent messages; with conflate only
+        # the newest per meter is kept for a client that falls behind.
+        "stream": True,
+        "stream_queue": 100,
+        "conflate": True,
+        # e.g. "*" so browser dashboards on another port can use EventSource.
+        "allow_origin": None,
+        # Prometheus text format on /metrics.
+        "metrics": True
+    },
+    "mqtt": {
+        # Publish every batch_interval seconds, one message per meter on
+        # <topic_prefix>/<meter> (see mqtt_sink.py). While the broker is down
+        # samples wait in the spool ("disk") or in memory up to max_buffered.
+        "enabled": False,
+        "host": "127.0.0.1",
+        "port": 1883,
+        "client_id": "rx380-watchdog",
+        "username": None,
+        "password": None,
+        "topic_prefix": "rx380",
+        "qos": 1,
+        "batch_interval": 5,
+        "batch_size": 100,
+        "buffer": "disk",
+        "spool_path": str(Path.home() / "rx380_mqtt_spool.sqlite3"),
+        "max_mb": 50,
+        "max_buffered": 100000
+    },
+    "tracing": {
+        # Spans around each pipeline stage, kept in memory (the newest capacity
+        # spans) and written as a Chrome trace on SIGUSR1 or GET /trace; SIGUSR2
+        # turns recording on and off without a restart (see tracing.py).
+        "enabled": False,
+        "capacity": 20000,
+        "folder": str(Path.home() / "rx380_traces")
     },
     "logging": {
         "log_file": "rx380_logger.log",
         "level": "INFO"
     },
+    "rollups": {
+        # min/max/mean/last per 1m/10m/1h/1d bucket, merged into database.rollup_table
+        # (see rollups.py for its CREATE TABLE).
+        "enabled": False,
+        "resolutions": ["1m", "10m", "1h", "1d"],
+        "checkpoint": str(Path.home() / "rx380_rollups.json")
+    },
+    "compression": {
+        # Store only the rows needed to rebuild every field within its tolerance
+        # (swinging door, or "deadband" for step-like fields) in CSV and SQL; see
+        # compression.py. Tolerances are looked up by field, then unit, then default.
+        "enabled": False,
+        "max_gap": 900,
+        "default": {"mode": "swinging_door", "tolerance": 0},
+        "units": {
+            "V": {"tolerance": 1}, "A": {"tolerance": 0.1}, "Hz": {"tolerance": 0.02},
+            "W": {"tolerance": 100}, "VA": {"tolerance": 100}, "VAR": {"tolerance": 100},
+            "kWh": {"tolerance": 0.1}, "kVAh": {"tolerance": 0.1}, "kVARh": {"tolerance": 0.1}
+        },
+        "fields": {
+            "total_power_factor": {"tolerance": 0.005},
+            **{f"voltage_{line}_{end}": {"mode": "deadband", "tolerance": 0}
+               for line in ("l12", "l23", "l31") for end in ("max", "min")}
+        }
+    },
+    "energy": {
+        # Per-interval deltas of the cumulative energy counters, added to every sample.
+        "state": str(Path.home() / "rx380_energy_state.json"),
+        "max_kw": 5000
+    },
+    # Samples kept in memory per meter (8640 = one day at 10 s polling).
+    "recent_samples": 8640,
     "data_save_interval": {
         "minutes": 10
     }
@@ -54,6 +195,34 @@ def setup_logger(cfg):
 logger = setup_logger(config["logging"])
 logger.info("Logger initialized.")
 
+# -------------------------------------------------------------------------------
+# Metrics (served on the HTTP API's /metrics)
+# -------------------------------------------------------------------------------
+MODBUS_SECONDS = REGISTRY.histogram(
+    "rx380_modbus_request_seconds", "Modbus read round trip per register block.", ["port", "slave", "block"])
+MODBUS_ERRORS = REGISTRY.counter(
+    "rx380_modbus_errors_total", "Failed Modbus reads by kind (timeout, crc, exception, other).", ["port", "slave", "kind"])
+CSV_WRITE_SECONDS = REGISTRY.histogram("rx380_csv_write_seconds", "Time to hand one batch to the CSV writer.")
+STORE_SECONDS = REGISTRY.histogram("rx380_store_seconds", "Time to store one batch in every store.")
+STORE_BATCH_SAMPLES = REGISTRY.histogram("rx380_store_batch_samples", "Samples per stored batch.",
+                                         buckets=SIZE_BUCKETS)
+QUEUE_DEPTH = REGISTRY.gauge("rx380_queue_depth", "Items waiting in each queue.", ["queue"])
+POLL_INTERVAL = REGISTRY.gauge("rx380_poll_interval_seconds", "Current adaptive poll interval.", ["meter"])
+
+def error_kind(error):
+    """Metric label of a failed read.
+
+    Only exception responses count as "exception"; lost or refused
+    connections, malformed replies and replies from the wrong slave are "other".
+    """
+    if isinstance(error, ModbusTimeout):
+        return "timeout"
+    if isinstance(error, ModbusCRCError):
+        return "crc"
+    if isinstance(error, ModbusExceptionResponse):
+        return "exception"
+    return "other"
+
 # -------------------------------------------------------------------------------
 # Helper function to compute next save time aligned with the clock
 # -------------------------------------------------------------------------------
@@ -68,159 +237,180 @@ def compute_next_save_time(now, interval_minutes):
 # -------------------------------------------------------------------------------
 class ModbusClient:
     def __init__(self, cfg, logger: logging.Logger):
-        self.port = cfg["port"]
-        self.slave_address = cfg["slave_address"]
-        self.baudrate = cfg["baudrate"]
+        self.slave_address = cfg.get("slave_address", 1)
+        self.baudrate = cfg.get("baudrate", 19200)
         self.logger = logger
-        self.instrument = minimalmodbus.Instrument(self.port, self.slave_address)
-        self.setup_instrument()
-        
-    def setup_instrument(self):
-        self.instrument.serial.baudrate = self.baudrate
-        self.instrument.serial.bytesize = 8
-        self.instrument.serial.parity = minimalmodbus.serial.PARITY_EVEN
-        self.instrument.serial.stopbits = 1
-        self.instrument.serial.timeout = 1
-        self.instrument.mode = minimalmodbus.MODE_RTU
-        self.logger.info("Modbus instrument set up.")
-
-    async def read_scaled_value(self, register_address, scale_factor):
-        try:
-            raw_value = await asyncio.to_thread(
-                self.instrument.read_registers, register_address, 2, functioncode=4
+        if "host" in cfg:
+            self.port = f'{cfg["host"]}:{cfg.get("tcp_port", 502)}'
+            self.transport = ModbusTcpTransport(
+                cfg["host"],
+                cfg.get("tcp_port", 502),
+                timeout=cfg.get("timeout", 1),
+                max_in_flight=cfg.get("max_in_flight", 1),
+                logger=logger
             )
-            value = (raw_value[0] << 16 | raw_value[1]) * scale_factor
-            return value
-        except Exception as e:
-            self.logger.error(f"Error reading register {register_address}: {e}")
-            return None
-        
-    async def read_register(self, register_address, number_of_decimals, signed):
-        """Read a single register value asynchronously."""
-        try:
-            return await asyncio.to_thread(
-                self.instrument.read_register,
-                register_address,
-                number_of_decimals,
-                signed=signed,
-                functioncode=4
+        else:
+            self.port = cfg["port"]
+            self.transport = RtuTransport(
+                self.port,
+                baudrate=self.baudrate,
+                bytesize=cfg.get("bytesize", 8),
+                parity=cfg.get("parity", "E"),
+                stopbits=cfg.get("stopbits", 1),
+                timeout=cfg.get("timeout", 1),
+                logger=logger
+            )
+        self.logger.info(f"Modbus transport set up on {self.port}.")
+        # Keeps each slave's blocks back to back on the wire.
+        self.bus_lock = asyncio.Lock()
+        self.profile = load_profile(cfg.get("profile", DEFAULT_PROFILE), max_gap=cfg.get("max_gap"))
+        self.logger.info(
+            f"{self.profile.model} profile: {len(self.profile.read_plan)} requests "
+            f"for {len(self.profile.field_names)} values."
         )
-        except Exception as e:
-            self.logger.error(f"Error reading register {register_address}: {e}")
-            return None
-        
-    async def read_data(self):
-        """Read all necessary data from RX380."""
-        data = {}
+
+    async def read_block(self, block, slave_address, timeout=None):
+        """Read one block of registers and decode all of its fields."""
+        started = time.perf_counter()
         try:
-            # Read voltages
-            data['voltage_l1'] = await self.read_scaled_value(4034, 0.1)  # V
-            data['voltage_l2'] = await self.read_scaled_value(4036, 0.1)  # V
-            data['voltage_l3'] = await self.read_scaled_value(4038, 0.1)  # V
-            data['voltage_l12'] = await self.read_scaled_value(4028, 0.1)  # V
-            data['voltage_l23'] = await self.read_scaled_value(4030, 0.1)  # V
-            data['voltage_l31'] = await self.read_scaled_value(4032, 0.1)  # V
-
-            # Read max voltages
-            data['voltage_l12_max'] = await self.read_scaled_value(4124, 0.1)  # V
-            data['voltage_l23_max'] = await self.read_scaled_value(4128, 0.1)  # V
-            data['voltage_l31_max'] = await self.read_scaled_value(4132, 0.1)  # V
-
-            # Read min voltages
-            data['voltage_l12_min'] = await self.read_scaled_value(4212, 0.1)  # V
-            data['voltage_l23_min'] = await self.read_scaled_value(4216, 0.1)  # V
-            data['voltage_l31_min'] = await self.read_scaled_value(4220, 0.1)  # V
-
-            # Read current
-            data['current_l1'] = await self.read_scaled_value(4020, 0.001)  # A
-            data['current_l2'] = await self.read_scaled_value(4022, 0.001)  # A
-            data['current_l3'] = await self.read_scaled_value(4024, 0.001)  # A
-            data['current_ln'] = await self.read_scaled_value(4026, 0.001)  # A
-
-            # Read power
-            data['total_real_power'] = await self.read_scaled_value(4012, 1)  # W
-            data['total_apparent_power'] = await self.read_scaled_value(4014, 1)  # VA
-            data['total_reactive_power'] = await self.read_scaled_value(4016, 1)  # VAR
-
-            # Read power factor and frequency
-            data['total_power_factor'] = await self.read_register(4018, 3, True)
-            data['frequency'] = await self.read_register(4019, 2, False)  # Hz
-
-            # Read energy
-            data['total_real_energy'] = await self.read_scaled_value(4002, 1)  # kWh
-            data['total_reactive_energy'] = await self.read_scaled_value(4010, 1)  # kVARh
-            data['total_apparent_energy'] = await self.read_scaled_value(4006, 1)  # kVAh
-
-            return data
+            with TRACER.span("modbus_read", slave=slave_address, block=block.start):
+                payload = await self.transport.read_registers(
+                    slave_address, block.start, block.count, self.profile.function_code, timeout
+                )
         except Exception as e:
-            self.logger.error(f"Error reading data: {e}")
-            return None
+            MODBUS_ERRORS.labels(self.port, slave_address, error_kind(e)).inc()
+            raise
+        MODBUS_SECONDS.labels(self.port, slave_address, block.start).observe(time.perf_counter() - started)
+        with TRACER.span("decode", block=block.start):
+            return block.decode(payload)
+
+    async def read_data(self, slave_address=None, timeout=None):
+        """Read all necessary data from one RX380 on the bus.
+
+        Returns None if the slave does not answer the first request, so a dead
+        slave costs a single timeout.
+        """
+        slave_address = slave_address or self.slave_address
+        data = dict.fromkeys(self.profile.field_names)
+        if self.transport.pipelined:
+            return await self.read_data_pipelined(slave_address, timeout, data)
+        async with self.bus_lock:
+            answered = False
+            for block in self.profile.read_plan:
+                try:
+                    data.update(await self.read_block(block, slave_address, timeout))
+                    answered = True
+                except Exception as e:
+                    self.logger.error(
+                        f"Error reading registers {block.start}-{block.end - 1} "
+                        f"from slave {slave_address}: {e}"
+                    )
+                    if not answered:
+                        return None
+        return data
+
+    async def read_data_pipelined(self, slave_address, timeout, data):
+        """Issue every block at once; the transport bounds how many are in flight."""
+        results = await asyncio.gather(
+            *(self.read_block(block, slave_address, timeout) for block in self.profile.read_plan),
+            return_exceptions=True
+        )
+        answered = False
+        for block, result in zip(self.profile.read_plan, results):
+            if isinstance(result, Exception):
+                self.logger.error(
+                    f"Error reading registers {block.start}-{block.end - 1} "
+                    f"from slave {slave_address}: {result}"
+                )
+            else:
+                data.update(result)
+                answered = True
+        return data if answered else None
 
 # -------------------------------------------------------------------------------
 # SQL Data Manager Module
 # -------------------------------------------------------------------------------
+# Keys of the database section that are ours rather than pymssql.connect's
+SQL_SETTINGS = ("table_name", "pool_size", "checkout_timeout", "health_check_interval", "batch_size",
+                "rollup_table", "meter_column", "energy_delta_columns")
+
 class SQLDataManager:
-    def __init__(self, db_config, logger: logging.Logger):
-        self.db_config = db_config
+    def __init__(self, db_config, logger: logging.Logger, meter_tables=None, pool=None):
+        self.table_name = db_config.get("table_name", "Office_Readings")
+        self.db_config = {k: v for k, v in db_config.items() if k not in SQL_SETTINGS}
+        self.meter_tables = meter_tables or {}
         self.logger = logger
-        
-    async def save_to_sql(self, data_buffer):
-        insert_query = """
-        INSERT INTO Office_Readings 
-           (Timestamp, VoltageL1_v, VoltageL2_v, VoltageL3_v, 
-            VoltageL12_v, VoltageL23_v, VoltageL31_v,
-            VoltageL12_maxv, VoltageL23_maxv, VoltageL31_maxv,
-            VoltageL12_minv, VoltageL23_minv, VoltageL31_minv,
-            CurrentL1_I, CurrentL2_I, CurrentL3_I, CurrentLn_I,
-            TotalRealPower, TotalApparentPower, TotalReactivePower,
-            TotalPowerFactor, Frequency,
-            TotalRealEnergy, TotalReactiveEnergy, TotalApparentEnergy)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        self.pool = pool or ConnectionPool(
+            functools.partial(pymssql.connect, **self.db_config),
+            size=db_config.get("pool_size", 2),
+            checkout_timeout=db_config.get("checkout_timeout", 10),
+            health_check_interval=db_config.get("health_check_interval", 60),
+            logger=logger
+        )
+        columns = (SQL_COLUMNS + (METER_COLUMNS if db_config.get("meter_column") else [])
+                   + (ENERGY_DELTA_COLUMNS if db_config.get("energy_delta_columns") else []))
+        self.bulk = BulkWriter(columns, batch_size=db_config.get("batch_size", 500))
+        self.rollup_table = db_config.get("rollup_table", "Rollups")
+        self.merge = MergeWriter(ROLLUP_COLUMNS, ROLLUP_KEYS, batch_size=db_config.get("batch_size", 500))
+
+    # Server errors caused by the values of a row: conversion (241, 242, 245,
+    # 8114), arithmetic overflow (8115), truncation (8152, 2628), NULL in a
+    # NOT NULL column (515), constraint and duplicate key (547, 2601, 2627).
+    ROW_ERRORS = {241, 242, 245, 515, 547, 2601, 2627, 2628, 8114, 8115, 8152}
+
+    def rejected(self, error):
+        """Whether SQL Server refused the rows for their values, so resending them cannot help.
+
+        Anything else (lost connections, failed logins, missing permissions,
+        a missing table or column, an offline database) is an outage of the
+        whole stream and is retried instead.
         """
+        if isinstance(error, (pymssql.IntegrityError, pymssql.DataError)):
+            return True
+        number = error.args[0] if isinstance(error, pymssql.DatabaseError) and error.args else None
+        return number in self.ROW_ERRORS
+
+    def samples_by_table(self, data_buffer):
+        # Each meter may log to its own table.
+        tables = {}
+        for data in data_buffer:
+            table = self.meter_tables.get(data.get('meter'), self.table_name)
+            tables.setdefault(table, []).append(data)
+        return tables
+
+    def write_batch(self, conn, data_buffer):
+        cursor = conn.cursor()
         try:
-            conn = await asyncio.to_thread(pymssql.connect, **self.db_config)
-            cursor = conn.cursor()
-            rows = []
-            for data in data_buffer:
-                rows.append((
-                    data['timestamp'],
-                    data.get('voltage_l1'),
-                    data.get('voltage_l2'),
-                    data.get('voltage_l3'),
-                    data.get('voltage_l12'),
-                    data.get('voltage_l23'),
-                    data.get('voltage_l31'),
-                    data.get('voltage_l12_max'),
-                    data.get('voltage_l23_max'),
-                    data.get('voltage_l31_max'),
-                    data.get('voltage_l12_min'),
-                    data.get('voltage_l23_min'),
-                    data.get('voltage_l31_min'),
-                    data.get('current_l1'),
-                    data.get('current_l2'),
-                    data.get('current_l3'),
-                    data.get('current_ln'),
-                    data.get('total_real_power'),
-                    data.get('total_apparent_power'),
-                    data.get('total_reactive_power'),
-                    data.get('total_power_factor'),
-                    data.get('frequency'),
-                    data.get('total_real_energy'),
-                    data.get('total_reactive_energy'),
-                    data.get('total_apparent_energy')
-                ))
-            await asyncio.to_thread(cursor.executemany, insert_query, rows)
-            await asyncio.to_thread(conn.commit)
+            for table, samples in self.samples_by_table(data_buffer).items():
+                self.bulk.insert(cursor, table, self.bulk.rows(samples))
+            conn.commit()
+        finally:
+            cursor.close()
+
+    async def insert_rows(self, data_buffer):
+        """Insert samples in one transaction; raises on failure."""
+        async with self.pool.connection() as conn:
+            await asyncio.to_thread(self.write_batch, conn, data_buffer)
+
+    def write_rollups(self, conn, rows):
+        cursor = conn.cursor()
+        try:
+            self.merge.upsert(cursor, self.rollup_table, rows)
+            conn.commit()
+        finally:
+            cursor.close()
+
+    async def merge_rollups(self, rows):
+        """Upsert rollup rows (ordered like ROLLUP_COLUMNS); raises on failure."""
+        async with self.pool.connection() as conn:
+            await asyncio.to_thread(self.write_rollups, conn, rows)
+
+    async def save_to_sql(self, data_buffer):
+        try:
+            await self.insert_rows(data_buffer)
             self.logger.info(f"Inserted {len(data_buffer)} SQL records.")
         except Exception as e:
             self.logger.error(f"SQL insert error: {e}")
-            if 'conn' in locals():
-                await asyncio.to_thread(conn.rollback)
-        finally:
-            if 'cursor' in locals():
-                await asyncio.to_thread(cursor.close)
-            if 'conn' in locals():
-                await asyncio.to_thread(conn.close)
 
 # -------------------------------------------------------------------------------
 # CSV Data Manager Module
@@ -230,54 +420,243 @@ class CSVDataManager:
         self.folder_path = Path(csv_config.get("log_folder", "."))
         self.folder_path.mkdir(parents=True, exist_ok=True)
         self.logger = logger
-        
-    def get_filename(self, extension="csv"):
-        today = datetime.now().strftime("%Y-%m-%d")
-        return self.folder_path / f"rx380_data_{today}.{extension}"
+        self.writer = DailyCsvWriter(
+            self.folder_path,
+            flush_rows=csv_config.get("flush_rows", 100),
+            flush_interval=csv_config.get("flush_interval", 5),
+            fsync=csv_config.get("fsync", False),
+            logger=logger
+        )
         
     async def save_to_csv(self, data):
-        filename = self.get_filename()
-        file_exists = filename.is_file()
-        async with aiofiles.open(filename, 'a', newline='') as csvfile:
-            if not file_exists:
-                header = ['timestamp'] + list(data.keys())
-                header = list(dict.fromkeys(header))  # Remove duplicates if any
-                await csvfile.write(','.join(header) + '\n')
-            # Construct the row based on the header
-            header = ['timestamp'] + list(data.keys())
-            header = list(dict.fromkeys(header))
-            row = ','.join(str(data.get(field, "")) for field in header) + '\n'
-            await csvfile.write(row)
-        self.logger.info(f"Data written to CSV: {filename}")
+        await self.save_batch_to_csv([data])
+
+    async def save_batch_to_csv(self, samples):
+        with CSV_WRITE_SECONDS.time():
+            await asyncio.to_thread(TRACER.wrap("csv_write", self.writer.write), samples)
+        self.logger.info(f"{len(samples)} rows written to CSV: {self.writer.path}")
+
+    async def flush_periodically(self):
+        """Push buffered rows out even when no new samples arrive."""
+        while True:
+            await asyncio.sleep(self.writer.flush_interval)
+            await asyncio.to_thread(self.writer.flush_if_due)
+
+    def close(self):
+        self.writer.close()
 
 # -------------------------------------------------------------------------------
 # Main Application Loop
 # -------------------------------------------------------------------------------
+async def store_samples(pipeline, spool, csv_manager, energy, sinks=(), compressor=None):
+    """Save whatever the acquisition has queued, batch by batch.
+
+    Energy deltas are added first so every store gets them. SQL-bound rows
+    go to the durable spool; the SpoolForwarder inserts them. With a
+    ``compressor`` only the rows it keeps go to SQL and CSV. ``sinks`` are
+    extra local stores with a blocking ``write(samples)``; they get every
+    sample.
+    """
+    while True:
+        samples = await next_batch(pipeline)
+        started = time.perf_counter()
+        span = TRACER.span("store_batch")
+        if TRACER.enabled:
+            span.set(samples=[sample_id(sample) for sample in samples])
+        try:
+            with span:
+                await asyncio.to_thread(TRACER.wrap("energy", energy.process), samples)
+                stored = (await asyncio.to_thread(TRACER.wrap("compress", compressor.compress), samples)
+                          if compressor else samples)
+                await asyncio.gather(
+                    *((spool.append(stored), csv_manager.save_batch_to_csv(stored)) if stored else ()),
+                    *(asyncio.to_thread(TRACER.wrap(f"sink:{type(sink).__name__}", sink.write), samples)
+                      for sink in sinks)
+                )
+            if compressor:
+                logger.info(f"Data saved at {samples[-1]['timestamp']}; {len(stored)} rows stored for "
+                            f"{len(samples)} samples ({compressor.ratio():.1f}x overall).")
+            else:
+                logger.info(f"Data saved at {samples[-1]['timestamp']}")
+            STORE_SECONDS.observe(time.perf_counter() - started)
+            STORE_BATCH_SAMPLES.observe(len(samples))
+        except Exception as e:
+            logger.error(f"Error saving data: {e}")
+
+async def log_poll_intervals(acquisition, interval_minutes):
+    """Adaptive mode: log every meter's poll interval once per save interval."""
+    while True:
+        now = datetime.now()
+        await asyncio.sleep((compute_next_save_time(now, interval_minutes) - now).total_seconds())
+        intervals = ", ".join(f"{name}={interval:g}s"
+                              for name, interval in acquisition.poll_intervals().items())
+        logger.info(f"Poll intervals: {intervals}")
+
+
+async def commit_archive_periodically(archive, interval=60):
+    """Close out each hour's part file even if no new samples arrive."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(archive.commit_if_due)
+        except Exception as e:
+            logger.error(f"Error writing Parquet archive: {e}")
+
 async def main():
-    modbus_client = ModbusClient(config["modbus"], logger)
-    sql_manager = SQLDataManager(config["database"], logger)
+    buses = []
+    meter_tables = {}
+    for port_cfg in port_configs(config["modbus"]):
+        modbus_client = ModbusClient(port_cfg, logger)
+        buses.append(BusScheduler(modbus_client, port_cfg, logger))
+        for slave in port_cfg.get("slaves", []):
+            if "table_name" in slave:
+                meter_tables[slave_name(slave)] = slave["table_name"]
+    names = [slave.name for bus in buses for slave in bus.slaves]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        # Every store keys samples by meter name.
+        raise ValueError(f"Meter names must be unique; name these slaves apart: {', '.join(duplicates)}")
+    if not config["database"].get("meter_column"):
+        default_table = config["database"].get("table_name", "Office_Readings")
+        tables = [meter_tables.get(name, default_table) for name in names]
+        shared = sorted({table for table in tables if tables.count(table) > 1})
+        if shared:
+            logger.warning(f"Several meters write to {', '.join(shared)} without database.meter_column; "
+                           f"their rows cannot be told apart and rows with the same timestamp are skipped.")
+    pipeline = asyncio.Queue()
+    acquisition = Acquisition(buses, pipeline, logger)
+    sql_manager = SQLDataManager(config["database"], logger, meter_tables)
     csv_manager = CSVDataManager(config["csv"], logger)
+    spool_cfg = config["spool"]
+    spool = SqlSpool(spool_cfg["path"], spool_cfg.get("max_mb", 200) * 1024 * 1024, logger)
+    forwarder = SpoolForwarder(
+        spool, sql_manager, logger,
+        batch_size=spool_cfg.get("batch_size", 500),
+        max_rows_per_second=spool_cfg.get("max_rows_per_second", 2000),
+        retry_interval=spool_cfg.get("retry_interval", 30),
+        rejected=sql_manager.rejected
+    )
+    archive = None
+    archive_cfg = config.get("archive", {})
+    if archive_cfg.get("enabled"):
+        from parquet_archive import ParquetArchive, archive_schema
+        archive = ParquetArchive(
+            archive_cfg.get("folder", config["csv"]["log_folder"]),
+            archive_schema(bus.client.profile for bus in buses),
+            compression=archive_cfg.get("compression", "zstd"),
+            logger=logger
+        )
+    history = None
+    if config.get("history", {}).get("enabled"):
+        history = SampleLogStore(config["history"]["folder"], [bus.client.profile for bus in buses], logger)
+    recent = RecentSamples(record_dtype(bus.client.profile for bus in buses), config.get("recent_samples", 8640))
+    rollups = None
+    rollup_cfg = config.get("rollups", {})
+    if rollup_cfg.get("enabled"):
+        rollups = RollupEngine(
+            dict.fromkeys(name for bus in buses for name in bus.client.profile.output_fields),
+            rollup_cfg["checkpoint"],
+            {name: RESOLUTIONS[name] for name in rollup_cfg.get("resolutions", RESOLUTIONS)},
+            logger=logger
+        )
+    live = None
+    api_cfg = config.get("http_api", {})
+    if api_cfg.get("enabled") and api_cfg.get("stream", True):
+        live = LiveStream(
+            recent.fields.names[1:],
+            max_queued=api_cfg.get("stream_queue", 100),
+            conflate=api_cfg.get("conflate", True),
+            logger=logger
+        )
+        if rollups:
+            rollups.listeners.append(live.write_rollups)
+    mqtt = None
+    if config.get("mqtt", {}).get("enabled"):
+        mqtt = MqttPublisher(config["mqtt"], logger)
+    sinks = [sink for sink in (recent, archive, history, rollups, live, mqtt) if sink]
+    energy_cfg = config.get("energy", {})
+    energy = EnergyDeltas(
+        {name: wrap for bus in buses for name, wrap in bus.client.profile.counters.items()},
+        energy_cfg.get("state", Path.home() / "rx380_energy_state.json"),
+        max_kw=energy_cfg.get("max_kw", 5000),
+        logger=logger
+    )
+    compressor = None
+    compression_cfg = config.get("compression", {})
+    if compression_cfg.get("enabled"):
+        profiles = [bus.client.profile for bus in buses]
+        compressor = Compressor(
+            dict.fromkeys(name for profile in profiles for name in profile.output_fields),
+            compression_cfg,
+            units={name: unit for profile in profiles for name, unit in profile.units.items()},
+            sum_fields=dict.fromkeys(name for profile in profiles for name in profile.delta_fields),
+            logger=logger
+        )
+    tracing_cfg = config.get("tracing", {})
+    if tracing_cfg.get("enabled"):
+        TRACER.enable(tracing_cfg.get("capacity", 20000))
+    install_signal_handlers(TRACER, tracing_cfg.get("folder", Path.home() / "rx380_traces"), logger)
+    api = None
+    if api_cfg.get("enabled"):
+        api = QueryApi(recent, history, api_cfg.get("host", "127.0.0.1"), api_cfg.get("port", 8380),
+                       live=live, allow_origin=api_cfg.get("allow_origin"),
+                       metrics=REGISTRY if api_cfg.get("metrics", True) else None,
+                       tracer=TRACER, logger=logger)
+        await api.start()
+    background_tasks = [
+        asyncio.create_task(store_samples(pipeline, spool, csv_manager, energy, sinks, compressor),
+                            name="store_samples"),
+        asyncio.create_task(forwarder.run(), name="sql_forwarder"),
+        asyncio.create_task(csv_manager.flush_periodically())
+    ]
+    if archive:
+        background_tasks.append(asyncio.create_task(commit_archive_periodically(archive)))
+    if rollups:
+        background_tasks.append(asyncio.create_task(forward_rollups(rollups, sql_manager, logger)))
+    if mqtt:
+        background_tasks.append(asyncio.create_task(mqtt.run()))
+    if api and api.metrics:
+        queues = {"pipeline": pipeline.qsize, "sql_spool": spool.__len__}
+        if mqtt:
+            queues["mqtt"] = mqtt.queue.__len__
+        if rollups:
+            queues["rollups"] = lambda: len(rollups.queue)
+        if live:
+            queues["stream_subscribers"] = lambda: len(live.subscribers)
+        QUEUE_DEPTH.set_function(lambda: {(name,): depth() for name, depth in queues.items()})
+        POLL_INTERVAL.set_function(
+            lambda: {(name,): interval for name, interval in acquisition.poll_intervals().items()})
+        background_tasks.append(asyncio.create_task(monitor_loop_lag()))
     
     data_interval = config.get("data_save_interval", {}).get("minutes", 10)
-    next_save_time = compute_next_save_time(datetime.now(), data_interval)
-    logger.info(f"Next data save scheduled at {next_save_time}")
+    adaptive = any(bus.adaptive for bus in buses)
+    if adaptive and not all(bus.adaptive for bus in buses):
+        raise ValueError("Adaptive polling must be enabled on every port or none.")
+    if adaptive:
+        logger.info("Adaptive polling enabled.")
+        background_tasks.append(asyncio.create_task(log_poll_intervals(acquisition, data_interval)))
     
-    while True:
-        now = datetime.now()
-        wait_time = (next_save_time - now).total_seconds()
-        if wait_time > 0:
-            await asyncio.sleep(wait_time)
-        data = await modbus_client.read_data()
-        if data:
-            data['timestamp'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            logger.info("Data successfully read from Modbus.")
-            await asyncio.gather(
-                sql_manager.save_to_sql([data]),
-                csv_manager.save_to_csv(data)
-            )
-            logger.info(f"Data saved at {data['timestamp']}")
-        next_save_time = compute_next_save_time(datetime.now(), data_interval)
-        logger.info(f"Next data save scheduled at {next_save_time}")
+    try:
+        await acquisition.run(lambda now: compute_next_save_time(now, data_interval))
+    finally:
+        if api:
+            await api.close()
+        if mqtt:
+            await mqtt.close()
+        if compressor:
+            # The newest sample of each meter is held until the next one arrives.
+            held = compressor.flush()
+            if held:
+                csv_manager.writer.write(held)
+                await spool.append(held)
+        csv_manager.close()
+        energy.close()
+        if archive:
+            archive.close()
+        if history:
+            history.close()
+        if rollups:
+            rollups.close()
 
 if __name__ == "__main__":
     try:
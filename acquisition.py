@@ -0,0 +1,83 @@
+import asyncio
+import logging
+from datetime import datetime
+
+
+def port_configs(cfg):
+    """Split the modbus section into one config per serial port.
+
+    Entries in ``modbus.ports`` inherit every other key of the modbus section,
+    so shared settings (profile, schedule, timeout) only need to be given once.
+    Without ``ports`` the section itself describes a single port.
+    """
+    shared = {key: value for key, value in cfg.items() if key != "ports"}
+    return [{**shared, **entry} for entry in cfg.get("ports") or [{}]]
+
+
+class Acquisition:
+    """Polls every port's bus in its own task and feeds one shared sample queue.
+
+    Each port has its own transport, lock and schedule, so a port stuck in
+    timeouts only delays its own samples; the other ports keep polling on
+    time. Samples from one port are queued in the order they were read.
+    """
+
+    def __init__(self, buses, pipeline: asyncio.Queue, logger: logging.Logger):
+        self.buses = buses
+        self.pipeline = pipeline
+        self.logger = logger
+
+    async def poll_port(self, bus):
+        try:
+            samples = await bus.poll_cycle()
+        except Exception as e:
+            self.logger.error(f"Error polling port {bus.client.port}: {e}")
+            return 0
+        for sample in samples:
+            await self.pipeline.put(sample)
+        return len(samples)
+
+    async def run_port(self, bus, next_poll_time):
+        """Poll one port until cancelled.
+
+        An adaptive port polls as soon as one of its slaves is due; a fixed
+        one at ``next_poll_time(now)``. A cycle that overruns its slot moves
+        on to the next slot instead of queueing up behind it.
+        """
+        if bus.adaptive:
+            while True:
+                await self.poll_port(bus)
+                await asyncio.sleep(max(bus.seconds_until_due(), 0.05))
+        next_time = next_poll_time(datetime.now())
+        while True:
+            wait_time = (next_time - datetime.now()).total_seconds()
+            if wait_time > 0:
+                await asyncio.sleep(wait_time)
+            count = await self.poll_port(bus)
+            if count:
+                self.logger.info(f"Data successfully read from {count} meter(s) on {bus.client.port}.")
+            next_time = next_poll_time(datetime.now())
+            self.logger.info(f"Next poll of {bus.client.port} scheduled at {next_time}")
+
+    async def run(self, next_poll_time):
+        """Run one polling task per port until cancelled."""
+        tasks = [asyncio.create_task(self.run_port(bus, next_poll_time), name=f"poll {bus.client.port}")
+                 for bus in self.buses]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def poll_intervals(self):
+        """Current adaptive poll interval per meter (None in fixed mode)."""
+        return {slave.name: slave.adaptive.interval if slave.adaptive else None
+                for bus in self.buses for slave in bus.slaves}
+
+
+async def next_batch(pipeline: asyncio.Queue):
+    """Wait for at least one sample, then take everything already queued."""
+    batch = [await pipeline.get()]
+    while not pipeline.empty():
+        batch.append(pipeline.get_nowait())
+    return batch
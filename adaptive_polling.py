@@ -0,0 +1,59 @@
+"""Per-meter poll intervals that follow how fast the load is changing.
+
+Each signal has a ``rate`` (units per second) and a ``deadband`` (units).
+When any of them moved by more than its deadband, faster than its rate,
+since the meter's previous sample, the meter's interval is halved toward
+``min_interval``; otherwise it grows by ``relax`` toward ``max_interval``.
+The deadband keeps ordinary measurement noise, which looks fast over a
+one-second interval, from pinning a steady meter at the floor.
+"""
+import logging
+
+# Reasonable defaults for an RX380 on a building feeder.
+DEFAULT_SIGNALS = {
+    "total_real_power": {"rate": 50.0, "deadband": 500.0},  # W
+    "current_l1": {"rate": 0.1, "deadband": 1.0},  # A
+    "current_l2": {"rate": 0.1, "deadband": 1.0},
+    "current_l3": {"rate": 0.1, "deadband": 1.0},
+}
+
+
+class AdaptiveInterval:
+    """Poll interval for one meter, updated from each new sample."""
+
+    def __init__(self, cfg, name="", logger: logging.Logger = None):
+        self.name = name
+        self.min_interval = cfg.get("min_interval", 1)
+        self.max_interval = cfg.get("max_interval", 60)
+        self.relax = cfg.get("relax", 1.25)
+        self.signals = cfg.get("signals", DEFAULT_SIGNALS)
+        self.logger = logger or logging.getLogger(__name__)
+        self.interval = self.min_interval  # start fast, relax once the load looks steady
+        self.previous = None  # (monotonic time, sample) of the last update
+        self.changing = []  # signals that triggered the last speed-up
+
+    def update(self, sample, now):
+        """Feed a new sample taken at monotonic time ``now``; returns the new interval."""
+        previous, self.previous = self.previous, (now, sample)
+        if previous is None:
+            return self.interval
+        then, before = previous
+        elapsed = max(now - then, 1e-3)
+        self.changing = []
+        for name, limits in self.signals.items():
+            old, new = before.get(name), sample.get(name)
+            if old is None or new is None:
+                continue
+            change = abs(new - old)
+            if change > limits.get("deadband", 0) and change / elapsed > limits["rate"]:
+                self.changing.append(name)
+        old_interval = self.interval
+        if self.changing:
+            self.interval = max(self.min_interval, self.interval / 2)
+        else:
+            self.interval = min(self.max_interval, self.interval * self.relax)
+        if self.interval == self.min_interval < old_interval:
+            self.logger.info(f"{self.name}: {', '.join(self.changing)} changing fast; polling every {self.interval:g}s.")
+        elif self.interval == self.max_interval > old_interval:
+            self.logger.info(f"{self.name}: steady; polling every {self.interval:g}s.")
+        return self.interval
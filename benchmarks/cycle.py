@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""Cycle time, CPU and memory of each watchdog version against simulated meters.
+
+Every run polls N simulated RX380s on one RS485 line and stores the samples
+in CSV and in a local SQL stand-in (SQLite, see sql_standin.py) the way that
+version does, so no meter or SQL Server is needed:
+
+    python3 benchmarks/cycle.py                       # every version, 1/8/32 meters
+    python3 benchmarks/cycle.py --versions 1.56 1.62 --meters 8 --cycles 50
+    python3 benchmarks/cycle.py --compare             # stored results side by side
+
+The meters are served by meter_simulator.py on a pseudo-terminal in its own
+process (``--baud 19200`` adds the time the frames would take on the wire;
+the default 0 measures the software alone). ``1.62-tcp`` polls the same
+meters through the simulator's Modbus TCP gateway instead. Each version and meter count
+runs in a fresh interpreter, so its peak RSS is its own. Cycles run back to
+back: samples/s is the throughput ceiling, not the polling rate.
+
+Results are appended to benchmarks/results.jsonl with the git commit and
+host they were measured on; --compare shows the newest run per version and
+meter count. Versions before 1.62 read one meter per minimalmodbus
+instrument, register by register; 1.6 and 1.61 only read three voltages, so
+read their cpu/sample against the ``fields`` column.
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+BENCHMARKS = Path(__file__).resolve().parent
+ROOT = BENCHMARKS.parent
+RESULTS = BENCHMARKS / "results.jsonl"
+
+VERSIONS = {
+    "1.5": "Rx380_watchdog_1.5.py",
+    "1.56": "Rx380_watchdog_v1.56.py",
+    "1.6": "Rx380_Watchdog_v1.6.py",
+    "1.61": "Rx380_watchdog_v1.61.py",
+    "1.62": "Rx_380_watchdog_v1.62.py",
+    "1.62-tcp": "Rx_380_watchdog_v1.62.py",  # the same meters behind a Modbus TCP gateway
+}
+
+# (result key, heading, format)
+COLUMNS = [("version", "version", "<8"), ("meters", "meters", ">6d"), ("fields", "fields", ">6d"),
+           ("samples_per_s", "samples/s", ">10.1f"), ("p50_ms", "p50 ms", ">8.2f"),
+           ("p99_ms", "p99 ms", ">8.2f"), ("cpu_ms_per_sample", "cpu ms/sample", ">13.3f"),
+           ("peak_rss_mb", "rss MB", ">7.1f"), ("errors", "errors", ">6d")]
+
+
+def load(version):
+    path = ROOT / VERSIONS[version]
+    if path.is_dir():
+        sys.path.insert(0, str(path))
+        return None
+    spec = importlib.util.spec_from_file_location(f"watchdog_{version.replace('.', '_')}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def timestamp():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+# -- one cycle per version: read every meter, then store what it read ---------
+
+def rx380_cycle(module, port, slaves, store):
+    """1.5 and 1.56: one RX380 instance per meter."""
+    meters = [module.RX380(port, address) for address in slaves]
+
+    async def cycle():
+        samples = []
+        for meter in meters:
+            data = await meter.read_data()
+            if data:
+                data['timestamp'] = timestamp()
+                samples.append(data)
+        await store(samples)
+        return samples
+    return cycle
+
+
+def bench_1_5(module, port, slaves, folder):
+    async def store(samples):
+        if samples:
+            await module.save_to_csv(samples, folder)
+    return rx380_cycle(module, port, slaves, store)
+
+
+def bench_1_56(module, port, slaves, folder):
+    manager = module.DataManager()
+
+    async def store(samples):
+        for data in samples:
+            await manager.save_to_sql([data])
+            await module.save_to_csv(data, folder)
+    return rx380_cycle(module, port, slaves, store)
+
+
+def bench_1_61(module, port, slaves, folder):
+    """1.6 and 1.61: ModbusClient per meter, SQL and CSV managers."""
+    if module is None:
+        from data_storage import CSVDataManager, SQLDataManager
+        from modbus_client import ModbusClient
+    else:
+        ModbusClient, SQLDataManager, CSVDataManager = (
+            module.ModbusClient, module.SQLDataManager, module.CSVDataManager)
+    logger = logging.getLogger()
+    clients = [ModbusClient({"port": port, "slave_address": address, "baudrate": 19200}, logger)
+               for address in slaves]
+    sql_manager = SQLDataManager({}, logger)
+    csv_manager = CSVDataManager({"log_folder": str(folder)}, logger)
+
+    async def cycle():
+        samples = []
+        for client in clients:
+            data = await client.read_data()
+            if data:
+                data['timestamp'] = timestamp()
+                samples.append(data)
+                await asyncio.gather(sql_manager.save_to_sql([data]), csv_manager.save_to_csv(data))
+        return samples
+    return cycle
+
+
+def bench_1_62(module, port, slaves, folder, tcp_port=None):
+    port_cfg = {"baudrate": 19200, "parity": "N", "timeout": 1,
+                "slaves": [{"address": address, "name": f"meter{address}"} for address in slaves]}
+    if tcp_port:
+        port_cfg.update(host="127.0.0.1", tcp_port=tcp_port, max_in_flight=4)
+    else:
+        port_cfg["port"] = port
+    logger = module.logger
+    bus = module.BusScheduler(module.ModbusClient(port_cfg, logger), port_cfg, logger)
+    sql_manager = module.SQLDataManager({"table_name": "Office_Readings"}, logger)
+    csv_manager = module.CSVDataManager({"log_folder": str(folder)}, logger)
+
+    async def cycle():
+        samples = await bus.poll_cycle()
+        if samples:
+            await asyncio.gather(csv_manager.save_batch_to_csv(samples), sql_manager.insert_rows(samples))
+        return samples
+    return cycle
+
+
+BENCHES = {"1.5": bench_1_5, "1.56": bench_1_56, "1.6": bench_1_61, "1.61": bench_1_61,
+           "1.62": bench_1_62, "1.62-tcp": bench_1_62}
+
+
+async def measure(version, meters, cycles, port, tcp_port, folder):
+    slaves = list(range(1, meters + 1))
+    module = load(version)
+    bench = BENCHES[version]
+    cycle = bench(module, port, slaves, folder, tcp_port) if tcp_port else bench(module, port, slaves, folder)
+    async def checked_cycle():
+        try:
+            return await cycle()
+        except Exception:
+            # Counted as errors; the traceback ends up in the run's stderr.log.
+            logging.exception(f"{version} cycle failed")
+            return []
+
+    first = await checked_cycle()  # opens the port, files and table
+    latencies, samples, complete = [], 0, 0
+    cpu, started = time.process_time(), time.perf_counter()
+    for _ in range(cycles):
+        begun = time.perf_counter()
+        read = await checked_cycle()
+        latencies.append(time.perf_counter() - begun)
+        samples += len(read)
+        complete += sum(1 for sample in read if None not in sample.values())
+    elapsed, cpu = time.perf_counter() - started, time.process_time() - cpu
+    quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "version": version,
+        "meters": meters,
+        "cycles": cycles,
+        "fields": len(first[0]) - 1 if first else None,
+        "samples": samples,
+        "errors": meters * cycles - complete,  # samples lost or with unread fields
+        "samples_per_s": samples / elapsed,
+        "p50_ms": quantiles[49] * 1000,
+        "p99_ms": quantiles[98] * 1000,
+        "cpu_ms_per_sample": cpu / samples * 1000 if samples else None,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def run_one(args):
+    """Child process: measure one version against the simulator and print JSON."""
+    os.chdir(args.workdir)  # older versions log to and read config.json from the cwd
+    sys.path.insert(0, str(ROOT))
+    sys.path.insert(0, str(BENCHMARKS))
+    import serial
+    import sql_standin
+    sys.modules["pymssql"] = sql_standin
+    sql_standin.DATABASE = str(Path(args.workdir) / "sql_standin.sqlite3")
+    # A pseudo-terminal has no parity bit; the older versions hard-code even parity.
+    serial.PARITY_EVEN = serial.PARITY_NONE
+    tcp_port = args.tcp_port if args.run.endswith("-tcp") else None
+    result = asyncio.run(measure(args.run, args.meters[0], args.cycles, args.device, tcp_port,
+                                 Path(args.workdir) / "csv"))
+    print(json.dumps(result))
+
+
+def start_simulator(meters, baud, tcp_port=None):
+    command = [sys.executable, str(ROOT / "meter_simulator.py"),
+               "--slaves", *map(str, range(1, meters + 1))]
+    if tcp_port:
+        command += ["--port", str(tcp_port), "--concurrent"]
+    else:
+        command += ["--rtu", "--baud", str(baud)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True, cwd=ROOT)
+    line = process.stdout.readline()
+    if not line:
+        raise RuntimeError("meter_simulator.py did not start")
+    return process, line.rsplit(" on ", 1)[1].strip()
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_all(args):
+    context = {"commit": git_commit(), "host": platform.node(), "machine": platform.machine(),
+               "python": platform.python_version(), "baud": args.baud,
+               "date": datetime.now().isoformat(timespec="seconds")}
+    print_header()
+    for version in args.versions:
+        for meters in args.meters:
+            tcp_port = args.tcp_port if version.endswith("-tcp") else None
+            simulator, device = start_simulator(meters, args.baud, tcp_port)
+            workdir = tempfile.mkdtemp(prefix="rx380_bench_")
+            try:
+                shutil.copy(ROOT / "config.json", workdir)
+                with open(Path(workdir) / "stderr.log", "w") as stderr:
+                    child = subprocess.run(
+                        [sys.executable, __file__, "--run", version, "--meters", str(meters),
+                         "--cycles", str(args.cycles), "--device", device, "--workdir", workdir,
+                         *(["--tcp-port", str(tcp_port)] if tcp_port else [])],
+                        stdout=subprocess.PIPE, stderr=stderr, text=True, timeout=args.timeout)
+                if child.returncode:
+                    print(f"{version} with {meters} meters failed; see {workdir}/stderr.log")
+                    continue
+                result = {**json.loads(child.stdout.splitlines()[-1]), **context}
+                print_row(result)
+                if not args.no_save:
+                    with open(RESULTS, "a") as f:
+                        f.write(json.dumps(result) + "\n")
+                shutil.rmtree(workdir)
+            finally:
+                simulator.terminate()
+                simulator.wait()
+
+
+def width(fmt):
+    return int(fmt[1:].rstrip("df").split(".")[0])
+
+
+def print_header():
+    print("  ".join(f"{heading:{fmt[0]}{width(fmt)}}" for _, heading, fmt in COLUMNS))
+
+
+def print_row(result):
+    print("  ".join(f"{'-':>{width(fmt)}}" if result.get(key) is None else f"{result[key]:{fmt}}"
+                    for key, _, fmt in COLUMNS))
+
+
+def compare():
+    """Newest stored result per version and meter count."""
+    if not RESULTS.exists():
+        print(f"No results yet in {RESULTS}.")
+        return
+    newest = {}
+    with open(RESULTS) as f:
+        for line in f:
+            result = json.loads(line)
+            newest[result["version"], result["meters"]] = result
+    print_header()
+    for key in sorted(newest, key=lambda key: (list(VERSIONS).index(key[0]) if key[0] in VERSIONS
+                                               else len(VERSIONS), key)):
+        print_row(newest[key])
+    hosts = {(r["host"], r["commit"], r["date"][:10]) for r in newest.values()}
+    print("\nMeasured on " + "; ".join(f"{host} at {commit} ({date})" for host, commit, date in sorted(
+        hosts, key=str)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--versions", nargs="+", default=list(VERSIONS), choices=list(VERSIONS))
+    parser.add_argument("--meters", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--cycles", type=int, default=20)
+    parser.add_argument("--baud", type=int, default=0, help="RTU line speed to emulate (0: instant)")
+    parser.add_argument("--tcp-port", type=int, default=5502, help="port for the 1.62-tcp simulator")
+    parser.add_argument("--timeout", type=float, default=900, help="seconds per run")
+    parser.add_argument("--no-save", action="store_true", help="do not append to results.jsonl")
+    parser.add_argument("--compare", action="store_true", help="show stored results and exit")
+    # Internal: one measurement in a child process.
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    parser.add_argument("--device", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run:
+        run_one(args)
+    elif args.compare:
+        compare()
+    else:
+        run_all(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Compare the old per-row executemany INSERT with BulkWriter on a live SQL Server.
+
+Rows go into a session temp table (#rx380_bench), so nothing is left behind:
+
+    python3 benchmarks/sql_insert.py --server 192.168.0.226 --user sa --password ... --rows 5000
+"""
+import argparse
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pymssql
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from sql_bulk import METER_COLUMNS, SQL_COLUMNS, BulkWriter  # noqa: E402
+
+TABLE = "#rx380_bench"
+COLUMNS = SQL_COLUMNS[:1] + METER_COLUMNS + SQL_COLUMNS[1:]
+
+
+def make_rows(count):
+    start = datetime(2024, 1, 1)
+    return [
+        ((start + timedelta(seconds=n)).strftime("%Y-%m-%d %H:%M:%S"), "office")
+        + tuple(230.0 + (n + i) % 7 * 0.1 for i in range(len(COLUMNS) - 2))
+        for n in range(count)
+    ]
+
+
+def reset_table(cursor):
+    cursor.execute(f"IF OBJECT_ID('tempdb..{TABLE}') IS NOT NULL DROP TABLE {TABLE}")
+    types = {"timestamp": "DATETIME", "meter": "NVARCHAR(64)"}
+    columns = ", ".join(f"{name} {types.get(key, 'FLOAT')}" for name, key in COLUMNS)
+    cursor.execute(f"CREATE TABLE {TABLE} ({columns})")
+    cursor.execute(f"CREATE UNIQUE INDEX UX_Meter_Timestamp ON {TABLE} (Meter, Timestamp) "
+                   f"WITH (IGNORE_DUP_KEY = ON)")
+
+
+def per_row(conn, rows):
+    names = ", ".join(name for name, _ in COLUMNS)
+    query = f"INSERT INTO {TABLE} ({names}) VALUES ({', '.join(['%s'] * len(COLUMNS))})"
+    cursor = conn.cursor()
+    cursor.executemany(query, rows)
+    conn.commit()
+
+
+def bulk(conn, rows, batch_size):
+    cursor = conn.cursor()
+    BulkWriter(COLUMNS, batch_size=batch_size).insert(cursor, TABLE, rows)
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--server", required=True)
+    parser.add_argument("--database", default="Power_Usage_Alumac")
+    parser.add_argument("--user", default="sa")
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    conn = pymssql.connect(server=args.server, database=args.database,
+                           user=args.user, password=args.password)
+    rows = make_rows(args.rows)
+    for name, run in (("executemany per row", lambda: per_row(conn, rows)),
+                      ("BulkWriter", lambda: bulk(conn, rows, args.batch_size))):
+        reset_table(conn.cursor())
+        conn.commit()
+        started = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - started
+        print(f"{name:20s} {len(rows)} rows in {elapsed:7.2f}s = {len(rows) / elapsed:9.0f} rows/s")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Local stand-in for pymssql that stores inserted rows in SQLite.
+
+The benchmarks import it as ``pymssql`` so every watchdog version runs its
+own SQL code path without a SQL Server. It does not speak T-SQL: an INSERT
+is reduced to its table, column list and parameters, and the rows are
+written with a plain SQLite INSERT (so BulkWriter's multi-row VALUES and
+the older per-row statements cost the same on the server side, and only
+the client side differs between versions). Any other statement, like the
+pool's ``SELECT 1``, goes to SQLite as is.
+
+    import sys, sql_standin
+    sys.modules["pymssql"] = sql_standin
+    sql_standin.DATABASE = "/tmp/bench.sqlite3"
+"""
+import re
+import sqlite3
+import threading
+
+DATABASE = ":memory:"
+
+INSERT = re.compile(r"\s*INSERT\s+INTO\s+(\w+)\s*\(([^)]*)\)", re.IGNORECASE)
+
+_tables = set()
+_lock = threading.Lock()
+
+
+class Error(Exception):
+    pass
+
+
+class DatabaseError(Error):
+    pass
+
+
+class DataError(DatabaseError):
+    pass
+
+
+class IntegrityError(DatabaseError):
+    pass
+
+
+class Cursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.db = connection.db
+        self.rows = []
+
+    def execute(self, query, params=()):
+        match = INSERT.match(query)
+        if match is None:
+            self.rows = self.db.execute(query.replace("%s", "?"), params).fetchall()
+            return
+        table = match.group(1)
+        columns = [name.strip() for name in match.group(2).split(",")]
+        params = tuple(params)
+        rows = [params[start:start + len(columns)] for start in range(0, len(params), len(columns))]
+        self.connection.create_table(table, columns)
+        self.db.executemany(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", rows)
+
+    def executemany(self, query, rows):
+        for params in rows:
+            self.execute(query, params)
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def close(self):
+        pass
+
+
+class Connection:
+    def __init__(self, database):
+        self.db = sqlite3.connect(database, check_same_thread=False, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+
+    def create_table(self, table, columns):
+        # Columns are added as later versions insert more of them.
+        with _lock:
+            if (table, tuple(columns)) in _tables:
+                return
+            self.db.execute(f"CREATE TABLE IF NOT EXISTS {table} ({columns[0]})")
+            existing = {row[1] for row in self.db.execute(f"PRAGMA table_info({table})")}
+            for name in columns:
+                if name not in existing:
+                    self.db.execute(f"ALTER TABLE {table} ADD COLUMN {name}")
+            self.db.commit()
+            _tables.add((table, tuple(columns)))
+
+    def cursor(self):
+        return Cursor(self)
+
+    def commit(self):
+        self.db.commit()
+
+    def rollback(self):
+        self.db.rollback()
+
+    def close(self):
+        self.db.close()
+
+
+def connect(*args, **kwargs):
+    """Accepts pymssql's arguments and ignores them; every connection opens DATABASE."""
+    return Connection(DATABASE)
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+
+from adaptive_polling import AdaptiveInterval
+from metrics import REGISTRY
+from tracing import TRACER, sample_id
+
+POLL_CYCLE_SECONDS = REGISTRY.histogram(
+    "rx380_poll_cycle_seconds", "Time to read every due slave on a port.", ["port"])
+SLAVE_FAILURES = REGISTRY.counter(
+    "rx380_slave_failures_total", "Polls a slave did not answer.", ["port", "slave"])
+SAMPLES_READ = REGISTRY.counter("rx380_samples_read_total", "Samples read per slave.", ["port", "slave"])
+SLAVE_CYCLE_SECONDS = REGISTRY.gauge(
+    "rx380_slave_cycle_seconds", "Time between a slave's last two good reads.", ["port", "slave"])
+SLAVE_READ_SECONDS = REGISTRY.gauge(
+    "rx380_slave_read_seconds", "Bus time taken by a slave's last read.", ["port", "slave"])
+
+
+def slave_name(cfg):
+    """The meter name of a ``modbus.slaves`` entry: ``name``, else ``slave<address>``."""
+    return cfg.get("name", f"slave{cfg['address']}")
+
+
+class Slave:
+    """Scheduling state for one meter on the bus."""
+
+    def __init__(self, cfg, default_timeout=1):
+        self.address = cfg["address"]
+        self.name = slave_name(cfg)
+        self.priority = cfg.get("priority", 0)
+        self.timeout = cfg.get("timeout", default_timeout)
+        self.failures = 0
+        self.skip_until = 0.0
+        self.last_success = None  # monotonic time of the last good read
+        self.cycle_time = None  # seconds between the last two good reads
+        self.read_time = None  # bus time taken by the last read
+        self.adaptive = None  # AdaptiveInterval in adaptive polling mode
+        self.next_poll = 0.0
+
+
+def slaves_from_config(cfg):
+    """Build the slave list from ``modbus.slaves``, falling back to ``slave_address``."""
+    entries = cfg.get("slaves") or [{"address": cfg.get("slave_address", 1)}]
+    return [Slave(entry, cfg.get("timeout", 1)) for entry in entries]
+
+
+class BusScheduler:
+    """Polls every slave on one port, one transaction at a time on serial lines.
+
+    ``round_robin`` rotates the starting slave each cycle so no meter is always
+    read last; ``priority`` reads lower ``priority`` values first. A slave that
+    stops answering is backed off exponentially (up to ``max_backoff`` seconds),
+    so its timeouts do not stretch the cycle for the others.
+
+    With ``polling.mode`` ``adaptive`` each slave gets its own interval (see
+    adaptive_polling) and a cycle only reads the slaves that are due.
+    """
+
+    def __init__(self, client, cfg, logger: logging.Logger):
+        self.client = client
+        self.logger = logger
+        self.slaves = slaves_from_config(cfg)
+        self.mode = cfg.get("schedule", "round_robin")
+        self.retry_interval = cfg.get("retry_interval", 30)
+        self.max_backoff = cfg.get("max_backoff", 300)
+        self.cycle_time = None
+        self._rotation = 0
+        if self.mode not in ("round_robin", "priority"):
+            raise ValueError(f"Unknown bus schedule {self.mode!r}")
+        polling = cfg.get("polling", {})
+        self.adaptive = polling.get("mode", "fixed") == "adaptive"
+        if self.adaptive:
+            for slave, entry in zip(self.slaves, cfg.get("slaves") or [{}]):
+                # Slave entries may override the port's interval limits.
+                slave.adaptive = AdaptiveInterval({**polling, **entry}, slave.name, logger)
+
+    def poll_order(self):
+        if self.mode == "priority":
+            return sorted(self.slaves, key=lambda s: (s.priority, s.address))
+        offset = self._rotation % len(self.slaves)
+        self._rotation += 1
+        return self.slaves[offset:] + self.slaves[:offset]
+
+    async def poll_slave(self, slave):
+        started = time.monotonic()
+        with TRACER.span("read_data", slave=slave.name) as span:
+            data = await self.client.read_data(slave.address, slave.timeout)
+        finished = time.monotonic()
+        slave.read_time = finished - started
+        SLAVE_READ_SECONDS.labels(self.client.port, slave.name).set(slave.read_time)
+        if data is None:
+            SLAVE_FAILURES.labels(self.client.port, slave.name).inc()
+            slave.failures += 1
+            backoff = min(self.retry_interval * 2 ** (slave.failures - 1), self.max_backoff)
+            slave.skip_until = finished + backoff
+            self.logger.warning(
+                f"Slave {slave.name} ({slave.address}) not responding, "
+                f"{slave.failures} failure(s); retrying in {backoff:.0f}s."
+            )
+            return None
+        if slave.failures:
+            self.logger.info(f"Slave {slave.name} ({slave.address}) is responding again.")
+        slave.failures = 0
+        SAMPLES_READ.labels(self.client.port, slave.name).inc()
+        if slave.last_success is not None:
+            slave.cycle_time = finished - slave.last_success
+            SLAVE_CYCLE_SECONDS.labels(self.client.port, slave.name).set(slave.cycle_time)
+        slave.last_success = finished
+        if slave.adaptive:
+            slave.next_poll = started + slave.adaptive.update(data, started)
+        sample = {'meter': slave.name}
+        sample.update(data)
+        sample['timestamp'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        span.set(sample=sample_id(sample))  # the recorded span shares its args
+        return sample
+
+    async def poll_cycle(self):
+        """Read every slave that is not backing off; returns the samples read."""
+        started = time.monotonic()
+        due = [slave for slave in self.poll_order()
+               if slave.skip_until <= started and slave.next_poll <= started]
+        if not due:
+            return []
+        with TRACER.span("poll_cycle", port=self.client.port, slaves=len(due)):
+            if self.client.transport.pipelined:
+                # The transport keeps several requests in flight across slaves.
+                results = await asyncio.gather(*(self.poll_slave(slave) for slave in due))
+            else:
+                results = [await self.poll_slave(slave) for slave in due]
+        samples = [sample for sample in results if sample is not None]
+        self.cycle_time = time.monotonic() - started
+        POLL_CYCLE_SECONDS.labels(self.client.port).observe(self.cycle_time)
+        # Adaptive cycles can run every second; keep them out of the info log.
+        self.logger.log(
+            logging.DEBUG if self.adaptive else logging.INFO,
+            f"Bus cycle on {self.client.port}: {len(samples)}/{len(self.slaves)} slaves "
+            f"in {self.cycle_time:.3f}s."
+        )
+        return samples
+
+    def seconds_until_due(self):
+        """Time until the next slave needs polling (0 if one is due now)."""
+        now = time.monotonic()
+        return max(0.0, min(max(slave.next_poll, slave.skip_until) for slave in self.slaves) - now)
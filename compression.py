@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""Deadband / swinging-door compression of samples before they are stored.
+
+Most fields barely move between samples, so storing every row of them
+mostly stores repetition. The ``Compressor`` passes on only the rows needed
+to rebuild every field to within its tolerance; ``reconstruct`` rebuilds
+the values at any time from the stored rows.
+
+Each field is compressed in one of two modes:
+
+``swinging_door``
+    Rows are joined by straight lines. A row is stored once no straight line
+    from the last stored row through the newest one stays within
+    ``tolerance`` of every sample in between; the previous sample, the last
+    one that still fit, is stored and the next segment starts there.
+``deadband``
+    The value is held until it differs from the stored one by more than
+    ``tolerance``; then that sample is stored. For step-like readings.
+
+A stored row carries every field, so a row stored for one field also
+restarts the others. Either way ``reconstruct`` is within ``tolerance`` of
+every sample that was dropped. Counter deltas (``<counter>_delta``) are not
+compressed: a stored row carries the sum of the deltas since the previous
+stored row, so sums over any stored range are unchanged.
+
+A row is also stored at least every ``max_gap`` seconds, when a field
+appears or disappears, and on ``flush`` at shutdown. To see what a setting
+would do to a day's log:
+
+    python3 compression.py rx380_daily_logs/rx380_data_2024-05-07.csv --config compression.json
+"""
+import argparse
+import csv
+import json
+import logging
+from datetime import datetime
+
+import numpy as np
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+MODES = ("swinging_door", "deadband")
+
+
+def field_settings(fields, cfg, units=None):
+    """(mode, tolerance) per field from ``cfg["fields"]``, then ``cfg["units"]``, then ``cfg["default"]``."""
+    units = units or {}
+    by_unit = cfg.get("units", {})
+    default = cfg.get("default", {})
+    settings = {}
+    for name in fields:
+        setting = {**default, **by_unit.get(units.get(name), {}), **cfg.get("fields", {}).get(name, {})}
+        mode = setting.get("mode", "swinging_door")
+        if mode not in MODES:
+            raise ValueError(f"Unknown compression mode {mode!r} for {name}")
+        settings[name] = (mode, float(setting.get("tolerance", 0)))
+    return settings
+
+
+def epoch(timestamp):
+    return datetime.strptime(timestamp, TIMESTAMP_FORMAT).timestamp()
+
+
+class MeterState:
+    """The last stored row of one meter and the swinging door since it."""
+
+    def __init__(self, size, sums):
+        self.anchor_time = None
+        self.anchor = np.full(size, np.nan)
+        self.low = np.full(size, -np.inf)  # the range of slopes that still fits every sample
+        self.high = np.full(size, np.inf)
+        self.previous = None  # (time, values, sample) of the newest sample, if not stored
+        self.sums = np.zeros(sums)
+
+
+class Compressor:
+    """Drops the samples that can be rebuilt from their neighbours within tolerance.
+
+    ``compress`` takes batches of samples in time order per meter and returns
+    the rows to store. The newest sample of each meter is held back until
+    the next one shows whether it is needed; ``flush`` returns the held
+    samples.
+    """
+
+    def __init__(self, fields, cfg, units=None, sum_fields=(), logger: logging.Logger = None):
+        self.sum_fields = list(sum_fields)
+        self.fields = [name for name in fields if name not in self.sum_fields]
+        self.settings = field_settings(self.fields, cfg, units)
+        self.max_gap = cfg.get("max_gap", 900)
+        self.logger = logger or logging.getLogger(__name__)
+        modes = [self.settings[name][0] for name in self.fields]
+        self.swinging = np.array([mode == "swinging_door" for mode in modes])
+        self.tolerance = np.array([self.settings[name][1] for name in self.fields])
+        self.meters = {}
+        self.received = 0
+        self.stored = 0
+
+    def _row(self, state, sample):
+        """The row to store for ``sample``, carrying the deltas summed since the last one."""
+        row = dict(sample)
+        for name, total in zip(self.sum_fields, state.sums):
+            row[name] = None if total != total else float(total)
+        state.sums[:] = 0
+        self.stored += 1
+        return row
+
+    def _restart(self, state, time, values):
+        state.anchor_time = time
+        state.anchor = values
+        state.low[:] = -np.inf
+        state.high[:] = np.inf
+        state.previous = None
+
+    def _fits(self, state, time, values):
+        """Whether ``values`` at ``time`` can be dropped, as far as the stored row is concerned."""
+        elapsed = time - state.anchor_time
+        if elapsed >= self.max_gap:
+            return False
+        gap = np.isnan(values)
+        if (gap != np.isnan(state.anchor)).any():
+            return False
+        with np.errstate(invalid="ignore"):
+            change = values - state.anchor
+            slope = change / elapsed
+            door = (slope < state.low) | (slope > state.high)
+            band = np.abs(change) > self.tolerance
+        return not np.where(self.swinging, door, band).any()
+
+    def add(self, sample):
+        """Feed one sample; returns the rows (0-2) it lets go to storage."""
+        self.received += 1
+        meter = sample.get("meter") or "meter"
+        state = self.meters.get(meter)
+        if state is None:
+            state = self.meters[meter] = MeterState(len(self.fields), len(self.sum_fields))
+        time = epoch(sample["timestamp"])
+        values = np.array([np.nan if v is None else v for v in map(sample.get, self.fields)], float)
+        rows = []
+        if state.anchor_time is not None and time <= (state.previous or (state.anchor_time,))[0]:
+            # Same second as the sample before (or replayed): only its deltas count.
+            self.logger.debug(f"{meter}: no newer than the previous sample at {sample['timestamp']}; not stored.")
+            self._accumulate(state, sample)
+            return rows
+        if state.anchor_time is not None and not self._fits(state, time, values) and state.previous:
+            # The newest sample no longer fits: store the one before it and start there.
+            previous_time, previous_values, previous_sample = state.previous
+            rows.append(self._row(state, previous_sample))
+            self._restart(state, previous_time, previous_values)
+        self._accumulate(state, sample)
+        if state.anchor_time is None or not self._fits(state, time, values):
+            rows.append(self._row(state, sample))
+            self._restart(state, time, values)
+            return rows
+        elapsed = time - state.anchor_time
+        with np.errstate(invalid="ignore"):
+            np.fmax(state.low, (values - self.tolerance - state.anchor) / elapsed, out=state.low)
+            np.fmin(state.high, (values + self.tolerance - state.anchor) / elapsed, out=state.high)
+        state.previous = (time, values, sample)
+        return rows
+
+    def _accumulate(self, state, sample):
+        # A missing delta makes the sum unknown (NaN) until the next stored row.
+        state.sums += [np.nan if v is None else v for v in map(sample.get, self.sum_fields)]
+
+    def compress(self, samples):
+        rows = []
+        for sample in samples:
+            rows.extend(self.add(sample))
+        return rows
+
+    def flush(self):
+        """The held samples, stored so the tail of each meter is not lost."""
+        rows = []
+        for state in self.meters.values():
+            if state.previous:
+                time, values, sample = state.previous
+                rows.append(self._row(state, sample))
+                self._restart(state, time, values)
+        return rows
+
+    def ratio(self):
+        """Samples received per row stored so far."""
+        return self.received / max(self.stored, 1)
+
+
+def reconstruct(rows, times, settings):
+    """Values of each field in ``settings`` at epoch ``times``, rebuilt from one meter's stored rows.
+
+    Swinging-door fields are interpolated between the stored rows and
+    deadband fields hold the stored value. Times before the first or after
+    the last stored row, and spans next to a missing value, come back NaN.
+    """
+    stored = np.array([epoch(row["timestamp"]) for row in rows])
+    times = np.asarray(times, float)
+    if not len(stored):
+        return {name: np.full(len(times), np.nan) for name in settings}
+    # A stored row is exact, including the last one.
+    at = np.searchsorted(stored, times, "left").clip(0, len(stored) - 1)
+    exact = stored[at] == times
+    left = np.searchsorted(stored, times, "right") - 1
+    inside = (left >= 0) & (left < len(stored) - 1)
+    left = left.clip(0, max(len(stored) - 2, 0))
+    right = np.minimum(left + 1, len(stored) - 1)
+    span = stored[right] - stored[left]
+    fraction = np.divide(times - stored[left], span, out=np.zeros(len(times)), where=span > 0)
+    result = {}
+    for name, (mode, _) in settings.items():
+        values = np.array([np.nan if row.get(name) is None else row[name] for row in rows], float)
+        if mode == "deadband":
+            rebuilt = np.where(np.isnan(values[right]), np.nan, values[left])
+        else:
+            rebuilt = values[left] + (values[right] - values[left]) * fraction
+        result[name] = np.where(exact, values[at], np.where(inside, rebuilt, np.nan))
+    return result
+
+
+def read_csv_samples(path):
+    """Samples from a CSV log, numbers as floats and gaps as None."""
+    samples = []
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            sample = {}
+            for name, text in row.items():
+                if name in ("meter", "timestamp"):
+                    sample[name] = text
+                elif text in ("", "None"):
+                    sample[name] = None
+                else:
+                    sample[name] = float(text)
+            samples.append(sample)
+    return samples
+
+
+def measure(samples, compressor):
+    """Compress ``samples`` and rebuild them; returns (rows, {field: max abs error})."""
+    rows = compressor.compress(samples) + compressor.flush()
+    errors = dict.fromkeys(compressor.fields, 0.0)
+    for meter in dict.fromkeys(sample.get("meter") or "meter" for sample in samples):
+        raw = [sample for sample in samples if (sample.get("meter") or "meter") == meter]
+        kept = [row for row in rows if (row.get("meter") or "meter") == meter]
+        rebuilt = reconstruct(kept, [epoch(sample["timestamp"]) for sample in raw], compressor.settings)
+        for name in compressor.fields:
+            actual = np.array([np.nan if s.get(name) is None else s[name] for s in raw], float)
+            with np.errstate(invalid="ignore"):
+                error = np.abs(rebuilt[name] - actual)
+            if len(error) and not np.isnan(error).all():
+                errors[name] = max(errors[name], float(np.nanmax(error)))
+    return rows, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure compression of an RX380 CSV log")
+    parser.add_argument("path", help="rx380_data_*.csv file")
+    parser.add_argument("--config", help="JSON file with the watchdog's compression settings")
+    args = parser.parse_args()
+    cfg = {}
+    if args.config:
+        with open(args.config) as f:
+            cfg = json.load(f)
+    samples = read_csv_samples(args.path)
+    if not samples:
+        print("No samples.")
+        return
+    fields = [name for name in samples[0] if name not in ("meter", "timestamp")]
+    compressor = Compressor(fields, cfg, sum_fields=[name for name in fields if name.endswith("_delta")])
+    rows, errors = measure(samples, compressor)
+    print(f"{len(samples)} samples -> {len(rows)} rows ({len(samples) / max(len(rows), 1):.1f}x)")
+    for name, error in errors.items():
+        mode, tolerance = compressor.settings[name]
+        print(f"  {name:24} {mode:14} tolerance {tolerance:<8g} max error {error:.6g}")
+
+
+if __name__ == "__main__":
+    main()
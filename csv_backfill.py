@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""Backfill SQL Server from the daily rx380_data_YYYY-MM-DD.csv archives.
+
+Files are streamed in chunks and bulk inserted; after each committed chunk the
+byte offset reached is checkpointed, so an interrupted import resumes where
+it stopped. Several days are imported in parallel worker processes.
+
+    python3 csv_backfill.py ~/Desktop/PUA_P7Oven/PUA/rx380_daily_logs --config config.json --workers 4
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import pymssql
+
+from sql_bulk import METER_COLUMNS, SQL_COLUMNS, BulkWriter
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("csv_backfill")
+
+SAMPLE_KEYS = {key for _, key in SQL_COLUMNS}
+
+
+class Checkpoint:
+    """Byte offset reached in one CSV file, kept in a small sidecar file."""
+
+    def __init__(self, folder, csv_path):
+        self.path = Path(folder) / (csv_path.name + ".offset")
+
+    def load(self):
+        try:
+            return int(self.path.read_text())
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def save(self, offset):
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(str(offset))
+        os.replace(tmp, self.path)
+
+
+def parse_value(key, text):
+    if text in ("", "None"):
+        return None
+    if key in ("timestamp", "meter"):
+        return text
+    return float(text)
+
+
+def read_chunks(csv_path, offset, chunk_rows):
+    """Yield (samples, end offset) chunks, starting at byte ``offset``."""
+    with open(csv_path, "rb") as f:
+        header = next(csv.reader([f.readline().decode()]))
+        keys = [key if key in SAMPLE_KEYS or key == "meter" else None for key in header]
+        if offset:
+            f.seek(offset)
+        samples = []
+        while True:
+            line = f.readline()
+            if not line.endswith(b"\n"):
+                break  # end of file, or a row still being written
+            values = next(csv.reader([line.decode()]), None)
+            if values:
+                samples.append({key: parse_value(key, value)
+                                for key, value in zip(keys, values) if key is not None})
+            if len(samples) >= chunk_rows:
+                yield samples, f.tell()
+                samples = []
+        if samples:
+            yield samples, f.tell()
+
+
+def import_file(csv_path, db_config, tables, columns, checkpoint_folder, chunk_rows, batch_size):
+    """Import one CSV file from its checkpoint onwards; runs in a worker process."""
+    csv_path = Path(csv_path)
+    checkpoint = Checkpoint(checkpoint_folder, csv_path)
+    offset = checkpoint.load()
+    if offset and offset >= csv_path.stat().st_size:
+        return csv_path.name, 0
+    writer = BulkWriter(columns, batch_size=batch_size)
+    default_table = tables.get(None, "Office_Readings")
+    imported = 0
+    conn = pymssql.connect(**db_config)
+    try:
+        for samples, end in read_chunks(csv_path, offset, chunk_rows):
+            cursor = conn.cursor()
+            by_table = {}
+            for sample in samples:
+                by_table.setdefault(tables.get(sample.get("meter"), default_table), []).append(sample)
+            for table, table_samples in by_table.items():
+                writer.insert(cursor, table, writer.rows(table_samples))
+            conn.commit()
+            cursor.close()
+            checkpoint.save(end)
+            imported += len(samples)
+    finally:
+        conn.close()
+    return csv_path.name, imported
+
+
+def find_csv_files(paths):
+    files = []
+    for path in map(Path, paths):
+        path = path.expanduser()
+        files.extend(sorted(path.glob("rx380_data_*.csv")) if path.is_dir() else [path])
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill SQL Server from RX380 CSV archives.")
+    parser.add_argument("paths", nargs="+", help="CSV files or folders of rx380_data_*.csv")
+    parser.add_argument("--config", help="JSON config with a 'database' section (e.g. config.json)")
+    parser.add_argument("--server")
+    parser.add_argument("--database")
+    parser.add_argument("--user")
+    parser.add_argument("--password")
+    parser.add_argument("--table", help="target table (default: table_name from config, else Office_Readings)")
+    parser.add_argument("--meter-table", action="append", default=[], metavar="METER=TABLE",
+                        help="route rows of one meter to its own table; repeatable")
+    parser.add_argument("--meter-column", action="store_true",
+                        help="also insert the Meter column (database.meter_column in the config)")
+    parser.add_argument("--checkpoints", help="checkpoint folder (default: <csv folder>/.backfill)")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--chunk-rows", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    db_config = {}
+    if args.config:
+        with open(args.config) as f:
+            db_config = json.load(f)["database"]
+    for key in ("server", "database", "user", "password"):
+        if getattr(args, key):
+            db_config[key] = getattr(args, key)
+    columns = SQL_COLUMNS + (METER_COLUMNS if args.meter_column or db_config.get("meter_column") else [])
+    tables = {None: args.table or db_config.pop("table_name", "Office_Readings")}
+    db_config = {key: db_config[key] for key in ("server", "database", "user", "password") if key in db_config}
+    for mapping in args.meter_table:
+        meter, _, table = mapping.partition("=")
+        tables[meter] = table
+
+    files = find_csv_files(args.paths)
+    if not files:
+        parser.error("no rx380_data_*.csv files found")
+    checkpoint_folder = Path(args.checkpoints or files[0].parent / ".backfill")
+    checkpoint_folder.mkdir(parents=True, exist_ok=True)
+
+    total = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {
+            pool.submit(import_file, path, db_config, tables, columns, checkpoint_folder,
+                        args.chunk_rows, args.batch_size): path
+            for path in files
+        }
+        for future in as_completed(futures):
+            try:
+                name, imported = future.result()
+                total += imported
+                logger.info(f"{name}: imported {imported} rows.")
+            except Exception as e:
+                logger.error(f"{futures[future].name}: import failed, rerun to resume: {e}")
+    logger.info(f"Backfill finished: {total} rows from {len(files)} files.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import csv
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+
+def csv_columns(sample):
+    """Column layout for a sample: timestamp first, then its keys in order."""
+    return list(dict.fromkeys(['timestamp'] + list(sample.keys())))
+
+
+class DailyCsvWriter:
+    """Keeps the day's CSV files open and writes rows through a buffer.
+
+    The column layout is fixed when a file is created. Rows are routed by the
+    date of their own timestamp, so files roll over at local midnight. Each
+    distinct set of sample keys (meters with different profiles, or a new
+    model mid-day) gets its own file for the day, ``rx380_data_<day>.csv``,
+    ``rx380_data_<day>_2.csv`` and so on, kept open alongside the others, so
+    rows never land under the wrong header and interleaved layouts do not
+    start a new file each time they alternate.
+
+    Buffered rows are flushed once ``flush_rows`` are pending or the oldest is
+    ``flush_interval`` seconds old; with ``fsync`` every flush also reaches
+    the disk. Blocking: call it from worker threads. Every method holds a
+    lock, so a periodic ``flush_if_due`` can run beside ``write``.
+    """
+
+    def __init__(self, folder, prefix="rx380_data", flush_rows=100, flush_interval=5.0,
+                 fsync=False, buffer_size=64 * 1024, logger: logging.Logger = None):
+        self.folder = Path(folder).expanduser()
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.prefix = prefix
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.buffer_size = buffer_size
+        self.logger = logger or logging.getLogger(__name__)
+        self.lock = threading.RLock()
+        self.day = None
+        self.path = None
+        self._files = {}  # columns -> (path, file, csv writer) for self.day
+        self._keys = None
+        self._columns = None
+        self._writer = None
+        self._pending = 0
+        self._pending_since = None
+
+    def _candidates(self, day):
+        """Existing files for ``day`` in creation order."""
+        first = self.folder / f"{self.prefix}_{day}.csv"
+        paths = [first] if first.is_file() else []
+        n = 2
+        while (self.folder / f"{self.prefix}_{day}_{n}.csv").is_file():
+            paths.append(self.folder / f"{self.prefix}_{day}_{n}.csv")
+            n += 1
+        return paths
+
+    @staticmethod
+    def _read_header(path):
+        with open(path, newline='') as f:
+            return next(csv.reader(f), None)
+
+    def _open(self, day, columns):
+        if day != self.day:
+            self.close()
+            self.day = day
+        if columns in self._files:
+            return self._files[columns]
+        paths = self._candidates(day)
+        # Carry on appending to the day's file with this layout, if there is one.
+        matching = [path for path in paths if self._read_header(path) == list(columns)]
+        if matching:
+            path, new = matching[-1], False
+        else:
+            path = self.folder / (f"{self.prefix}_{day}_{len(paths) + 1}.csv" if paths
+                                  else f"{self.prefix}_{day}.csv")
+            new = True
+            if paths:
+                self.logger.warning(f"New CSV column layout; writing it to {path.name}.")
+        file = open(path, 'a', newline='', buffering=self.buffer_size)
+        writer = csv.writer(file, lineterminator='\n')
+        if new:
+            writer.writerow(columns)
+        self._files[columns] = (path, file, writer)
+        self.logger.info(f"Writing CSV data to {path}")
+        return self._files[columns]
+
+    def write(self, samples):
+        with self.lock:
+            for sample in samples:
+                day = sample['timestamp'][:10]
+                if day != self.day or sample.keys() != self._keys:
+                    columns = tuple(csv_columns(sample))
+                    self.path, _, self._writer = self._open(day, columns)
+                    self._columns, self._keys = columns, sample.keys()
+                self._writer.writerow([sample.get(column) for column in self._columns])
+                if not self._pending:
+                    self._pending_since = time.monotonic()
+                self._pending += 1
+            if self._pending >= self.flush_rows:
+                self.flush()
+            else:
+                self.flush_if_due()
+
+    def flush_if_due(self):
+        with self.lock:
+            if self._pending and time.monotonic() - self._pending_since >= self.flush_interval:
+                self.flush()
+
+    def flush(self):
+        with self.lock:
+            if not self._pending:
+                return
+            for _, file, _ in self._files.values():
+                file.flush()
+                if self.fsync:
+                    os.fsync(file.fileno())
+            self._pending = 0
+
+    def close(self):
+        with self.lock:
+            self.flush()
+            for _, file, _ in self._files.values():
+                file.close()
+            self._files = {}
+            self.day = self._keys = self._columns = self._writer = None
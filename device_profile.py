@@ -0,0 +1,145 @@
+import json
+import operator
+import struct
+from pathlib import Path
+
+from read_plan import MAX_REGISTERS_PER_READ, RegisterField, plan_reads
+
+# Register type -> (number of registers, struct format character)
+REGISTER_TYPES = {
+    "uint16": (1, "H"),
+    "int16": (1, "h"),
+    "uint32": (2, "I"),
+    "int32": (2, "i"),
+    "float32": (2, "f"),
+}
+
+DEFAULT_PROFILE = Path(__file__).resolve().parent / "profiles" / "rx380.json"
+
+
+class BlockDecoder:
+    """Decodes one read block from its raw response bytes in a single unpack."""
+
+    def __init__(self, block, codes, word_order="big"):
+        self.start = block.start
+        self.count = block.count
+        self.end = block.end
+        self.names = tuple(field.name for field in block.fields)
+        self.scales = tuple(field.scale for field in block.fields)
+        # Unused registers inside the block become pad bytes.
+        layout = []
+        position = block.start
+        for field in block.fields:
+            if field.address < position:
+                raise ValueError(f"Register {field.name} overlaps another register at {field.address}")
+            layout.append("x" * 2 * (field.address - position) + codes[field.name])
+            position = field.end
+        layout.append("x" * 2 * (block.end - position))
+        # Low-word-first devices are decoded little-endian once every register
+        # has had its two bytes swapped.
+        self.swap_words = word_order == "little"
+        self.struct = struct.Struct(("<" if self.swap_words else ">") + "".join(layout))
+        self.pack_registers = struct.Struct(f">{block.count}H").pack
+
+    def decode(self, buffer):
+        """Turn a response payload (2 bytes per register, big-endian) into values."""
+        if self.swap_words:
+            swapped = bytearray(len(buffer))
+            swapped[0::2] = buffer[1::2]
+            swapped[1::2] = buffer[0::2]
+            buffer = swapped
+        return dict(zip(self.names, map(operator.mul, self.struct.unpack(buffer), self.scales)))
+
+    def decode_registers(self, registers):
+        """Decode a list of register values, as returned by minimalmodbus."""
+        return self.decode(self.pack_registers(*registers))
+
+
+class DeviceProfile:
+    """A meter model's register map compiled into read blocks and decoders.
+
+    An optional ``fields`` list in the spec (or passed to ``load_profile``)
+    keeps only those registers, so the read plan skips the rest.
+    """
+
+    def __init__(self, spec):
+        self.model = spec.get("model", "unknown")
+        self.function_code = spec.get("function_code", 4)
+        self.word_order = spec.get("word_order", "big")
+        if self.word_order not in ("big", "little"):
+            raise ValueError(f"{self.model}: word_order must be 'big' or 'little', not {self.word_order!r}")
+
+        fields = []
+        codes = {}
+        self.units = {}
+        self.counters = {}
+        wanted = spec.get("fields")
+        for register in spec["registers"]:
+            name = register["name"]
+            if wanted is not None and name not in wanted:
+                continue
+            if name in codes:
+                raise ValueError(f"{self.model}: duplicate register name {name!r}")
+            try:
+                words, code = REGISTER_TYPES[register.get("type", "uint32")]
+            except KeyError:
+                raise ValueError(f"{self.model}: unknown type {register['type']!r} for {name}") from None
+            fields.append(RegisterField(name, register["address"], words,
+                                        register.get("scale", 1), code.islower()))
+            codes[name] = code
+            self.units[name] = register.get("unit", "")
+            if register.get("counter"):
+                if code not in "HI":
+                    raise ValueError(f"{self.model}: counter {name} must be an unsigned integer register")
+                # The value at which the register wraps back to zero.
+                self.counters[name] = 2 ** (16 * words) * register.get("scale", 1)
+
+        self.fields = fields
+        self.codes = codes
+        self.field_names = [field.name for field in fields]
+        # Samples also carry a per-interval delta of every cumulative counter.
+        self.delta_fields = {f"{name}_delta": name for name in self.counters}
+        self.units.update((delta, self.units[name]) for delta, name in self.delta_fields.items())
+        self.output_fields = self.field_names + list(self.delta_fields)
+        self.read_plan = [
+            BlockDecoder(block, codes, self.word_order)
+            for block in plan_reads(fields,
+                                    max_gap=spec.get("max_gap", 8),
+                                    max_registers=spec.get("max_registers", MAX_REGISTERS_PER_READ))
+        ]
+
+    def decode(self, responses):
+        """Build a full sample from one response buffer per read block."""
+        data = dict.fromkeys(self.field_names)
+        for decoder, buffer in zip(self.read_plan, responses):
+            data.update(decoder.decode(buffer))
+        return data
+
+    def encode(self, values):
+        """Inverse of decode: map register address -> 16-bit value (for simulators)."""
+        registers = {}
+        for field in self.fields:
+            if values.get(field.name) is None:
+                continue
+            code = self.codes[field.name]
+            raw = values[field.name] / field.scale
+            if code != "f":
+                raw = int(round(raw))
+            words = struct.unpack(f">{field.words}H", struct.pack(">" + code, raw))
+            if self.word_order == "little":
+                words = words[::-1]
+            registers.update(zip(range(field.address, field.end), words))
+        return registers
+
+
+def load_profile(path=DEFAULT_PROFILE, **overrides):
+    """Load and compile a JSON (or YAML, if PyYAML is installed) device profile."""
+    path = Path(path)
+    with path.open("r") as f:
+        if path.suffix in (".yaml", ".yml"):
+            import yaml
+            spec = yaml.safe_load(f)
+        else:
+            spec = json.load(f)
+    spec.update((key, value) for key, value in overrides.items() if value is not None)
+    return DeviceProfile(spec)
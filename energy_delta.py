@@ -0,0 +1,125 @@
+"""Per-interval energy from cumulative counter registers.
+
+For every counter the device profile marks (``"counter": true``), each
+sample gains ``<name>_delta``: the energy used since the meter's previous
+sample. Summing the deltas over a time range gives its consumption without
+having to pair up readings.
+
+The registers are unsigned, so a counter that passes its maximum wraps back
+to zero; that shows up as a drop from near the top of the range and is
+added back. Any other drop is a meter reset (replacement, CT change, clear
+from the front panel): the new reading is taken as counted up from zero.
+A jump larger than the meter could have consumed in the elapsed time at
+``max_kw`` is not trusted; its delta is left empty.
+
+Columns for the SQL table (opt in with ``database.energy_delta_columns``):
+
+    ALTER TABLE Office_Readings ADD RealEnergyDelta FLOAT NULL,
+        ReactiveEnergyDelta FLOAT NULL, ApparentEnergyDelta FLOAT NULL
+"""
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class EnergyDeltas:
+    """Turns cumulative counters into per-interval deltas, meter by meter.
+
+    ``counters`` maps counter field -> wrap value (``DeviceProfile.counters``).
+    The last reading per meter is kept in a small JSON state file so the
+    first interval after a restart is not lost. It is written at most every
+    ``checkpoint_interval`` seconds and on ``close``; after a crash the first
+    delta of each meter spans back to the last checkpoint.
+    """
+
+    def __init__(self, counters, state_path, max_kw=5000, wrap_margin=0.1,
+                 checkpoint_interval=10, logger: logging.Logger = None):
+        self.counters = dict(counters)
+        self.state_path = Path(state_path).expanduser()
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_kw = max_kw
+        self.wrap_margin = wrap_margin
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpointed = 0.0
+        self.lock = threading.Lock()
+        self.logger = logger or logging.getLogger(__name__)
+        try:
+            self.last = json.loads(self.state_path.read_text())
+        except FileNotFoundError:
+            self.last = {}
+        except ValueError as e:
+            self.logger.error(f"Ignoring unreadable energy state {self.state_path}: {e}")
+            self.last = {}
+
+    def delta(self, meter, name, previous, current, hours):
+        """Energy used between two readings of one counter, or None if unknown."""
+        limit = self.max_kw * max(hours, 1 / 3600)
+        modulus = self.counters[name]
+        change = current - previous
+        if change < 0:
+            if previous >= modulus * (1 - self.wrap_margin) and current <= modulus * self.wrap_margin:
+                change += modulus
+                self.logger.info(f"{meter}: {name} wrapped around; delta {change:g}.")
+            else:
+                self.logger.warning(f"{meter}: {name} dropped from {previous:g} to {current:g}; meter reset.")
+                change = current
+        if change > limit:
+            self.logger.warning(f"{meter}: {name} jumped by {change:g} in {hours * 60:.1f} min; delta left empty.")
+            return None
+        return change
+
+    def apply(self, samples):
+        """Add ``<counter>_delta`` to each sample in place; returns the samples."""
+        for sample in samples:
+            meter = sample.get("meter") or "meter"
+            previous = self.last.get(meter)
+            hours = None
+            if previous is not None:
+                elapsed = (datetime.strptime(sample["timestamp"], TIMESTAMP_FORMAT)
+                           - datetime.strptime(previous["timestamp"], TIMESTAMP_FORMAT))
+                hours = elapsed.total_seconds() / 3600
+                if hours <= 0:
+                    hours = None  # replayed or out-of-order sample
+            readings = previous["values"] if previous else {}
+            for name in self.counters:
+                current = sample.get(name)
+                before = readings.get(name)
+                if hours is None or current is None or before is None:
+                    sample[f"{name}_delta"] = None
+                else:
+                    sample[f"{name}_delta"] = self.delta(meter, name, before, current, hours)
+            if hours is not None or previous is None:
+                self.last[meter] = {
+                    "timestamp": sample["timestamp"],
+                    # Keep the last good reading of a counter that failed this time.
+                    "values": {name: sample[name] if sample.get(name) is not None else readings.get(name)
+                               for name in self.counters},
+                }
+        return samples
+
+    def checkpoint(self):
+        tmp = self.state_path.with_name(self.state_path.name + ".tmp")
+        tmp.write_text(json.dumps(self.last))
+        os.replace(tmp, self.state_path)
+        self.checkpointed = time.monotonic()
+
+    def checkpoint_if_due(self):
+        if time.monotonic() - self.checkpointed >= self.checkpoint_interval:
+            self.checkpoint()
+
+    def process(self, samples):
+        """Blocking: apply, saving the state if it is due."""
+        with self.lock:
+            self.apply(samples)
+            self.checkpoint_if_due()
+        return samples
+
+    def close(self):
+        with self.lock:
+            self.checkpoint()
@@ -0,0 +1,391 @@
+"""Small HTTP query API served from the watchdog's own event loop.
+
+Dashboards read live numbers from memory and recent history from the local
+sample logs instead of querying SQL Server:
+
+    GET /meters                      meters and fields
+    GET /latest?meter=office         newest sample per meter
+    GET /range?meter=office&start=-3600&step=60&agg=mean
+    GET /stream?meter=office         server-sent events (see live_stream.py)
+    GET /metrics                     Prometheus text format (see metrics.py)
+    GET /trace                       buffered spans as a Chrome trace (see tracing.py)
+
+``start``/``end`` are epoch seconds, "YYYY-MM-DD[ HH:MM:SS]" local times, or
+negative numbers meaning seconds before now. ``fields=a,b`` limits the
+columns and ``format=csv`` returns CSV instead of JSON. A range is answered
+from the in-memory ring when it covers ``start``, otherwise from the sample
+log. ``step`` groups rows into buckets aligned to local midnight, reduced
+with ``agg`` (mean, min, max or last).
+
+JSON is column-oriented to stay compact (epoch-second timestamps, null for
+gaps). Every response has an ETag that only changes when new samples could
+change it, so a dashboard polling with If-None-Match gets an empty 304.
+Range reads and encoding run in a worker thread, never on the loop that
+polls the meters.
+"""
+import asyncio
+import csv
+import gzip
+import hashlib
+import io
+import json
+import logging
+import time
+from datetime import datetime
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy as np
+
+from sample_log import epoch_seconds
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+AGGREGATES = {"mean", "min", "max", "last"}
+STATUS = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found",
+          405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error"}
+MAX_HEADER_BYTES = 16384
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_time(text, now=None):
+    """Epoch seconds from a query parameter; negative numbers count back from now."""
+    try:
+        value = float(text)
+    except ValueError:
+        try:
+            return epoch_seconds(text.replace("T", " "))
+        except ValueError:
+            raise HttpError(400, f"Bad time {text!r}") from None
+    return int((now or time.time()) + value) if value < 0 else int(value)
+
+
+def downsample(records, step, agg="mean"):
+    """Reduce records to one row per ``step``-second bucket aligned to local midnight."""
+    if not len(records):
+        return records
+    timestamps = records["timestamp"]
+    offset = time.localtime(int(timestamps[0])).tm_gmtoff
+    buckets = timestamps - (timestamps + offset) % step
+    starts, first = np.unique(buckets, return_index=True)
+    result = np.zeros(len(starts), records.dtype)
+    result["timestamp"] = starts
+    for name in records.dtype.names[1:]:
+        values = records[name].astype(np.float64)
+        valid = ~np.isnan(values)
+        if agg == "last":
+            # The newest valid value in each bucket.
+            index = np.where(valid, np.arange(len(values)), -1)
+            newest = np.maximum.reduceat(index, first)
+            result[name] = np.where(newest >= first, values[np.clip(newest, 0, None)], np.nan)
+            continue
+        with np.errstate(invalid="ignore", divide="ignore"):
+            if agg == "min":
+                reduced = np.fmin.reduceat(values, first)
+            elif agg == "max":
+                reduced = np.fmax.reduceat(values, first)
+            else:
+                reduced = (np.add.reduceat(np.where(valid, values, 0), first)
+                           / np.add.reduceat(valid, first))
+        result[name] = reduced
+    return result
+
+
+def column(records, name):
+    """One column as a JSON-ready list: float32 noise rounded away, NaN as None."""
+    values = records[name]
+    if values.dtype == np.float32:
+        values = np.round(values.astype(np.float64), 4)
+    return [None if value != value else value for value in values.tolist()]
+
+
+def encode(meter, records, fields, fmt):
+    """(content type, body) for a set of records."""
+    if fmt == "csv":
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(["timestamp", "meter", *fields])
+        columns = [column(records, name) for name in fields]
+        for timestamp, *values in zip(records["timestamp"].tolist(), *columns):
+            writer.writerow([datetime.fromtimestamp(timestamp).strftime(TIMESTAMP_FORMAT), meter,
+                             *("" if value is None else value for value in values)])
+        return "text/csv; charset=utf-8", out.getvalue().encode()
+    body = {"meter": meter, "timestamp": records["timestamp"].tolist(),
+            **{name: column(records, name) for name in fields}}
+    return "application/json", json.dumps(body, separators=(",", ":")).encode()
+
+
+class QueryApi:
+    """HTTP/1.1 server (keep-alive, GET only) over ``RecentSamples`` and ``SampleLogStore``."""
+
+    def __init__(self, recent, history=None, host="127.0.0.1", port=8380, max_rows=200000,
+                 live=None, allow_origin=None, metrics=None, tracer=None,
+                 logger: logging.Logger = None):
+        self.recent = recent
+        self.history = history
+        self.live = live
+        self.allow_origin = allow_origin
+        self.metrics = metrics
+        self.tracer = tracer
+        self.host = host
+        self.port = port
+        self.max_rows = max_rows
+        self.logger = logger or logging.getLogger(__name__)
+        fields = recent.fields
+        self.fields = list(fields.names[1:] if isinstance(fields, np.dtype) else fields)
+        self.routes = {"/meters": self.meters, "/latest": self.latest, "/range": self.range}
+        if metrics is not None:
+            self.routes["/metrics"] = self.render_metrics
+        if tracer is not None:
+            self.routes["/trace"] = self.trace
+        self.server = None
+        self.connections = set()
+        self.requests = 0
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.logger.info(f"HTTP API listening on {self.host}:{self.port}.")
+
+    async def close(self):
+        if self.server:
+            self.server.close()
+            # Idle keep-alive and stream connections would hold wait_closed open.
+            for writer in list(self.connections):
+                writer.close()
+            await self.server.wait_closed()
+
+    # -- queries ------------------------------------------------------------
+
+    def version(self, meters):
+        """Changes whenever a sample is added for any of ``meters``."""
+        rings = self.recent.rings
+        return ",".join(f"{meter}:{rings[meter].appended if meter in rings else 0}" for meter in meters)
+
+    def select_fields(self, query):
+        if "fields" not in query:
+            return self.fields
+        fields = [name for name in query["fields"].split(",") if name]
+        unknown = [name for name in fields if name not in self.fields]
+        if unknown:
+            raise HttpError(400, f"Unknown fields: {', '.join(unknown)}")
+        return fields
+
+    def all_meters(self):
+        meters = set(self.recent.rings)
+        if self.history:
+            meters.update(self.history.meters())
+        return sorted(meters)
+
+    # Each route returns (tag, build): the tag feeds the ETag, and build() is
+    # only awaited for (content type, body) when the client's copy is stale.
+
+    def meters(self, query):
+        meters = self.all_meters()
+
+        async def build():
+            body = {"meters": meters, "fields": self.fields}
+            return "application/json", json.dumps(body, separators=(",", ":")).encode()
+
+        return self.version(meters), build
+
+    def latest(self, query):
+        fields = self.select_fields(query)
+        fmt = query.get("format", "json")
+        meters = query["meter"].split(",") if "meter" in query else sorted(self.recent.rings)
+        for meter in meters:
+            if meter not in self.recent.rings:
+                raise HttpError(404, f"No samples for {meter}")
+
+        async def build():
+            rows = {}
+            for meter in meters:
+                sample = self.recent.rings[meter].last()
+                rows[meter] = {"timestamp": sample["timestamp"],
+                               **{name: None if sample[name] is None else round(sample[name], 4)
+                                  for name in fields}}
+            if fmt == "csv":
+                out = io.StringIO()
+                writer = csv.writer(out)
+                writer.writerow(["timestamp", "meter", *fields])
+                for meter, row in rows.items():
+                    writer.writerow([row["timestamp"], meter,
+                                     *("" if row[name] is None else row[name] for name in fields)])
+                return "text/csv; charset=utf-8", out.getvalue().encode()
+            return "application/json", json.dumps(rows, separators=(",", ":")).encode()
+
+        return f"{self.version(meters)}:{fmt}:{fields}", build
+
+    def render_metrics(self, query):
+        async def build():
+            return "text/plain; version=0.0.4; charset=utf-8", self.metrics.render().encode()
+
+        # Never the same twice: a scrape always gets fresh values.
+        return str(time.monotonic()), build
+
+    def trace(self, query):
+        def run():
+            body = json.dumps(self.tracer.chrome_trace(), separators=(",", ":"), default=str)
+            return "application/json", body.encode()
+
+        return f"{self.tracer.recorded}:{self.tracer.enabled}", lambda: asyncio.to_thread(run)
+
+    def check_rows(self, timestamps, first, last, step):
+        """Refuse a read of ``timestamps[first:last]`` that would give more than ``max_rows`` rows."""
+        rows = last - first
+        if step > 0 and rows:
+            # At most one row per step-aligned bucket the range touches.
+            rows = min(rows, (int(timestamps[last - 1]) - int(timestamps[first])) // step + 2)
+        if rows > self.max_rows:
+            raise HttpError(413, f"Up to {rows} rows; narrow the range or use a larger step")
+
+    def read(self, meter, start, end, step=0):
+        """Blocking: records of ``meter`` with ``start <= timestamp < end``, as a copy.
+
+        The row count is checked against ``max_rows`` from the index bounds,
+        before any history is copied.
+        """
+        ring = self.recent.rings.get(meter)
+        logged = self.history is not None and meter in self.history.meters()
+        if ring is None and not logged:
+            raise HttpError(404, f"Unknown meter {meter}")
+        if ring is not None:
+            records = ring.snapshot()
+            timestamps = records["timestamp"]
+            if not logged or len(records) and start is not None and timestamps[0] <= start:
+                first = 0 if start is None else np.searchsorted(timestamps, start, "left")
+                last = len(records) if end is None else np.searchsorted(timestamps, end, "left")
+                self.check_rows(timestamps, first, last, step)
+                return records[first:last]
+        log = self.history.log(meter)
+        records = log.records
+        first, last = log.bounds(records, start, end)
+        self.check_rows(records["timestamp"], first, last, step)
+        return records[first:last].copy()
+
+    def range(self, query):
+        if "meter" not in query:
+            raise HttpError(400, "meter is required")
+        meter = query["meter"]
+        fields = self.select_fields(query)
+        fmt = query.get("format", "json")
+        now = time.time()
+        start = parse_time(query["start"], now) if "start" in query else None
+        end = parse_time(query["end"], now) if "end" in query else None
+        try:
+            step = int(query.get("step", 0))
+        except ValueError:
+            raise HttpError(400, "step must be a whole number of seconds") from None
+        agg = query.get("agg", "mean")
+        if agg not in AGGREGATES:
+            raise HttpError(400, f"agg must be one of {', '.join(sorted(AGGREGATES))}")
+        # A range that ended before the newest sample no longer changes.
+        ring = self.recent.rings.get(meter)
+        newest = ring.last() if ring else None
+        settled = end is not None and newest is not None and end <= epoch_seconds(newest["timestamp"])
+        tag = f"{meter}:{start}:{end}:{step}:{agg}:{fmt}:{fields}" + ("" if settled else self.version([meter]))
+
+        def run():
+            records = self.read(meter, start, end, step)
+            if step > 0:
+                records = downsample(records, step, agg)
+            return encode(meter, records, fields, fmt)
+
+        return tag, lambda: asyncio.to_thread(run)
+
+    # -- HTTP ---------------------------------------------------------------
+
+    async def respond(self, writer, status, body=b"", content_type="text/plain; charset=utf-8",
+                      headers=(), keep_alive=True):
+        lines = [f"HTTP/1.1 {status} {STATUS[status]}", f"Content-Type: {content_type}",
+                 f"Content-Length: {len(body)}", f"Connection: {'keep-alive' if keep_alive else 'close'}",
+                 *headers]
+        if self.allow_origin:
+            lines.append(f"Access-Control-Allow-Origin: {self.allow_origin}")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + body)
+        await writer.drain()
+
+    async def dispatch(self, method, target, headers):
+        """(status, body, content type, extra headers) for one request."""
+        if method != "GET":
+            raise HttpError(405, "Only GET is supported")
+        url = urlsplit(target)
+        route = self.routes.get(url.path)
+        if route is None:
+            raise HttpError(404, f"No such endpoint {url.path}")
+        query = dict(parse_qsl(url.query))
+        tag, build = route(query)
+        etag = '"' + hashlib.blake2b(f"{url.path}?{tag}".encode(), digest_size=8).hexdigest() + '"'
+        extra = [f"ETag: {etag}", "Cache-Control: no-cache"]
+        if headers.get("if-none-match") == etag:
+            return 304, b"", "text/plain; charset=utf-8", extra
+        content_type, body = await build()
+        if len(body) > 1024 and "gzip" in headers.get("accept-encoding", ""):
+            body = gzip.compress(body, 5)
+            extra.append("Content-Encoding: gzip")
+        return 200, body, content_type, extra
+
+    async def stream(self, writer, target):
+        """Hand the connection over to the live stream until the client goes away."""
+        query = dict(parse_qsl(urlsplit(target).query))
+        try:
+            fields = self.select_fields(query)
+        except HttpError as e:
+            await self.respond(writer, e.status, str(e).encode(), keep_alive=False)
+            return
+        headers = ["HTTP/1.1 200 OK", "Content-Type: text/event-stream", "Cache-Control: no-cache",
+                   "Connection: keep-alive"]
+        if self.allow_origin:
+            headers.append(f"Access-Control-Allow-Origin: {self.allow_origin}")
+        writer.write(("\r\n".join(headers) + "\r\n\r\n").encode())
+        meters = query["meter"].split(",") if "meter" in query else None
+        await self.live.serve(writer, meters, fields)
+
+    async def handle(self, reader, writer):
+        self.connections.add(writer)
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 60)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self.respond(writer, 400, b"Request too large", keep_alive=False)
+                    break
+                if len(head) > MAX_HEADER_BYTES:
+                    await self.respond(writer, 400, b"Request too large", keep_alive=False)
+                    break
+                request_line, *header_lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = request_line.split(" ")
+                except ValueError:
+                    await self.respond(writer, 400, b"Bad request line", keep_alive=False)
+                    break
+                headers = {}
+                for line in header_lines:
+                    name, _, value = line.partition(":")
+                    if name:
+                        headers[name.strip().lower()] = value.strip()
+                keep_alive = (headers.get("connection", "").lower() != "close"
+                              and version == "HTTP/1.1")
+                self.requests += 1
+                if self.live and method == "GET" and urlsplit(target).path == "/stream":
+                    await self.stream(writer, target)
+                    break
+                try:
+                    status, body, content_type, extra = await self.dispatch(method, target, headers)
+                except HttpError as e:
+                    status, body, content_type, extra = e.status, str(e).encode(), "text/plain; charset=utf-8", []
+                except Exception as e:
+                    self.logger.error(f"HTTP API error on {target}: {e}")
+                    status, body, content_type, extra = 500, b"Internal error", "text/plain; charset=utf-8", []
+                await self.respond(writer, status, body, content_type, extra, keep_alive)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self.connections.discard(writer)
+            writer.close()
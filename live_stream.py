@@ -0,0 +1,152 @@
+"""Server-sent events of new samples and closed rollup buckets.
+
+A dashboard opens ``GET /stream`` on the HTTP API (optionally with
+``meter=a,b`` and ``fields=x,y``) and receives every new sample as an
+``event: sample`` message, and every closed rollup bucket as ``event:
+rollup``, as soon as the acquisition stores them:
+
+    event: sample
+    data: {"meter":"office","timestamp":"2024-05-07 14:03:00","total_real_power":18250.0}
+
+Each message is serialised once per distinct field selection, however many
+subscribers share it. Every subscriber has its own bounded queue: a client
+that cannot keep up gets only the newest message per meter (``conflate``)
+or loses the oldest ones, and is told how many with ``event: dropped``; it
+never holds up the acquisition or the other subscribers.
+"""
+import asyncio
+import json
+import logging
+from collections import OrderedDict
+from itertools import count
+
+HEARTBEAT = 15  # seconds between keep-alive comments on an idle stream
+
+
+class Subscriber:
+    """One open stream: its filter and its queue of encoded messages."""
+
+    def __init__(self, meters, fields, max_queued, conflate):
+        self.meters = set(meters) if meters else None
+        self.fields = tuple(fields)
+        self.max_queued = max_queued
+        self.conflate = conflate
+        self.queue = OrderedDict()
+        self.ready = asyncio.Event()
+        self.sequence = count()
+        self.dropped = 0
+
+    def put(self, key, message):
+        # Conflating keeps one slot per key (kind and meter, plus resolution
+        # for rollups), so a newer message replaces one not sent yet.
+        key = key if self.conflate else next(self.sequence)
+        if key in self.queue:
+            del self.queue[key]
+            self.dropped += 1
+        self.queue[key] = message
+        while len(self.queue) > self.max_queued:
+            self.queue.popitem(last=False)
+            self.dropped += 1
+        self.ready.set()
+
+    def take(self):
+        messages = list(self.queue.values())
+        self.queue.clear()
+        self.ready.clear()
+        if self.dropped:
+            messages.append(f'event: dropped\ndata: {{"count":{self.dropped}}}\n\n'.encode())
+            self.dropped = 0
+        return messages
+
+
+def sample_event(sample, fields):
+    body = {"meter": sample.get("meter"), "timestamp": sample["timestamp"],
+            **{name: sample.get(name) for name in fields}}
+    return f"event: sample\ndata: {json.dumps(body, separators=(',', ':'))}\n\n".encode()
+
+
+def rollup_event(meter, resolution, start, rows, fields):
+    body = {"meter": meter, "resolution": resolution, "start": start,
+            "fields": {row[3]: dict(zip(("min", "max", "mean", "last", "count"), row[4:]))
+                       for row in rows if row[3] in fields}}
+    return f"event: rollup\ndata: {json.dumps(body, separators=(',', ':'))}\n\n".encode()
+
+
+class LiveStream:
+    """Fans samples and rollup rows out to the open streams.
+
+    ``write`` is a sink like the others (called from a worker thread) and
+    ``write_rollups`` can be registered as a RollupEngine listener; both
+    encode in the calling thread and hand the messages to the event loop.
+    """
+
+    def __init__(self, fields, max_queued=100, conflate=True, logger: logging.Logger = None):
+        self.fields = tuple(fields)
+        self.max_queued = max_queued
+        self.conflate = conflate
+        self.logger = logger or logging.getLogger(__name__)
+        self.loop = asyncio.get_running_loop()
+        self.subscribers = set()
+        self.published = 0
+
+    def _encode(self, encode_one):
+        """Encode once per distinct field selection of the current subscribers."""
+        return {fields: encode_one(fields) for fields in {s.fields for s in list(self.subscribers)}}
+
+    def _deliver(self, messages):
+        # On the event loop: queue each message for the subscribers that want it.
+        for (kind, meter, *rest), encoded, encode_one in messages:
+            for subscriber in self.subscribers:
+                if subscriber.meters is None or meter in subscriber.meters:
+                    message = encoded.get(subscriber.fields)
+                    if message is None:  # subscribed after encoding
+                        message = encoded[subscriber.fields] = encode_one(subscriber.fields)
+                    subscriber.put((kind, meter, *rest), message)
+        self.published += len(messages)
+
+    def write(self, samples):
+        if not self.subscribers:
+            return
+        messages = []
+        for sample in samples:
+            def encode_one(fields, sample=sample):
+                return sample_event(sample, fields)
+            messages.append((("sample", sample.get("meter")), self._encode(encode_one), encode_one))
+        self.loop.call_soon_threadsafe(self._deliver, messages)
+
+    def write_rollups(self, rows):
+        """RollupEngine listener: ``rows`` are tuples ordered like ROLLUP_COLUMNS."""
+        if not self.subscribers:
+            return
+        buckets = {}
+        for row in rows:
+            buckets.setdefault(row[:3], []).append(row)
+        messages = []
+        for (meter, resolution, start), bucket_rows in buckets.items():
+            def encode_one(fields, key=(meter, resolution, start), bucket_rows=bucket_rows):
+                return rollup_event(*key, bucket_rows, fields)
+            messages.append((("rollup", meter, resolution), self._encode(encode_one), encode_one))
+        self.loop.call_soon_threadsafe(self._deliver, messages)
+
+    async def serve(self, writer, meters=None, fields=None):
+        """Stream to one client until it disconnects."""
+        subscriber = Subscriber(meters, fields or self.fields, self.max_queued, self.conflate)
+        self.subscribers.add(subscriber)
+        self.logger.info(f"Live stream opened ({len(self.subscribers)} open).")
+        try:
+            writer.write(b": connected\n\n")
+            await writer.drain()
+            while not writer.is_closing():
+                try:
+                    await asyncio.wait_for(subscriber.ready.wait(), HEARTBEAT)
+                    messages = subscriber.take()
+                except asyncio.TimeoutError:
+                    messages = [b": ping\n\n"]
+                writer.write(b"".join(messages))
+                # A slow client blocks here; meanwhile its queue conflates or drops.
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.subscribers.discard(subscriber)
+            self.logger.info(f"Live stream closed ({len(self.subscribers)} open).")
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""Simulated RX380 meters behind a loopback Modbus TCP stand-in server.
+
+Start it with ``python3 meter_simulator.py --port 5020 --slaves 1 2 3`` and add
+a ``modbus.ports`` entry with ``"host": "127.0.0.1", "tcp_port": 5020`` to
+poll it like a real RS485-to-Ethernet gateway.
+
+With ``--rtu`` the meters answer Modbus RTU on a pseudo-terminal instead
+(POSIX only); the printed device path goes in ``modbus.port`` like a USB
+RS485 adapter, and works for the minimalmodbus-based older versions too.
+"""
+import argparse
+import asyncio
+import math
+import os
+import random
+import struct
+import time
+
+from device_profile import DEFAULT_PROFILE, load_profile
+from modbus_rtu import crc16
+from modbus_tcp import MBAP_HEADER
+
+# Modbus exception codes
+ILLEGAL_FUNCTION = 1
+ILLEGAL_DATA_ADDRESS = 2
+ILLEGAL_DATA_VALUE = 3
+GATEWAY_TARGET_FAILED = 11
+
+
+class SimulatedMeter:
+    """Register bank holding plausible, slowly changing three-phase readings."""
+
+    def __init__(self, profile, seed=None, load_kw=20.0, strict=False):
+        self.profile = profile
+        self.random = random.Random(seed)
+        self.load = load_kw * 1000
+        self.phase = self.random.uniform(0, 2 * math.pi)
+        self.strict = strict
+        self.energy = self.random.uniform(1e4, 1e5)  # kWh
+        self.apparent_energy = self.energy * 1.08  # kVAh
+        self.reactive_energy = self.energy * 0.4  # kVARh
+        self.line_max = 0.0
+        self.line_min = float("inf")
+        self.updated = time.monotonic()
+        self.registers = {}
+        self.update()
+
+    def values(self, elapsed):
+        jitter = self.random.gauss
+        power = self.load * (1 + 0.3 * math.sin(time.time() / 60 + self.phase)) + jitter(0, 50)
+        power_factor = min(0.999, 0.92 + jitter(0, 0.005))
+        apparent = power / power_factor
+        reactive = math.sqrt(max(apparent ** 2 - power ** 2, 0))
+        # Counters only ever go up, like the meter's own registers.
+        self.energy += power * elapsed / 3.6e6
+        self.apparent_energy += apparent * elapsed / 3.6e6
+        self.reactive_energy += reactive * elapsed / 3.6e6
+        phase_voltages = [230 + jitter(0, 1) for _ in range(3)]
+        line_voltages = [v * math.sqrt(3) for v in phase_voltages]
+        self.line_max = max(self.line_max, *line_voltages)
+        self.line_min = min(self.line_min, *line_voltages)
+        currents = [apparent / 3 / v for v in phase_voltages]
+        values = {
+            "frequency": 50 + jitter(0, 0.02),
+            "total_real_power": power,
+            "total_apparent_power": apparent,
+            "total_reactive_power": reactive,
+            "total_power_factor": power_factor,
+            "total_real_energy": self.energy,
+            "total_apparent_energy": self.apparent_energy,
+            "total_reactive_energy": self.reactive_energy,
+            "current_ln": abs(jitter(0, 0.2)),
+        }
+        for n, (vp, vl, i) in enumerate(zip(phase_voltages, line_voltages, currents)):
+            line = ("l12", "l23", "l31")[n]
+            values[f"voltage_l{n + 1}"] = vp
+            values[f"voltage_{line}"] = vl
+            values[f"voltage_{line}_max"] = self.line_max
+            values[f"voltage_{line}_min"] = self.line_min
+            values[f"current_l{n + 1}"] = i
+        return values
+
+    def update(self):
+        now = time.monotonic()
+        self.registers = self.profile.encode(self.values(now - self.updated))
+        self.updated = now
+
+    def read(self, address, count):
+        """Register payload for a read, or None if the range is not mapped."""
+        self.update()
+        span = range(address, address + count)
+        if self.strict and any(a not in self.registers for a in span):
+            return None
+        return struct.pack(f">{count}H", *(self.registers.get(a, 0) for a in span))
+
+
+def respond(meters, unit, pdu):
+    """Answer one request PDU the way a gateway would."""
+    function_code = pdu[0]
+    meter = meters.get(unit)
+    if meter is None:
+        return bytes([function_code | 0x80, GATEWAY_TARGET_FAILED])
+    if function_code not in (3, 4) or len(pdu) != 5:
+        return bytes([function_code | 0x80, ILLEGAL_FUNCTION])
+    address, count = struct.unpack(">HH", pdu[1:])
+    if not 1 <= count <= 125:
+        return bytes([function_code | 0x80, ILLEGAL_DATA_VALUE])
+    payload = meter.read(address, count)
+    if payload is None:
+        return bytes([function_code | 0x80, ILLEGAL_DATA_ADDRESS])
+    return bytes([function_code, len(payload)]) + payload
+
+
+async def serve_tcp(meters, host="127.0.0.1", port=5020, response_delay=0.0, concurrent=False):
+    """Start a Modbus TCP stand-in serving ``meters`` (unit id -> SimulatedMeter).
+
+    ``response_delay`` emulates the RS485 hop behind a gateway. By default one
+    request per connection is answered at a time, like a gateway with a single
+    serial line; ``concurrent=True`` answers pipelined requests in parallel.
+    """
+    async def answer(writer, lock, header, pdu):
+        transaction_id, _, _, unit = MBAP_HEADER.unpack(header)
+        if response_delay:
+            await asyncio.sleep(response_delay)
+        response = respond(meters, unit, pdu)
+        async with lock:
+            writer.write(MBAP_HEADER.pack(transaction_id, 0, len(response) + 1, unit) + response)
+            await writer.drain()
+
+    async def handle(reader, writer):
+        lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while True:
+                header = await reader.readexactly(MBAP_HEADER.size)
+                pdu = await reader.readexactly(MBAP_HEADER.unpack(header)[2] - 1)
+                if concurrent:
+                    task = asyncio.create_task(answer(writer, lock, header, pdu))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                else:
+                    await answer(writer, lock, header, pdu)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
+
+
+class RtuLine:
+    """Meters answering Modbus RTU on the far end of a pseudo-terminal.
+
+    ``baudrate`` delays each reply by the time the request and response
+    frames would take on the wire (0 answers at once). Requests for unknown
+    slaves or with a bad CRC get no reply, like on a real RS485 bus.
+    """
+
+    def __init__(self, meters, baudrate=0):
+        import tty
+        self.meters = meters
+        self.baudrate = baudrate
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.path = os.ttyname(self.slave)
+        self.buffer = b""
+        self.requests = asyncio.Queue()
+
+    def _on_readable(self):
+        try:
+            self.buffer += os.read(self.master, 4096)
+        except OSError:
+            return
+        # Read requests are always 8 bytes: slave, function, address, count, CRC.
+        while len(self.buffer) >= 8:
+            frame, self.buffer = self.buffer[:8], self.buffer[8:]
+            if crc16(frame[:6]) != frame[6:]:
+                self.buffer = b""  # lost sync; wait for the next request
+                return
+            self.requests.put_nowait(frame)
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        loop.add_reader(self.master, self._on_readable)
+        try:
+            while True:
+                frame = await self.requests.get()
+                unit = frame[0]
+                if unit not in self.meters:
+                    continue
+                response = bytes([unit]) + respond(self.meters, unit, frame[1:6])
+                response += crc16(response)
+                if self.baudrate:
+                    await asyncio.sleep((len(frame) + len(response)) * 11 / self.baudrate)
+                os.write(self.master, response)
+        finally:
+            loop.remove_reader(self.master)
+
+    def close(self):
+        os.close(self.master)
+        os.close(self.slave)
+
+
+def simulated_meters(slaves, profile=None, seed=None):
+    profile = profile or load_profile(DEFAULT_PROFILE)
+    return {address: SimulatedMeter(profile, seed=None if seed is None else seed + address)
+            for address in slaves}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Simulated RX380 meters over Modbus TCP or RTU")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5020)
+    parser.add_argument("--slaves", type=int, nargs="+", default=[1])
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds per response")
+    parser.add_argument("--concurrent", action="store_true", help="answer pipelined requests in parallel")
+    parser.add_argument("--rtu", action="store_true", help="serve Modbus RTU on a pseudo-terminal")
+    parser.add_argument("--baud", type=int, default=0, help="RTU line speed to emulate (0: instant)")
+    args = parser.parse_args()
+
+    if args.rtu:
+        line = RtuLine(simulated_meters(args.slaves), args.baud)
+        print(f"Simulating slaves {args.slaves} on {line.path}", flush=True)
+        try:
+            await line.serve()
+        finally:
+            line.close()
+        return
+
+    server = await serve_tcp(simulated_meters(args.slaves), args.host, args.port,
+                             args.delay, args.concurrent)
+    print(f"Simulating slaves {args.slaves} on {args.host}:{args.port}", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
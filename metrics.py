@@ -0,0 +1,252 @@
+"""Counters, gauges and histograms in the Prometheus text format.
+
+Modules declare their metrics once at import time on the shared
+``REGISTRY`` and update them inline; an update is a dict lookup and a few
+integer operations under a lock, cheap enough to leave on. The HTTP API
+serves ``REGISTRY.render()`` on ``/metrics``.
+
+    MODBUS_SECONDS = REGISTRY.histogram("rx380_modbus_request_seconds", "...", ["port", "slave"])
+    MODBUS_SECONDS.labels("/dev/ttyUSB0", "1").observe(0.042)
+"""
+import abc
+import asyncio
+import bisect
+import threading
+import time
+
+# Seconds, from a fast Modbus TCP round trip up to a stuck SQL insert.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+def format_labels(names, values, extra=""):
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Timer:
+    """``with histogram.labels(...).time():`` observes the block's duration."""
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.started)
+
+
+class CounterChild:
+    __slots__ = ("value", "lock")
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+
+class HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "lock")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # per bucket, not cumulative; the last is +Inf
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        return Timer(self)
+
+
+class Metric(abc.ABC):
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        self.lock = threading.Lock()
+        if not self.labelnames:
+            self.labels()  # so an unlabelled metric shows up before its first update
+
+    @abc.abstractmethod
+    def new_child(self):
+        """A fresh child holding one label combination's value."""
+
+    def labels(self, *values):
+        values = tuple(str(value) for value in values)
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}")
+            with self.lock:
+                child = self.children.setdefault(values, self.new_child())
+        return child
+
+    @abc.abstractmethod
+    def samples(self):
+        """(suffix, label values, extra label, value) for each line to render."""
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, values, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{format_labels(self.labelnames, values, extra)} "
+                         f"{format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    """Registered under its sample name, which ends in ``_total``."""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        if not name.endswith("_total"):
+            raise ValueError(f"counter {name} must end in _total")
+        super().__init__(name, help_text, labelnames)
+
+    def new_child(self):
+        return CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def samples(self):
+        for values, child in list(self.children.items()):
+            yield "", values, "", child.value
+
+
+class Gauge(Metric):
+    """Set directly, or computed at scrape time by ``set_function``."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.function = None
+        super().__init__(name, help_text, labelnames)
+
+    def new_child(self):
+        return GaugeChild()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def set_function(self, function):
+        """``function()`` returns a number, or {label values tuple: number}."""
+        self.function = function
+
+    def samples(self):
+        if self.function is not None:
+            try:
+                result = self.function()
+            except Exception:
+                return
+            if not isinstance(result, dict):
+                result = {(): result}
+            for values, value in result.items():
+                if value is not None:
+                    yield "", tuple(map(str, values)), "", value
+            return
+        for values, child in list(self.children.items()):
+            yield "", values, "", child.value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help_text, labelnames)
+
+    def new_child(self):
+        return HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def samples(self):
+        for values, child in list(self.children.items()):
+            with child.lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield "_bucket", values, f'le="{format_value(float(bound))}"', cumulative
+            yield "_sum", values, "", total
+            yield "_count", values, "", cumulative
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def _add(self, metric):
+        # Re-declaring a metric (e.g. a module imported twice) returns the first.
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._add(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._add(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help_text, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+LOOP_LAG_SECONDS = REGISTRY.histogram(
+    "rx380_event_loop_lag_seconds", "How late the event loop woke a sleeping task.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+
+
+async def monitor_loop_lag(interval=0.5):
+    """Sleep ``interval`` seconds at a time and record how much longer it took."""
+    while True:
+        started = time.monotonic()
+        await asyncio.sleep(interval)
+        LOOP_LAG_SECONDS.observe(max(time.monotonic() - started - interval, 0.0))
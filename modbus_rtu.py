@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import struct
+import time
+
+import serial
+
+
+class ModbusError(IOError):
+    """A transaction failed: timeout, bad CRC, or an exception response."""
+
+
+class ModbusTimeout(ModbusError):
+    pass
+
+
+class ModbusCRCError(ModbusError):
+    pass
+
+
+class ModbusExceptionResponse(ModbusError):
+    """The slave answered with a Modbus exception ``code``."""
+
+    def __init__(self, slave, code):
+        super().__init__(f"Slave {slave} returned exception code {code}")
+        self.code = code
+
+
+def _crc_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+_CRC_TABLE = _crc_table()
+
+
+def crc16(frame):
+    """Modbus RTU CRC-16, returned as the two bytes sent on the wire (low byte first)."""
+    crc = 0xFFFF
+    for byte in frame:
+        crc = (crc >> 8) ^ _CRC_TABLE[(crc ^ byte) & 0xFF]
+    return struct.pack("<H", crc)
+
+
+def rtu_frame_silence(baudrate, bits_per_char=11):
+    """Minimum idle time between RTU frames (3.5 character times).
+
+    Above 19200 baud the Modbus spec fixes the gap at 1.75 ms.
+    """
+    if baudrate > 19200:
+        return 0.00175
+    return 3.5 * bits_per_char / baudrate
+
+
+def read_request(slave, address, count, function_code=4):
+    """Build an FC3/FC4 read request frame, CRC included."""
+    pdu = struct.pack(">BBHH", slave, function_code, address, count)
+    return pdu + crc16(pdu)
+
+
+def expected_length(buffer):
+    """Full length of a read response once its header has arrived, else None."""
+    if len(buffer) < 3:
+        return None
+    if buffer[1] & 0x80:
+        return 5  # address, function | 0x80, exception code, CRC
+    return 5 + buffer[2]  # address, function, byte count, data, CRC
+
+
+def parse_read_response(frame, slave, function_code, count):
+    """Check a complete response frame and return its register payload."""
+    if crc16(frame[:-2]) != frame[-2:]:
+        raise ModbusCRCError(f"CRC error in response from slave {slave}")
+    if frame[0] != slave:
+        raise ModbusError(f"Response from slave {frame[0]}, expected {slave}")
+    if frame[1] == function_code | 0x80:
+        raise ModbusExceptionResponse(slave, frame[2])
+    if frame[1] != function_code or frame[2] != 2 * count:
+        raise ModbusError(f"Malformed response from slave {slave}")
+    return bytes(frame[3:-2])
+
+
+class RtuTransport:
+    """Modbus RTU master that runs the serial line on the asyncio event loop.
+
+    The port is opened non-blocking and watched with ``loop.add_reader``, so a
+    transaction costs no thread handoff. Framing, CRC and the 3.5 character
+    inter-frame silence are handled here. Needs a selector event loop with
+    file descriptor support (Linux / Raspberry Pi OS).
+    """
+
+    # A serial line carries one transaction at a time.
+    pipelined = False
+
+    def __init__(self, port, baudrate=19200, bytesize=8, parity="E", stopbits=1,
+                 timeout=1, logger: logging.Logger = None):
+        self.port = port
+        self.timeout = timeout
+        self.logger = logger or logging.getLogger(__name__)
+        self.serial = serial.Serial(port, baudrate=baudrate, bytesize=bytesize, parity=parity,
+                                    stopbits=stopbits, timeout=0)
+        self.frame_silence = rtu_frame_silence(baudrate)
+        self.lock = asyncio.Lock()
+        self._idle_since = 0.0
+        self._buffer = bytearray()
+        self._response = None
+
+    def close(self):
+        self.serial.close()
+
+    def _on_readable(self):
+        try:
+            self._buffer += self.serial.read(self.serial.in_waiting or 1)
+        except serial.SerialException as e:
+            if self._response is not None and not self._response.done():
+                self._response.set_exception(ModbusError(f"Serial error on {self.port}: {e}"))
+            return
+        self._idle_since = time.monotonic()
+        length = expected_length(self._buffer)
+        if (length is not None and len(self._buffer) >= length
+                and self._response is not None and not self._response.done()):
+            self._response.set_result(bytes(self._buffer[:length]))
+
+    async def transact(self, request, timeout=None):
+        """Send one request frame and wait for the complete response frame."""
+        loop = asyncio.get_running_loop()
+        async with self.lock:
+            idle = self._idle_since + self.frame_silence - time.monotonic()
+            if idle > 0:
+                await asyncio.sleep(idle)
+            self.serial.reset_input_buffer()
+            self._buffer.clear()
+            self._response = loop.create_future()
+            loop.add_reader(self.serial.fileno(), self._on_readable)
+            try:
+                self.serial.write(request)
+                return await asyncio.wait_for(self._response, timeout or self.timeout)
+            except asyncio.TimeoutError:
+                raise ModbusTimeout(f"No complete response on {self.port} "
+                                    f"({len(self._buffer)} bytes received)") from None
+            finally:
+                loop.remove_reader(self.serial.fileno())
+                self._response = None
+                self._idle_since = time.monotonic()
+
+    async def read_registers(self, slave, address, count, function_code=4, timeout=None):
+        """Read ``count`` registers; returns the raw big-endian payload bytes."""
+        frame = await self.transact(read_request(slave, address, count, function_code), timeout)
+        return parse_read_response(frame, slave, function_code, count)
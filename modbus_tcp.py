@@ -0,0 +1,140 @@
+import asyncio
+import itertools
+import logging
+import struct
+import time
+
+from modbus_rtu import ModbusError, ModbusExceptionResponse, ModbusTimeout
+
+MBAP_HEADER = struct.Struct(">HHHB")  # transaction id, protocol id, length, unit id
+
+
+def parse_read_pdu(pdu, slave, function_code, count):
+    """Check a read response PDU and return its register payload."""
+    if pdu[0] == function_code | 0x80:
+        raise ModbusExceptionResponse(slave, pdu[1])
+    if pdu[0] != function_code or pdu[1] != 2 * count or len(pdu) != 2 + 2 * count:
+        raise ModbusError(f"Malformed response from slave {slave}")
+    return bytes(pdu[2:])
+
+
+class ModbusTcpTransport:
+    """Modbus TCP master keeping one persistent connection to a gateway.
+
+    Up to ``max_in_flight`` transactions are written without waiting for the
+    previous answer and matched back by transaction id. Gateways that forward
+    to a single RS485 line usually want ``max_in_flight`` of 1. A lost
+    connection is re-opened on the next request, with the delay between
+    attempts doubling up to ``max_reconnect_delay``.
+    """
+
+    def __init__(self, host, port=502, timeout=1, max_in_flight=1, reconnect_delay=1,
+                 max_reconnect_delay=60, logger: logging.Logger = None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.max_in_flight = max_in_flight
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.logger = logger or logging.getLogger(__name__)
+        self.slots = asyncio.Semaphore(max_in_flight)
+        self._connect_lock = asyncio.Lock()
+        self._transaction_ids = itertools.cycle(range(1, 0x10000))
+        self._pending = {}
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._delay = reconnect_delay
+        self._retry_at = 0.0
+
+    @property
+    def pipelined(self):
+        return self.max_in_flight > 1
+
+    @property
+    def connected(self):
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self):
+        async with self._connect_lock:
+            if self.connected:
+                return
+            wait = self._retry_at - time.monotonic()
+            if wait > 0:
+                raise ModbusError(f"Gateway {self.host}:{self.port} down, reconnecting in {wait:.0f}s")
+            try:
+                self._reader, self._writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port), self.timeout
+                )
+            except (OSError, asyncio.TimeoutError) as e:
+                self._retry_at = time.monotonic() + self._delay
+                self._delay = min(self._delay * 2, self.max_reconnect_delay)
+                raise ModbusError(f"Cannot connect to gateway {self.host}:{self.port}: {e!r}") from None
+            self._delay = self.reconnect_delay
+            self._reader_task = asyncio.create_task(self._read_responses())
+            self.logger.info(f"Connected to Modbus TCP gateway {self.host}:{self.port}.")
+
+    def close(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+        self._writer = None
+        self._fail_pending(ModbusError(f"Connection to {self.host}:{self.port} closed"))
+
+    def _fail_pending(self, error):
+        for future, _ in self._pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self._pending.clear()
+
+    async def _read_responses(self):
+        try:
+            while True:
+                header = await self._reader.readexactly(MBAP_HEADER.size)
+                transaction_id, protocol_id, length, unit_id = MBAP_HEADER.unpack(header)
+                # length counts the unit id and a PDU of 1 to 253 bytes.
+                if protocol_id != 0 or not 2 <= length <= 254:
+                    raise ModbusError(f"Bad MBAP header (protocol {protocol_id}, length {length})")
+                pdu = await self._reader.readexactly(length - 1)
+                future, slave = self._pending.get(transaction_id, (None, None))
+                if future is not None and unit_id != slave:
+                    raise ModbusError(f"Response from unit {unit_id} to a request for unit {slave}")
+                self._pending.pop(transaction_id, None)
+                if future is not None and not future.done():
+                    future.set_result(pdu)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # A broken stream cannot be resynchronised: drop it and reconnect.
+            self.logger.warning(f"Lost connection to gateway {self.host}:{self.port}: {e!r}")
+            if self._writer is not None:
+                self._writer.close()
+            self._writer = None
+            self._retry_at = time.monotonic() + self._delay
+            self._fail_pending(ModbusError(f"Connection to {self.host}:{self.port} lost"))
+
+    async def read_registers(self, slave, address, count, function_code=4, timeout=None):
+        """Read ``count`` registers; returns the raw big-endian payload bytes."""
+        async with self.slots:
+            await self.connect()
+            writer = self._writer
+            transaction_id = next(self._transaction_ids)
+            pdu = struct.pack(">BHH", function_code, address, count)
+            future = asyncio.get_running_loop().create_future()
+            self._pending[transaction_id] = future, slave
+            try:
+                writer.write(MBAP_HEADER.pack(transaction_id, 0, len(pdu) + 1, slave) + pdu)
+                await writer.drain()
+                response = await asyncio.wait_for(future, timeout or self.timeout)
+            except asyncio.TimeoutError:
+                raise ModbusTimeout(f"No response from slave {slave} via {self.host}:{self.port}") from None
+            except ModbusError:
+                # Set on the future by the reader when the connection drops;
+                # ModbusError is an OSError, so let it through unchanged.
+                raise
+            except OSError as e:
+                raise ModbusError(f"Send to {self.host}:{self.port} failed: {e!r}") from None
+            finally:
+                self._pending.pop(transaction_id, None)
+        return parse_read_pdu(response, slave, function_code, count)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""Minimal local MQTT 3.1.1 broker stand-in for trying out the MQTT sink.
+
+Start it with ``python3 mqtt_broker.py --port 1883 --print`` and enable the
+watchdog's ``mqtt`` section with ``"host": "127.0.0.1"``. It accepts any
+client, acknowledges QoS 1 publishes, forwards messages to subscribers
+(``+``/``#`` wildcards, delivered at QoS 0) and remembers which client ids
+had a persistent session. It is not a real broker: no retained messages,
+no QoS 2, no authentication.
+"""
+import argparse
+import asyncio
+import struct
+
+from mqtt_sink import (CONNACK, CONNECT, DISCONNECT, PINGREQ, PINGRESP, PUBACK, PUBLISH,
+                       MqttError, packet, publish_packet, read_packet)
+
+SUBSCRIBE, SUBACK = 8, 9
+
+
+def topic_matches(pattern, topic):
+    pattern_parts, topic_parts = pattern.split("/"), topic.split("/")
+    for index, part in enumerate(pattern_parts):
+        if part == "#":
+            return True
+        if index >= len(topic_parts) or part not in ("+", topic_parts[index]):
+            return False
+    return len(pattern_parts) == len(topic_parts)
+
+
+class Broker:
+    """Keeps the received messages (topic, payload, qos) for inspection."""
+
+    def __init__(self, print_messages=False):
+        self.messages = []
+        self.sessions = set()  # client ids with a persistent session
+        self.subscriptions = {}  # writer -> topic filters
+        self.print_messages = print_messages
+        self.ack_publishes = True  # False: swallow QoS 1 publishes without a PUBACK
+
+    async def handle(self, reader, writer):
+        try:
+            kind, _, body = await read_packet(reader)
+            if kind != CONNECT:
+                return
+            flags = body[7]
+            client_id_length = struct.unpack(">H", body[10:12])[0]
+            client_id = body[12:12 + client_id_length].decode()
+            present = not flags & 0x02 and client_id in self.sessions
+            if not flags & 0x02:
+                self.sessions.add(client_id)
+            writer.write(packet(CONNACK, 0, bytes([1 if present else 0, 0])))
+            while True:
+                kind, flags, body = await read_packet(reader)
+                if kind == PUBLISH:
+                    qos = flags >> 1 & 0x03
+                    topic_length = struct.unpack(">H", body[:2])[0]
+                    topic = body[2:2 + topic_length].decode()
+                    offset = 2 + topic_length + (2 if qos else 0)
+                    payload = body[offset:]
+                    self.messages.append((topic, payload, qos))
+                    if self.print_messages:
+                        print(f"{topic} ({len(payload)} bytes): {payload[:200].decode(errors='replace')}")
+                    if qos and self.ack_publishes:
+                        writer.write(packet(PUBACK, 0, body[2 + topic_length:offset]))
+                    for subscriber, filters in list(self.subscriptions.items()):
+                        if any(topic_matches(pattern, topic) for pattern in filters):
+                            subscriber.write(publish_packet(topic, payload))
+                elif kind == SUBSCRIBE:
+                    packet_id, position, granted = body[:2], 2, []
+                    while position < len(body):
+                        length = struct.unpack(">H", body[position:position + 2])[0]
+                        self.subscriptions.setdefault(writer, []).append(
+                            body[position + 2:position + 2 + length].decode())
+                        position += 3 + length
+                        granted.append(0)
+                    writer.write(packet(SUBACK, 0, packet_id + bytes(granted)))
+                elif kind == PINGREQ:
+                    writer.write(packet(PINGRESP, 0, b""))
+                elif kind == DISCONNECT:
+                    return
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, MqttError):
+            pass
+        finally:
+            self.subscriptions.pop(writer, None)
+            writer.close()
+
+
+async def serve(host="127.0.0.1", port=1883, print_messages=False):
+    """Start a broker stand-in; returns (Broker, asyncio server)."""
+    broker = Broker(print_messages)
+    server = await asyncio.start_server(broker.handle, host, port)
+    return broker, server
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Local MQTT broker stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--print", action="store_true", help="print every published message")
+    args = parser.parse_args()
+    _, server = await serve(args.host, args.port, args.print)
+    print(f"MQTT broker stand-in on {args.host}:{args.port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+
@@ -0,0 +1,379 @@
+"""Publishes samples to an MQTT broker, a batch per meter at a time.
+
+Samples are queued (on disk in a SqlSpool, or in memory) as they are
+stored, and every ``batch_interval`` seconds each meter's queued samples go
+out as one message on ``<topic_prefix>/<meter>``. The payload is
+column-oriented JSON, like the HTTP API's:
+
+    {"meter":"office","timestamp":["2024-05-07 14:03:00",...],"total_real_power":[18250.0,...],...}
+
+The client speaks just enough MQTT 3.1.1 for this (CONNECT, PUBLISH with
+QoS 0 or 1, PINGREQ) over one persistent connection, with a persistent
+session (clean session off) under a fixed client id. Queued samples are
+only removed once the broker has acknowledged them (QoS 1) or they were
+written to the socket (QoS 0), so a broker outage delays messages instead
+of losing them; after a reconnect a batch may be delivered twice.
+``mqtt_broker.py`` is a local stand-in broker for trying it out.
+"""
+import asyncio
+import collections
+import itertools
+import json
+import logging
+import struct
+import threading
+import time
+
+from sql_spool import SqlSpool
+
+# Control packet types (high nibble of the first byte)
+CONNECT, CONNACK, PUBLISH, PUBACK = 1, 2, 3, 4
+PINGREQ, PINGRESP, DISCONNECT = 12, 13, 14
+
+CONNACK_ERRORS = {1: "unacceptable protocol version", 2: "client id rejected", 3: "server unavailable",
+                  4: "bad user name or password", 5: "not authorized"}
+
+
+class MqttError(Exception):
+    pass
+
+
+def encode_length(length):
+    """MQTT variable-length 'remaining length'."""
+    encoded = bytearray()
+    while True:
+        length, digit = divmod(length, 128)
+        encoded.append(digit | (0x80 if length else 0))
+        if not length:
+            return bytes(encoded)
+
+
+def encode_string(text):
+    data = text.encode() if isinstance(text, str) else text
+    return struct.pack(">H", len(data)) + data
+
+
+def packet(kind, flags, body):
+    return bytes([kind << 4 | flags]) + encode_length(len(body)) + body
+
+
+async def read_packet(reader):
+    """(type, flags, body) of the next control packet."""
+    first = (await reader.readexactly(1))[0]
+    length = shift = 0
+    while True:
+        digit = (await reader.readexactly(1))[0]
+        length |= (digit & 0x7F) << shift
+        if not digit & 0x80:
+            break
+        shift += 7
+        if shift > 21:
+            raise MqttError("Malformed remaining length")
+    return first >> 4, first & 0x0F, await reader.readexactly(length)
+
+
+def connect_packet(client_id, keepalive, clean_session=False, username=None, password=None):
+    flags = (0x02 if clean_session else 0) | (0x80 if username else 0) | (0x40 if password else 0)
+    body = encode_string("MQTT") + bytes([4, flags]) + struct.pack(">H", keepalive) + encode_string(client_id)
+    if username:
+        body += encode_string(username)
+    if password:
+        body += encode_string(password)
+    return packet(CONNECT, 0, body)
+
+
+def publish_packet(topic, payload, qos=0, retain=False, packet_id=None, dup=False):
+    flags = (0x08 if dup else 0) | qos << 1 | (0x01 if retain else 0)
+    body = encode_string(topic) + (struct.pack(">H", packet_id) if qos else b"") + payload
+    return packet(PUBLISH, flags, body)
+
+
+class MqttClient:
+    """One persistent MQTT 3.1.1 connection, reopened on demand with backoff."""
+
+    def __init__(self, host, port=1883, client_id="rx380-watchdog", keepalive=60, clean_session=False,
+                 username=None, password=None, timeout=10, reconnect_delay=1, max_reconnect_delay=300,
+                 logger: logging.Logger = None):
+        self.host = host
+        self.port = port
+        self.client_id = client_id
+        self.keepalive = keepalive
+        self.clean_session = clean_session
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.logger = logger or logging.getLogger(__name__)
+        self._packet_ids = itertools.cycle(range(1, 0x10000))
+        self._pending = {}
+        self._reader = None
+        self._writer = None
+        self._tasks = []
+        self._connect_lock = asyncio.Lock()
+        self._delay = reconnect_delay
+        self._retry_at = 0.0
+        self._last_sent = 0.0
+
+    @property
+    def connected(self):
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self):
+        async with self._connect_lock:
+            if self.connected:
+                return
+            wait = self._retry_at - time.monotonic()
+            if wait > 0:
+                raise MqttError(f"Broker {self.host}:{self.port} down, reconnecting in {wait:.0f}s")
+            try:
+                self._reader, self._writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port), self.timeout
+                )
+                self._writer.write(connect_packet(self.client_id, self.keepalive, self.clean_session,
+                                                  self.username, self.password))
+                await self._writer.drain()
+                kind, _, body = await asyncio.wait_for(read_packet(self._reader), self.timeout)
+                if kind != CONNACK or len(body) != 2:
+                    raise MqttError("Expected CONNACK")
+                if body[1]:
+                    raise MqttError(f"Connection refused: {CONNACK_ERRORS.get(body[1], body[1])}")
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, MqttError) as e:
+                self._drop(e)
+                raise MqttError(f"Cannot connect to broker {self.host}:{self.port}: {e!r}") from None
+            self._delay = self.reconnect_delay
+            self._last_sent = time.monotonic()
+            self._tasks = [asyncio.create_task(self._read_packets()), asyncio.create_task(self._ping())]
+            session = "resumed" if body[0] & 0x01 else "new"
+            self.logger.info(f"Connected to MQTT broker {self.host}:{self.port} ({session} session).")
+
+    def _drop(self, error):
+        """Forget the connection and fail everything waiting on it."""
+        if self._writer is not None:
+            self._writer.close()
+        self._writer = None
+        self._retry_at = time.monotonic() + self._delay
+        self._delay = min(self._delay * 2, self.max_reconnect_delay)
+        for task in self._tasks:
+            if task is not asyncio.current_task():
+                task.cancel()
+        self._tasks = []
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(MqttError(f"Connection to {self.host}:{self.port} lost: {error!r}"))
+        self._pending.clear()
+
+    async def _read_packets(self):
+        try:
+            while True:
+                kind, _, body = await read_packet(self._reader)
+                if kind == PUBACK:
+                    future = self._pending.pop(struct.unpack(">H", body[:2])[0], None)
+                    if future is not None and not future.done():
+                        future.set_result(None)
+        except (asyncio.IncompleteReadError, OSError, MqttError) as e:
+            self.logger.warning(f"Lost connection to MQTT broker {self.host}:{self.port}: {e!r}")
+            self._drop(e)
+
+    async def _ping(self):
+        # The broker drops a client silent for 1.5x keepalive.
+        while True:
+            await asyncio.sleep(max(self.keepalive / 2 - (time.monotonic() - self._last_sent), 1))
+            if time.monotonic() - self._last_sent >= self.keepalive / 2:
+                try:
+                    await self._send(packet(PINGREQ, 0, b""))
+                except OSError as e:
+                    self._drop(e)
+                    return
+
+    async def _send(self, data):
+        self._writer.write(data)
+        self._last_sent = time.monotonic()
+        await self._writer.drain()
+
+    async def publish(self, topic, payload, qos=0, retain=False):
+        """Publish one message; with QoS 1, returns once the broker acknowledged it."""
+        await self.connect()
+        if qos == 0:
+            try:
+                await self._send(publish_packet(topic, payload, 0, retain))
+            except OSError as e:
+                self._drop(e)
+                raise MqttError(f"Publish to {self.host}:{self.port} failed: {e!r}") from None
+            return
+        packet_id = next(self._packet_ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[packet_id] = future
+        try:
+            await self._send(publish_packet(topic, payload, qos, retain, packet_id))
+            await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self._drop(TimeoutError("no PUBACK"))
+            raise MqttError(f"No PUBACK from {self.host}:{self.port}") from None
+        except OSError as e:
+            self._drop(e)
+            raise MqttError(f"Publish to {self.host}:{self.port} failed: {e!r}") from None
+        finally:
+            self._pending.pop(packet_id, None)
+
+    async def disconnect(self):
+        if self.connected:
+            try:
+                await self._send(packet(DISCONNECT, 0, b""))
+            except OSError:
+                pass
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        if self._writer is not None:
+            self._writer.close()
+        self._writer = None
+
+
+class MemoryQueue:
+    """In-memory stand-in for SqlSpool: the newest ``max_samples`` samples."""
+
+    def __init__(self, max_samples=100000, logger: logging.Logger = None):
+        self.max_samples = max_samples
+        self.logger = logger or logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.items = collections.deque()
+        self.ids = itertools.count()
+        self.added = asyncio.Event()
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, samples):
+        with self.lock:
+            self.items.extend(zip(self.ids, samples))
+            excess = len(self.items) - self.max_samples
+            for _ in range(max(excess, 0)):
+                self.items.popleft()
+        if excess > 0:
+            self.logger.warning(f"MQTT buffer full; dropped {excess} oldest samples.")
+
+    async def peek(self, limit):
+        with self.lock:
+            items = list(itertools.islice(self.items, limit))
+        return [item_id for item_id, _ in items], [sample for _, sample in items]
+
+    async def ack(self, ids):
+        done = set(ids)
+        with self.lock:
+            while self.items and self.items[0][0] in done:
+                done.discard(self.items.popleft()[0])
+            if done:
+                # Behind a message that failed; keep the rest in order.
+                self.items = collections.deque(item for item in self.items if item[0] not in done)
+
+    def close(self):
+        pass
+
+
+def encode_batch(meter, samples):
+    """Column-oriented JSON for one meter's samples."""
+    fields = list(dict.fromkeys(name for sample in samples for name in sample if name != "meter"))
+    body = {"meter": meter, **{name: [sample.get(name) for sample in samples] for name in fields}}
+    return json.dumps(body, separators=(",", ":")).encode()
+
+
+class MqttPublisher:
+    """Store sink that publishes queued samples in per-meter batches.
+
+    ``write`` (blocking, from a worker thread) queues samples; ``run``
+    publishes them every ``batch_interval`` seconds, at most ``batch_size``
+    samples per message, and retries with backoff while the broker is down.
+    """
+
+    def __init__(self, cfg, logger: logging.Logger = None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.topic_prefix = cfg.get("topic_prefix", "rx380").rstrip("/")
+        self.qos = cfg.get("qos", 1)
+        if self.qos not in (0, 1):
+            raise ValueError("mqtt.qos must be 0 or 1")
+        self.retain = cfg.get("retain", False)
+        self.batch_interval = cfg.get("batch_interval", 5)
+        self.batch_size = cfg.get("batch_size", 100)
+        self.max_batch = cfg.get("max_batch", 5000)
+        self.retry_interval = cfg.get("retry_interval", 5)
+        self.max_retry_interval = cfg.get("max_retry_interval", 300)
+        if cfg.get("buffer", "disk") == "disk":
+            self.queue = SqlSpool(cfg["spool_path"], cfg.get("max_mb", 50) * 1024 * 1024, self.logger)
+        else:
+            self.queue = MemoryQueue(cfg.get("max_buffered", 100000), self.logger)
+        self.client = MqttClient(
+            cfg.get("host", "127.0.0.1"), cfg.get("port", 1883),
+            client_id=cfg.get("client_id", "rx380-watchdog"),
+            keepalive=cfg.get("keepalive", 60),
+            username=cfg.get("username"), password=cfg.get("password"),
+            timeout=cfg.get("timeout", 10),
+            logger=self.logger
+        )
+        self.loop = asyncio.get_running_loop()
+        self.published = 0
+
+    def write(self, samples):
+        self.queue.put(samples)
+        self.loop.call_soon_threadsafe(self.queue.added.set)
+
+    async def publish_batch(self, ids, samples):
+        """Publish queued samples and ack those whose message went out.
+
+        Returns the number of messages; if any failed, raises the first
+        error once the others are acked, so only the failed ones are retried.
+        """
+        by_meter = {}
+        for item_id, sample in zip(ids, samples):
+            by_meter.setdefault(sample.get("meter") or "meter", []).append((item_id, sample))
+        chunks = [(meter, items[i:i + self.batch_size])
+                  for meter, items in by_meter.items()
+                  for i in range(0, len(items), self.batch_size)]
+        # QoS 1 messages are in flight together.
+        results = await asyncio.gather(
+            *(self.client.publish(f"{self.topic_prefix}/{meter}",
+                                  encode_batch(meter, [sample for _, sample in chunk]), self.qos, self.retain)
+              for meter, chunk in chunks),
+            return_exceptions=True)
+        published = [item_id for (_, chunk), result in zip(chunks, results)
+                     if not isinstance(result, BaseException) for item_id, _ in chunk]
+        if published:
+            await self.queue.ack(published)
+            self.published += len(published)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            raise errors[0]
+        return len(chunks)
+
+    async def run(self):
+        delay = self.retry_interval
+        while True:
+            self.queue.added.clear()
+            ids, samples = await self.queue.peek(self.max_batch)
+            if not ids:
+                await self.queue.added.wait()
+                # Let a batch accumulate.
+                await asyncio.sleep(self.batch_interval)
+                continue
+            try:
+                count = await self.publish_batch(ids, samples)
+            except Exception as e:
+                self.logger.error(f"MQTT publish error, {len(self.queue)} samples buffered: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_retry_interval)
+                continue
+            delay = self.retry_interval
+            self.logger.debug(f"Published {len(ids)} samples in {count} MQTT messages.")
+            if len(ids) < self.max_batch:
+                await asyncio.sleep(self.batch_interval)
+
+    async def close(self):
+        """Try to publish what is still queued, then disconnect."""
+        ids, samples = await self.queue.peek(self.max_batch)
+        if ids:
+            try:
+                await asyncio.wait_for(self.publish_batch(ids, samples), self.client.timeout)
+            except Exception as e:
+                self.logger.warning(f"{len(self.queue)} samples left unpublished at shutdown: {e}")
+        await self.client.disconnect()
+        self.queue.close()
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""Typed, columnar daily archive: rx380_data_YYYY-MM-DD.parquet.
+
+One file per day. While the day is live each hour is written to its own
+part file, rx380_data_YYYY-MM-DD_partNNN.parquet; once the day is over the
+parts are compacted into the day file in large, time-sorted row groups. ``timestamp`` is int64 epoch
+seconds, ``meter`` a dictionary-encoded string and every measurement float32,
+except cumulative energy counters, which stay float64 so large register
+values keep their whole-kWh resolution. Readers only touch the columns and
+hours they ask for:
+
+    from parquet_archive import read_archive
+    df = read_archive(folder, columns=["total_real_power"],
+                      start="2024-05-01", end="2024-06-01").to_pandas()
+
+Existing CSV logs can be converted with
+``python3 parquet_archive.py convert <folder or files>``.
+"""
+import argparse
+import csv
+import logging
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from device_profile import DEFAULT_PROFILE, load_profile
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def archive_schema(profiles):
+    """Arrow schema for the union of the profiles' fields, with units as metadata."""
+    fields = [pa.field("timestamp", pa.int64()), pa.field("meter", pa.dictionary(pa.int32(), pa.string()))]
+    seen = set()
+    for profile in profiles:
+        for name in profile.output_fields:
+            if name in seen:
+                continue
+            seen.add(name)
+            unit = profile.units.get(name, "")
+            kind = pa.float64() if unit.endswith("h") else pa.float32()
+            fields.append(pa.field(name, kind, metadata={"unit": unit}))
+    return pa.schema(fields)
+
+
+def merged_parts(path):
+    """Names of the part files already merged into the day file at ``path``."""
+    if not path.is_file():
+        return set()
+    metadata = pq.read_schema(path).metadata or {}
+    return set(metadata.get(b"rx380_parts", b"").decode().split())
+
+
+def epoch_seconds(value):
+    """Local-time datetime or "YYYY-MM-DD[ HH:MM:SS]" string as epoch seconds."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return int(value.timestamp())
+
+
+class ParquetArchive:
+    """Buffers the current hour of samples and writes it as one part file.
+
+    Parquet files cannot be appended to in place, so each finished hour goes
+    to a new part file of its day, written to a temporary name and renamed,
+    and a commit only costs the hour it writes. Files on disk are always
+    complete; a crash loses at most the buffered hour, which is still in the
+    CSV log.
+
+    Many small files are slow to read back, so once a day is over its parts
+    are merged into the day's file, sorted by time in row groups of
+    ``compact_rows``; their timestamp statistics still let readers skip what
+    they do not need. Blocking: call it from worker threads. Every method
+    holds a lock, so the periodic ``commit_if_due`` can run beside ``write``.
+    """
+
+    def __init__(self, folder, schema, prefix="rx380_data", compression="zstd",
+                 compact_rows=65536, logger: logging.Logger = None):
+        self.folder = Path(folder).expanduser()
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.schema = schema
+        self.prefix = prefix
+        self.compression = compression
+        self.compact_rows = compact_rows
+        self.logger = logger or logging.getLogger(__name__)
+        self.lock = threading.RLock()
+        self.hour = None
+        self.columns = {name: [] for name in schema.names}
+
+    def path_for(self, day):
+        return self.folder / f"{self.prefix}_{day}.parquet"
+
+    def parts(self, day="*"):
+        """Part files not yet compacted, of ``day`` or of every day."""
+        return sorted(self.folder.glob(f"{self.prefix}_{day}_part*.parquet"))
+
+    def write(self, samples):
+        with self.lock:
+            for sample in samples:
+                hour = sample["timestamp"][:13]
+                if hour != self.hour:
+                    self._advance(hour)
+                    self.hour = hour
+                for name, column in self.columns.items():
+                    column.append(sample.get(name))
+
+    def commit_if_due(self, now=None):
+        """Commit the buffered hour once the wall clock has left it."""
+        hour = (now or datetime.now()).strftime("%Y-%m-%d %H")
+        with self.lock:
+            if hour != self.hour:
+                self._advance(hour)
+
+    def _advance(self, hour):
+        self.commit()
+        # Also catches days left over from before a restart.
+        for day in sorted({path.stem[len(self.prefix) + 1:][:10] for path in self.parts()}):
+            if day < hour[:10]:
+                self.compact(day)
+
+    def commit(self):
+        with self.lock:
+            if not self.columns["timestamp"]:
+                return
+            columns = dict(self.columns, timestamp=[
+                int(datetime.strptime(ts, TIMESTAMP_FORMAT).timestamp()) for ts in self.columns["timestamp"]
+            ])
+            table = pa.Table.from_pydict(columns, schema=self.schema)
+            day = self.hour[:10]
+            # Never reuse a merged part's name, or compact() would skip it.
+            names = [part.name for part in self.parts(day)] + list(merged_parts(self.path_for(day)))
+            number = max((int(Path(name).stem.rsplit("_part", 1)[1]) for name in names), default=0) + 1
+            path = self.folder / f"{self.prefix}_{day}_part{number:03d}.parquet"
+            tmp = path.with_suffix(".parquet.tmp")
+            pq.write_table(table, tmp, row_group_size=max(table.num_rows, 1), compression=self.compression)
+            os.replace(tmp, path)
+            self.logger.info(f"Archived {table.num_rows} rows for {self.hour}:00 to {path.name}")
+            self.columns = {name: [] for name in self.schema.names}
+            self.hour = None
+
+    def compact(self, day):
+        """Merge the day's parts into its file, sorted by time."""
+        with self.lock:
+            path = self.path_for(day)
+            parts = self.parts(day)
+            if not parts:
+                return
+            # Parts listed in the day file were merged by a compaction that
+            # stopped before deleting them.
+            merged = merged_parts(self.path_for(day))
+            sources = ([path] if path.is_file() else []) + [part for part in parts if part.name not in merged]
+            table = pa.concat_tables(
+                pq.read_table(source, schema=self.schema) for source in sources
+            ).sort_by("timestamp")
+            table = table.replace_schema_metadata(
+                {b"rx380_parts": " ".join(sorted(merged | {part.name for part in parts})).encode()})
+            tmp = path.with_suffix(".parquet.tmp")
+            pq.write_table(table, tmp, row_group_size=self.compact_rows, compression=self.compression)
+            os.replace(tmp, path)
+            for part in parts:
+                part.unlink()
+            self.logger.info(f"Compacted {path.name}: {table.num_rows} rows.")
+
+    def close(self):
+        self.commit()
+
+
+def read_archive(folder, columns=None, start=None, end=None, meters=None, prefix="rx380_data"):
+    """Load the archive as an Arrow table, reading only what was asked for.
+
+    ``start`` (inclusive) and ``end`` (exclusive) are datetimes or ISO strings
+    in local time. Files outside the range are never opened, and row groups
+    are skipped using their timestamp statistics.
+    """
+    folder = Path(folder).expanduser()
+    files = sorted(folder.glob(f"{prefix}_*.parquet"))
+    first_day = (start if isinstance(start, datetime) else datetime.fromisoformat(start)).date() if start else None
+    last_day = (end if isinstance(end, datetime) else datetime.fromisoformat(end)).date() if end else None
+    selected = []
+    for path in files:
+        # rx380_data_<day>.parquet or, while the day is live, rx380_data_<day>_partNNN.parquet
+        day = datetime.strptime(path.stem[len(prefix) + 1:][:10], "%Y-%m-%d").date()
+        if (first_day is None or day >= first_day) and (last_day is None or day <= last_day):
+            selected.append(path)
+    # Parts a compaction merged but did not get to delete are already in the day file.
+    merged = set()
+    for day in {path.stem[len(prefix) + 1:][:10] for path in selected if "_part" in path.stem}:
+        merged |= merged_parts(folder / f"{prefix}_{day}.parquet")
+    selected = [str(path) for path in selected if path.name not in merged]
+    if columns is not None:
+        columns = list(dict.fromkeys(["timestamp", "meter"] + list(columns)))
+    if not selected:
+        if not files:
+            return pa.table({})
+        empty = pq.read_schema(files[0]).empty_table()
+        return empty.select(columns) if columns else empty
+
+    condition = None
+    if start:
+        condition = ds.field("timestamp") >= epoch_seconds(start)
+    if end:
+        before_end = ds.field("timestamp") < epoch_seconds(end)
+        condition = before_end if condition is None else condition & before_end
+    if meters:
+        by_meter = ds.field("meter").isin(list(meters))
+        condition = by_meter if condition is None else condition & by_meter
+    return ds.dataset(selected, format="parquet").to_table(columns=columns, filter=condition)
+
+
+def convert_csv(csv_path, archive):
+    """Append one rx380_data_*.csv day log (as written by the watchdog) to ``archive``."""
+    with open(csv_path, newline="") as f:
+        for row in csv.DictReader(f):
+            sample = {}
+            for name in archive.schema.names:
+                value = row.get(name)
+                if name in ("timestamp", "meter"):
+                    sample[name] = value
+                else:
+                    sample[name] = float(value) if value not in (None, "", "None") else None
+            archive.write([sample])
+    archive.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RX380 Parquet archive tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    convert = sub.add_parser("convert", help="convert rx380_data_*.csv day logs to Parquet")
+    convert.add_argument("paths", nargs="+", help="CSV files or folders")
+    convert.add_argument("--profile", default=str(DEFAULT_PROFILE))
+    convert.add_argument("--output", help="archive folder (default: next to each CSV)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    logger = logging.getLogger("parquet_archive")
+    schema = archive_schema([load_profile(args.profile)])
+    csv_paths = []
+    for path in map(Path, args.paths):
+        path = path.expanduser()
+        csv_paths.extend(sorted(path.glob("rx380_data_*.csv")) if path.is_dir() else [path])
+    converted = {}
+    for csv_path in csv_paths:
+        folder = Path(args.output).expanduser() if args.output else csv_path.parent
+        archive = ParquetArchive(folder, schema, logger=logger)
+        # rx380_data_<day>_2.csv continues <day> under new columns: same archive file.
+        day = csv_path.stem[len("rx380_data_"):][:10]
+        if (folder, day) not in converted:
+            archive.path_for(day).unlink(missing_ok=True)
+            for part in archive.parts(day):
+                part.unlink()
+            converted[folder, day] = archive
+        convert_csv(csv_path, archive)
+    for (folder, day), archive in converted.items():
+        archive.compact(day)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+from collections import namedtuple
+
+# Largest quantity of registers a single FC3/FC4 request may ask for.
+MAX_REGISTERS_PER_READ = 125
+
+
+class RegisterField(namedtuple("RegisterField", "name address words scale signed")):
+    """One meter quantity: 1 or 2 registers (high word first) times a scale factor."""
+    __slots__ = ()
+
+    def __new__(cls, name, address, words=2, scale=1, signed=False):
+        return super().__new__(cls, name, address, words, scale, signed)
+
+    @property
+    def end(self):
+        return self.address + self.words
+
+
+class ReadBlock(namedtuple("ReadBlock", "start count fields")):
+    """A contiguous run of registers fetched with a single request."""
+    __slots__ = ()
+
+    @property
+    def end(self):
+        return self.start + self.count
+
+
+def plan_reads(fields, max_gap=8, max_registers=MAX_REGISTERS_PER_READ):
+    """Merge fields into the fewest read blocks.
+
+    Fields closer than ``max_gap`` unused registers share a block, as long as the
+    block stays within ``max_registers``. Use ``max_gap=0`` for meters that reject
+    reads spanning undefined registers.
+    """
+    blocks = []
+    start = end = None
+    members = []
+    for field in sorted(fields, key=lambda f: f.address):
+        if members and (field.address - end > max_gap or field.end - start > max_registers):
+            blocks.append(ReadBlock(start, end - start, tuple(members)))
+            members = []
+        if not members:
+            start, end = field.address, field.end
+        members.append(field)
+        end = max(end, field.end)
+    if members:
+        blocks.append(ReadBlock(start, end - start, tuple(members)))
+    return blocks
@@ -0,0 +1,142 @@
+"""Fixed-size in-memory history of recent samples as a NumPy structured array.
+
+One preallocated column per field instead of a dict per sample: appending
+overwrites the oldest slot, and window statistics are single NumPy calls.
+
+    ring = SampleRing(["total_real_power", "frequency"], capacity=86400)
+    ring.append(sample)
+    ring.latest(360)["total_real_power"].mean()
+"""
+import threading
+from datetime import datetime
+
+import numpy as np
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def ring_dtype(fields):
+    """int64 epoch-second timestamp plus a float64 column per field name."""
+    return np.dtype([("timestamp", "<i8")] + [(name, "<f8") for name in fields if name != "timestamp"])
+
+
+class SampleRing:
+    """Ring buffer of the last ``capacity`` samples.
+
+    ``fields`` is a list of field names or a structured dtype whose first
+    field is ``timestamp`` (e.g. ``sample_log.record_dtype``). Missing values
+    are stored as NaN. All methods take a lock, so one writer and any number
+    of reader threads can share a ring. ``latest``/``since`` return a view
+    into the buffer when the window does not wrap around; such a view is
+    overwritten once ``capacity`` more samples have been appended, so
+    anything kept or handed to another thread should come from ``snapshot``,
+    which always copies.
+    """
+
+    def __init__(self, fields, capacity):
+        self.dtype = fields if isinstance(fields, np.dtype) else ring_dtype(fields)
+        self.fields = self.dtype.names[1:]
+        self.capacity = capacity
+        self.buffer = np.zeros(capacity, self.dtype)
+        for name in self.dtype.names[1:]:
+            self.buffer[name] = np.nan
+        self.appended = 0  # samples ever appended; the next slot is appended % capacity
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.appended, self.capacity)
+
+    def append(self, sample):
+        """O(1): write ``sample`` (a dict) over the oldest slot."""
+        timestamp = sample["timestamp"]
+        if isinstance(timestamp, str):
+            timestamp = datetime.strptime(timestamp, TIMESTAMP_FORMAT).timestamp()
+        row = (timestamp, *(np.nan if value is None else value
+                             for value in map(sample.get, self.fields)))
+        with self.lock:
+            self.buffer[self.appended % self.capacity] = row
+            self.appended += 1
+
+    def extend(self, samples):
+        for sample in samples:
+            self.append(sample)
+
+    def _window(self, count, copy):
+        count = min(count, len(self))
+        end = self.appended % self.capacity or (self.capacity if self.appended else 0)
+        start = end - count
+        if start < 0:
+            # Wraps around the end of the buffer: the only case that must copy.
+            return np.concatenate((self.buffer[start:], self.buffer[:end]))
+        window = self.buffer[start:end]
+        return window.copy() if copy else window
+
+    def latest(self, count=None):
+        """The newest ``count`` samples (default: all), oldest first."""
+        with self.lock:
+            return self._window(self.capacity if count is None else count, copy=False)
+
+    def snapshot(self, count=None):
+        """Like ``latest`` but always an independent copy, safe to keep."""
+        with self.lock:
+            return self._window(self.capacity if count is None else count, copy=True)
+
+    def since(self, when):
+        """Samples taken at or after ``when`` (epoch seconds or a datetime)."""
+        if isinstance(when, datetime):
+            when = when.timestamp()
+        with self.lock:
+            window = self._window(self.capacity, copy=False)
+            return window[np.searchsorted(window["timestamp"], when, "left"):]
+
+    def last(self):
+        """The newest sample as a dict, or None if the ring is empty."""
+        with self.lock:
+            if not self.appended:
+                return None
+            index = (self.appended - 1) % self.capacity
+            return self.to_samples(self.buffer[index:index + 1])[0]
+
+    @staticmethod
+    def to_samples(records):
+        """Records back to sample dicts (timestamp string, None for NaN)."""
+        names = records.dtype.names[1:]
+        samples = []
+        for record in records.tolist():
+            sample = {"timestamp": datetime.fromtimestamp(record[0]).strftime(TIMESTAMP_FORMAT)}
+            sample.update((name, None if value != value else value) for name, value in zip(names, record[1:]))
+            samples.append(sample)
+        return samples
+
+    def stats(self, field, count=None):
+        """min/max/mean/last of one field over the newest ``count`` samples, ignoring gaps."""
+        with self.lock:
+            values = self._window(self.capacity if count is None else count, copy=False)[field]
+            valid = ~np.isnan(values)
+            if not valid.any():
+                return None
+            return {
+                "min": float(np.nanmin(values)),
+                "max": float(np.nanmax(values)),
+                "mean": float(np.nanmean(values)),
+                "last": float(values[valid][-1]),
+                "count": int(np.count_nonzero(valid)),
+            }
+
+
+class RecentSamples:
+    """A SampleRing per meter, filled from the acquisition batches."""
+
+    def __init__(self, fields, capacity):
+        self.fields = fields
+        self.capacity = capacity
+        self.rings = {}
+
+    def ring(self, meter):
+        if meter not in self.rings:
+            self.rings[meter] = SampleRing(self.fields, self.capacity)
+        return self.rings[meter]
+
+    def write(self, samples):
+        for sample in samples:
+            self.ring(sample.get("meter") or "meter").append(sample)
@@ -0,0 +1,237 @@
+"""Incremental min/max/mean/last rollups of samples at several resolutions.
+
+Every sample updates the open bucket of each resolution in O(1) (a handful
+of NumPy operations over all fields at once). When a sample falls into a
+later bucket, the open one is closed and its rows queued for the sinks.
+Buckets are aligned to local midnight, so "1d" means a calendar day.
+
+Closed rows wait for SQL Server in a SqlSpool next to the checkpoint
+(rx380_rollups.sqlite3), so an outage costs one small insert per closed
+bucket. Open buckets and the last timestamp seen per meter are saved to a
+JSON checkpoint at most every ``checkpoint_interval`` seconds; after a
+restart the partial buckets carry on where they were, and samples already
+counted are not counted again (samples since the last checkpoint are
+missing from the partial buckets).
+
+SQL Server table the rows are merged into (one row per meter, resolution,
+bucket and field):
+
+    CREATE TABLE Rollups (
+        Meter NVARCHAR(64) NOT NULL, Resolution VARCHAR(8) NOT NULL,
+        BucketStart DATETIME2(0) NOT NULL, Field VARCHAR(64) NOT NULL,
+        MinValue FLOAT, MaxValue FLOAT, MeanValue FLOAT, LastValue FLOAT,
+        SampleCount INT NOT NULL,
+        PRIMARY KEY (Resolution, Meter, Field, BucketStart)
+    )
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+
+from sql_spool import SqlSpool
+
+RESOLUTIONS = {"1m": 60, "10m": 600, "1h": 3600, "1d": 86400}
+ROLLUP_COLUMNS = ["Meter", "Resolution", "BucketStart", "Field",
+                  "MinValue", "MaxValue", "MeanValue", "LastValue", "SampleCount"]
+ROLLUP_KEYS = ["Meter", "Resolution", "BucketStart", "Field"]
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def rollup_key(row):
+    """Spool key of a rollup row: meter, resolution, bucket start and field."""
+    return "|".join(map(str, row[:4]))
+
+
+def bucket_start(when, seconds):
+    """Start of the ``seconds``-long bucket holding ``when``, counted from local midnight."""
+    midnight = when.replace(hour=0, minute=0, second=0, microsecond=0)
+    offset = int((when - midnight).total_seconds()) // seconds * seconds
+    return midnight + timedelta(seconds=offset)
+
+
+class Bucket:
+    """Running min/max/sum/count/last for every field of one bucket."""
+
+    def __init__(self, start, size):
+        self.start = start
+        self.min = np.full(size, np.nan)
+        self.max = np.full(size, np.nan)
+        self.sum = np.zeros(size)
+        self.count = np.zeros(size, np.int64)
+        self.last = np.full(size, np.nan)
+
+    def add(self, values, valid):
+        np.fmin(self.min, values, out=self.min)
+        np.fmax(self.max, values, out=self.max)
+        np.add(self.sum, values, out=self.sum, where=valid)
+        self.count += valid
+        np.copyto(self.last, values, where=valid)
+
+    def rows(self, meter, resolution, fields):
+        start = self.start.strftime(TIMESTAMP_FORMAT)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = self.sum / self.count
+        return [
+            (meter, resolution, start, field, *(None if v != v else float(v) for v in values), int(count))
+            for field, count, *values in zip(fields, self.count, self.min, self.max, mean, self.last)
+            if count
+        ]
+
+    def state(self):
+        return {"start": self.start.strftime(TIMESTAMP_FORMAT),
+                **{name: [None if v != v else float(v) for v in getattr(self, name)]
+                   for name in ("min", "max", "sum", "last")},
+                "count": self.count.tolist()}
+
+    @classmethod
+    def from_state(cls, state):
+        bucket = cls(datetime.strptime(state["start"], TIMESTAMP_FORMAT), len(state["count"]))
+        for name in ("min", "max", "sum", "last"):
+            getattr(bucket, name)[:] = [np.nan if v is None else v for v in state[name]]
+        bucket.count[:] = state["count"]
+        return bucket
+
+
+class RollupEngine:
+    """Keeps an open bucket per meter and resolution and queues closed ones.
+
+    ``write`` (blocking) feeds a batch of samples. Closed rows (lists ordered
+    like ROLLUP_COLUMNS) go to ``queue``, a SqlSpool keyed by ROLLUP_KEYS in
+    which a re-closed bucket replaces its queued rows; while the sink is down
+    it keeps at most ``max_queue_bytes``, dropping the oldest.
+    """
+
+    def __init__(self, fields, checkpoint_path, resolutions=RESOLUTIONS, max_queue_bytes=50 * 1024 * 1024,
+                 checkpoint_interval=10, logger: logging.Logger = None):
+        self.fields = list(fields)
+        self.resolutions = dict(resolutions)
+        self.checkpoint_path = Path(checkpoint_path).expanduser()
+        self.checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+        self.checkpoint_interval = checkpoint_interval
+        self.logger = logger or logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.buckets = {}  # (meter, resolution) -> Bucket
+        self.last_seen = {}  # meter -> last timestamp string counted
+        self.queue = SqlSpool(self.checkpoint_path.with_suffix(".sqlite3"), max_queue_bytes, self.logger,
+                              key=rollup_key, replace=True)
+        self.listeners = []  # called with the rows of each bucket as it closes
+        self.checkpointed = 0.0
+        self.load()
+
+    def load(self):
+        try:
+            state = json.loads(self.checkpoint_path.read_text())
+        except FileNotFoundError:
+            return
+        except ValueError as e:
+            self.logger.error(f"Ignoring unreadable rollup checkpoint {self.checkpoint_path}: {e}")
+            return
+        # Checkpoints written before the spool also hold the queued rows.
+        self.queue.put(state.get("queue", []))
+        if state.get("fields") != self.fields:
+            self.logger.warning("Rollup fields changed; closing the checkpointed buckets.")
+            for key, bucket_state in state.get("buckets", {}).items():
+                meter, resolution = key.rsplit("|", 1)
+                self.queue.put(Bucket.from_state(bucket_state).rows(meter, resolution, state["fields"]))
+            return
+        self.last_seen = state.get("last_seen", {})
+        for key, bucket_state in state.get("buckets", {}).items():
+            meter, resolution = key.rsplit("|", 1)
+            if resolution in self.resolutions:
+                self.buckets[meter, resolution] = Bucket.from_state(bucket_state)
+
+    def checkpoint(self):
+        state = {
+            "fields": self.fields,
+            "last_seen": self.last_seen,
+            "buckets": {f"{meter}|{resolution}": bucket.state()
+                        for (meter, resolution), bucket in self.buckets.items()},
+        }
+        tmp = self.checkpoint_path.with_name(self.checkpoint_path.name + ".tmp")
+        tmp.write_text(json.dumps(state))
+        os.replace(tmp, self.checkpoint_path)
+        self.checkpointed = time.monotonic()
+
+    def checkpoint_if_due(self):
+        if time.monotonic() - self.checkpointed >= self.checkpoint_interval:
+            self.checkpoint()
+
+    def _close(self, meter, resolution):
+        bucket = self.buckets.pop((meter, resolution))
+        rows = bucket.rows(meter, resolution, self.fields)
+        self.queue.put(rows)
+        for listener in self.listeners:
+            try:
+                listener(rows)
+            except Exception as e:
+                self.logger.error(f"Rollup listener error: {e}")
+
+    def add(self, sample):
+        meter = sample.get("meter") or "meter"
+        timestamp = sample["timestamp"]
+        if timestamp <= self.last_seen.get(meter, ""):
+            return  # already counted before a restart, or out of order
+        self.last_seen[meter] = timestamp
+        when = datetime.strptime(timestamp, TIMESTAMP_FORMAT)
+        values = np.array([np.nan if v is None else v for v in map(sample.get, self.fields)], float)
+        valid = ~np.isnan(values)
+        for resolution, seconds in self.resolutions.items():
+            start = bucket_start(when, seconds)
+            bucket = self.buckets.get((meter, resolution))
+            if bucket is not None and bucket.start != start:
+                self._close(meter, resolution)
+                bucket = None
+            if bucket is None:
+                bucket = self.buckets[meter, resolution] = Bucket(start, len(self.fields))
+            bucket.add(values, valid)
+
+    def write(self, samples):
+        """Blocking: roll a batch of samples up, checkpointing if it is due."""
+        with self.lock:
+            for sample in samples:
+                self.add(sample)
+            self.checkpoint_if_due()
+
+    def close_due(self, now=None, grace=60):
+        """Close buckets whose end passed ``grace`` seconds ago (meters that went quiet)."""
+        now = now or datetime.now()
+        with self.lock:
+            due = [key for key, bucket in self.buckets.items()
+                   if bucket.start + timedelta(seconds=self.resolutions[key[1]] + grace) <= now]
+            for meter, resolution in due:
+                self._close(meter, resolution)
+            self.checkpoint_if_due()
+        return len(due)
+
+    def close(self):
+        with self.lock:
+            self.checkpoint()
+        self.queue.close()
+
+
+async def forward_rollups(engine, sql_manager, logger: logging.Logger, interval=30,
+                          batch_size=2000, max_retry_interval=600):
+    """Close quiet buckets and MERGE queued rollup rows into SQL, forever."""
+    delay = interval
+    while True:
+        await asyncio.sleep(delay)
+        try:
+            await asyncio.to_thread(engine.close_due)
+            ids, rows = await engine.queue.peek(batch_size)
+            if not rows:
+                delay = interval
+                continue
+            await sql_manager.merge_rollups([tuple(row) for row in rows])
+            await engine.queue.ack(ids)
+            logger.info(f"Merged {len(rows)} rollup rows.")
+            delay = interval if len(ids) < batch_size else 0
+        except Exception as e:
+            logger.error(f"Rollup merge error, {len(engine.queue)} rows queued: {e}")
+            delay = min(max(delay, interval) * 2, max_retry_interval)
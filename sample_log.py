@@ -0,0 +1,217 @@
+"""Append-only binary history of samples, one fixed-width record per reading.
+
+A file starts with a small header (magic, version, record layout as JSON)
+followed by packed records: ``timestamp`` as int64 epoch seconds, then every
+profile field. Records are appended in time order, so a time lookup is a
+binary search over the memory-mapped file and a range read is a NumPy view
+into the mapping; nothing is parsed or copied.
+
+    log = SampleLogStore("~/rx380_history", [profile]).log("office")
+    log.at("2024-05-07 14:03:00")["total_real_power"]
+    log.range("2024-05-07", "2024-05-08")["frequency"].mean()
+"""
+import bisect
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+MAGIC = b"RX380LOG"
+VERSION = 1
+HEADER = struct.Struct("<8sHHI")  # magic, version, header size, record size
+HEADER_SIZE = 4096
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def record_dtype(profiles):
+    """Record layout for the union of the profiles' fields.
+
+    Measurements are float32; cumulative energy counters (units ending in
+    "h") are float64 so large register values keep whole-kWh resolution.
+    """
+    fields = [("timestamp", "<i8")]
+    seen = set()
+    for profile in profiles:
+        for name in profile.output_fields:
+            if name not in seen:
+                seen.add(name)
+                fields.append((name, "<f8" if profile.units.get(name, "").endswith("h") else "<f4"))
+    return np.dtype(fields)
+
+
+def epoch_seconds(value):
+    """Epoch seconds from a number, a local datetime or a "YYYY-MM-DD[ HH:MM:SS]" string."""
+    if isinstance(value, (int, float, np.integer)):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return int(value.timestamp())
+
+
+class SampleLog:
+    """One meter's fixed-width record file, read through ``mmap``.
+
+    Views returned by ``range``/``latest`` stay valid after later appends;
+    they simply do not see the new records. Records older than the last one
+    written are dropped, as they would break the binary search. One thread
+    appends while others read.
+    """
+
+    def __init__(self, path, dtype=None, logger: logging.Logger = None):
+        self.path = Path(path).expanduser()
+        self.logger = logger or logging.getLogger(__name__)
+        if self.path.is_file() and self.path.stat().st_size:
+            self.dtype = self._read_header()
+        elif dtype is None:
+            raise FileNotFoundError(f"{self.path} does not exist and no record layout was given")
+        else:
+            self.dtype = np.dtype(dtype)
+            self._write_header()
+        self._file = open(self.path, "r+b")
+        self._repair_tail()
+        self._file.seek(0, os.SEEK_END)
+        self.lock = threading.Lock()  # guards the mapping and _records
+        self._map = None
+        self._records = np.empty(0, self.dtype)
+        self.last_timestamp = int(self.records[-1]["timestamp"]) if len(self) else None
+
+    def _write_header(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        layout = json.dumps({"fields": [[name, self.dtype[name].str] for name in self.dtype.names]})
+        header = HEADER.pack(MAGIC, VERSION, HEADER_SIZE, self.dtype.itemsize) + layout.encode()
+        if len(header) > HEADER_SIZE:
+            raise ValueError(f"Record layout too large for a {HEADER_SIZE}-byte header")
+        with open(self.path, "wb") as f:
+            f.write(header.ljust(HEADER_SIZE, b"\0"))
+
+    def _read_header(self):
+        with open(self.path, "rb") as f:
+            raw = f.read(HEADER_SIZE)
+        magic, version, header_size, record_size = HEADER.unpack_from(raw)
+        if magic != MAGIC or version != VERSION or header_size != HEADER_SIZE:
+            raise ValueError(f"{self.path} is not a version {VERSION} sample log")
+        layout = json.loads(raw[HEADER.size:].rstrip(b"\0"))
+        dtype = np.dtype([tuple(field) for field in layout["fields"]])
+        if dtype.itemsize != record_size:
+            raise ValueError(f"{self.path}: record size {record_size} does not match its layout")
+        return dtype
+
+    def _repair_tail(self):
+        """Cut off a record left half-written by a crash."""
+        size = os.fstat(self._file.fileno()).st_size
+        excess = (size - HEADER_SIZE) % self.dtype.itemsize
+        if excess:
+            self.logger.warning(f"Dropping a partial record at the end of {self.path.name}.")
+            self._file.truncate(size - excess)
+
+    def __len__(self):
+        return (os.fstat(self._file.fileno()).st_size - HEADER_SIZE) // self.dtype.itemsize
+
+    @property
+    def records(self):
+        """All records as a read-only structured array backed by the mapping."""
+        with self.lock:
+            count = len(self)
+            if count != len(self._records):
+                if count:
+                    self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+                    self._records = np.frombuffer(self._map, self.dtype, count, HEADER_SIZE)
+                else:
+                    self._records = np.empty(0, self.dtype)
+            return self._records
+
+    def append(self, samples):
+        """Append samples (dicts as produced by the bus scheduler); returns how many were written."""
+        rows = np.zeros(len(samples), self.dtype)
+        kept = 0
+        for sample in samples:
+            timestamp = int(datetime.strptime(sample["timestamp"], TIMESTAMP_FORMAT).timestamp())
+            if self.last_timestamp is not None and timestamp < self.last_timestamp:
+                self.logger.warning(f"{self.path.name}: skipping out-of-order sample at {sample['timestamp']}.")
+                continue
+            row = rows[kept]
+            row["timestamp"] = timestamp
+            for name in self.dtype.names[1:]:
+                value = sample.get(name)
+                row[name] = np.nan if value is None else value
+            self.last_timestamp = timestamp
+            kept += 1
+        if kept:
+            self._file.write(rows[:kept].tobytes())
+            self._file.flush()
+        return kept
+
+    def bounds(self, records, start=None, end=None):
+        """Indices (first, last) of the ``records`` with ``start <= timestamp < end``."""
+        # bisect probes the strided view in place; np.searchsorted would first
+        # copy the whole timestamp column into a contiguous array.
+        timestamps = records["timestamp"]
+        first = 0 if start is None else bisect.bisect_left(timestamps, epoch_seconds(start))
+        last = len(records) if end is None else bisect.bisect_left(timestamps, epoch_seconds(end))
+        return first, last
+
+    def range(self, start=None, end=None):
+        """Zero-copy view of the records with ``start <= timestamp < end``."""
+        records = self.records
+        first, last = self.bounds(records, start, end)
+        return records[first:last]
+
+    def at(self, when):
+        """The last record taken at or before ``when``, or None."""
+        records = self.records
+        index = bisect.bisect_right(records["timestamp"], epoch_seconds(when)) - 1
+        return records[index] if index >= 0 else None
+
+    def latest(self, count=1):
+        return self.records[-count:]
+
+    def close(self):
+        with self.lock:
+            self._records = np.empty(0, self.dtype)
+            self._map = None  # released once no view refers to it any more
+            self._file.close()
+
+
+class SampleLogStore:
+    """A ``<meter>.rxlog`` SampleLog per meter in one folder.
+
+    ``log`` is called from both the store thread and the HTTP API's, so
+    opening a meter's log is serialised.
+    """
+
+    def __init__(self, folder, profiles, logger: logging.Logger = None):
+        self.folder = Path(folder).expanduser()
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.dtype = record_dtype(profiles)
+        self.logger = logger or logging.getLogger(__name__)
+        self.logs = {}
+        self.lock = threading.Lock()
+
+    def log(self, meter):
+        with self.lock:
+            if meter not in self.logs:
+                self.logs[meter] = SampleLog(self.folder / f"{meter}.rxlog", self.dtype, self.logger)
+            return self.logs[meter]
+
+    def meters(self):
+        return sorted(path.stem for path in self.folder.glob("*.rxlog"))
+
+    def write(self, samples):
+        """Blocking: append a batch of samples to their meters' logs."""
+        by_meter = {}
+        for sample in samples:
+            by_meter.setdefault(sample.get("meter") or "meter", []).append(sample)
+        for meter, meter_samples in by_meter.items():
+            self.log(meter).append(meter_samples)
+
+    def close(self):
+        with self.lock:
+            for log in self.logs.values():
+                log.close()
+            self.logs.clear()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""Spreadsheet (ODS/XLSX) copies of the daily CSV logs.
+
+Rows are streamed from the CSV straight into the spreadsheet's zipped XML,
+so memory stays flat however long the day is, and nothing is reread or
+rewritten as the day grows. The watchdog scripts export each finished day
+once in a separate process; for an export on demand:
+
+    python3 spreadsheet_export.py rx380_daily_logs/rx380_data_2024-05-07.csv --format xlsx
+"""
+import argparse
+import asyncio
+import csv
+import io
+import logging
+import math
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+ODS_MIMETYPE = "application/vnd.oasis.opendocument.spreadsheet"
+
+ODS_MANIFEST = """<?xml version="1.0" encoding="UTF-8"?>
+<manifest:manifest xmlns:manifest="urn:oasis:names:tc:opendocument:xmlns:manifest:1.0" manifest:version="1.2">
+<manifest:file-entry manifest:full-path="/" manifest:media-type="application/vnd.oasis.opendocument.spreadsheet"/>
+<manifest:file-entry manifest:full-path="content.xml" manifest:media-type="text/xml"/>
+</manifest:manifest>
+"""
+
+ODS_CONTENT_START = """<?xml version="1.0" encoding="UTF-8"?>
+<office:document-content xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0" \
+xmlns:table="urn:oasis:names:tc:opendocument:xmlns:table:1.0" \
+xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0" office:version="1.2">
+<office:body><office:spreadsheet><table:table table:name="{sheet}">
+"""
+
+ODS_CONTENT_END = "</table:table></office:spreadsheet></office:body></office:document-content>\n"
+
+XLSX_PARTS = {
+    "[Content_Types].xml": """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+</Types>
+""",
+    "_rels/.rels": """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>
+""",
+    "xl/workbook.xml": """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" \
+xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets><sheet name="{sheet}" sheetId="1" r:id="rId1"/></sheets>
+</workbook>
+""",
+    "xl/_rels/workbook.xml.rels": """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>
+</Relationships>
+""",
+}
+
+XLSX_SHEET_START = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>
+"""
+
+XLSX_SHEET_END = "</sheetData></worksheet>\n"
+
+
+def cell_value(value):
+    """NaN (a gap) as None and +/-inf as text; neither is a valid xsd:double."""
+    if isinstance(value, float) and not math.isfinite(value):
+        return None if math.isnan(value) else str(value)
+    return value
+
+
+def ods_cell(value):
+    value = cell_value(value)
+    if isinstance(value, float):
+        return (f'<table:table-cell office:value-type="float" office:value="{value!r}">'
+                f'<text:p>{value!r}</text:p></table:table-cell>')
+    if value is None:
+        return "<table:table-cell/>"
+    return f'<table:table-cell office:value-type="string"><text:p>{escape(str(value))}</text:p></table:table-cell>'
+
+
+def xlsx_cell(value):
+    value = cell_value(value)
+    if isinstance(value, float):
+        return f"<c><v>{value!r}</v></c>"
+    if value is None:
+        return "<c/>"
+    return f'<c t="inlineStr"><is><t>{escape(str(value))}</t></is></c>'
+
+
+def write_ods(path, rows, sheet="Sheet1"):
+    """Stream ``rows`` (lists of str/float/None) into an ODS file."""
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        # The mimetype must come first and be stored uncompressed.
+        zf.writestr(zipfile.ZipInfo("mimetype"), ODS_MIMETYPE, compress_type=zipfile.ZIP_STORED)
+        zf.writestr("META-INF/manifest.xml", ODS_MANIFEST)
+        with io.TextIOWrapper(zf.open("content.xml", "w", force_zip64=True), encoding="utf-8") as out:
+            out.write(ODS_CONTENT_START.format(sheet=escape(sheet)))
+            for row in rows:
+                out.write("<table:table-row>" + "".join(map(ods_cell, row)) + "</table:table-row>\n")
+            out.write(ODS_CONTENT_END)
+
+
+def write_xlsx(path, rows, sheet="Sheet1"):
+    """Stream ``rows`` (lists of str/float/None) into an XLSX file."""
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, part in XLSX_PARTS.items():
+            zf.writestr(name, part.format(sheet=escape(sheet)) if "{sheet}" in part else part)
+        with io.TextIOWrapper(zf.open("xl/worksheets/sheet1.xml", "w", force_zip64=True),
+                              encoding="utf-8") as out:
+            out.write(XLSX_SHEET_START)
+            for row in rows:
+                out.write("<row>" + "".join(map(xlsx_cell, row)) + "</row>\n")
+            out.write(XLSX_SHEET_END)
+
+
+WRITERS = {"ods": write_ods, "xlsx": write_xlsx}
+
+
+def csv_rows(csv_path):
+    """The CSV's header, then its rows with numbers as floats and gaps as None."""
+    with open(csv_path, newline="") as f:
+        reader = csv.reader(f)
+        yield next(reader, [])
+        for row in reader:
+            values = []
+            for text in row:
+                if text in ("", "None"):
+                    values.append(None)
+                    continue
+                try:
+                    values.append(float(text))
+                except ValueError:
+                    values.append(text)
+            yield values
+
+
+def export_csv(csv_path, fmt="ods", out_path=None):
+    """Blocking: write the spreadsheet next to ``csv_path``; returns its path.
+
+    The file is written under a temporary name and renamed, so a reader
+    never sees a half-written spreadsheet.
+    """
+    csv_path = Path(csv_path)
+    out_path = Path(out_path) if out_path else csv_path.with_suffix(f".{fmt}")
+    tmp = out_path.with_name(out_path.name + ".tmp")
+    WRITERS[fmt](tmp, csv_rows(csv_path))
+    os.replace(tmp, out_path)
+    return out_path
+
+
+class SpreadsheetExporter:
+    """Exports finished days' CSV logs in a background process.
+
+    Call ``check_rollover()`` from the acquisition loop: when the date
+    changes, the previous day is exported once. ``export(day)`` exports on
+    demand. Neither blocks the caller on spreadsheet I/O.
+    """
+
+    def __init__(self, folder, fmt="ods", prefix="rx380_data", logger: logging.Logger = None):
+        self.folder = Path(folder)
+        self.fmt = fmt
+        self.prefix = prefix
+        self.logger = logger or logging.getLogger(__name__)
+        self.executor = ProcessPoolExecutor(max_workers=1)
+        self.day = datetime.now().strftime("%Y-%m-%d")
+        self.tasks = set()
+
+    async def _export(self, day):
+        csv_path = self.folder / f"{self.prefix}_{day}.csv"
+        if not csv_path.is_file():
+            self.logger.warning(f"No CSV log to export for {day}.")
+            return None
+        loop = asyncio.get_running_loop()
+        try:
+            path = await loop.run_in_executor(self.executor, export_csv, str(csv_path), self.fmt)
+            self.logger.info(f"Exported {csv_path.name} to {path.name}")
+            return path
+        except Exception as e:
+            self.logger.error(f"Error exporting {csv_path.name}: {e}")
+            return None
+
+    def export(self, day=None):
+        """Start exporting ``day`` (default: today) and return the task."""
+        task = asyncio.create_task(self._export(day or datetime.now().strftime("%Y-%m-%d")))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def check_rollover(self):
+        today = datetime.now().strftime("%Y-%m-%d")
+        if today != self.day:
+            self.export(self.day)
+            self.day = today
+
+    async def close(self):
+        if self.tasks:
+            await asyncio.gather(*self.tasks)
+        self.executor.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export RX380 CSV logs to ODS/XLSX")
+    parser.add_argument("paths", nargs="+", help="rx380_data_*.csv files")
+    parser.add_argument("--format", choices=sorted(WRITERS), default="ods")
+    args = parser.parse_args()
+    for csv_path in args.paths:
+        print(export_csv(Path(csv_path).expanduser(), args.format))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import itertools
+
+# (SQL column, sample key) in insert order
+SQL_COLUMNS = [
+    ('Timestamp', 'timestamp'),
+    ('VoltageL1_v', 'voltage_l1'),
+    ('VoltageL2_v', 'voltage_l2'),
+    ('VoltageL3_v', 'voltage_l3'),
+    ('VoltageL12_v', 'voltage_l12'),
+    ('VoltageL23_v', 'voltage_l23'),
+    ('VoltageL31_v', 'voltage_l31'),
+    ('VoltageL12_maxv', 'voltage_l12_max'),
+    ('VoltageL23_maxv', 'voltage_l23_max'),
+    ('VoltageL31_maxv', 'voltage_l31_max'),
+    ('VoltageL12_minv', 'voltage_l12_min'),
+    ('VoltageL23_minv', 'voltage_l23_min'),
+    ('VoltageL31_minv', 'voltage_l31_min'),
+    ('CurrentL1_I', 'current_l1'),
+    ('CurrentL2_I', 'current_l2'),
+    ('CurrentL3_I', 'current_l3'),
+    ('CurrentLn_I', 'current_ln'),
+    ('TotalRealPower', 'total_real_power'),
+    ('TotalApparentPower', 'total_apparent_power'),
+    ('TotalReactivePower', 'total_reactive_power'),
+    ('TotalPowerFactor', 'total_power_factor'),
+    ('Frequency', 'frequency'),
+    ('TotalRealEnergy', 'total_real_energy'),
+    ('TotalReactiveEnergy', 'total_reactive_energy'),
+    ('TotalApparentEnergy', 'total_apparent_energy'),
+]
+
+# Optional meter name column, needed when meters share a table (opt in with
+# ``database.meter_column``). Add it to an existing table, name the rows
+# already there, and index the pair rows are deduplicated on with
+#
+#     ALTER TABLE Office_Readings ADD Meter NVARCHAR(64) NULL
+#     UPDATE Office_Readings SET Meter = 'office' WHERE Meter IS NULL
+#     CREATE UNIQUE INDEX UX_Office_Readings_Meter_Timestamp
+#         ON Office_Readings (Meter, Timestamp) WITH (IGNORE_DUP_KEY = ON)
+#
+# Without it rows are deduplicated on Timestamp alone; index that instead.
+METER_COLUMNS = [
+    ('Meter', 'meter'),
+]
+
+# Optional per-interval energy columns (see energy_delta.py)
+ENERGY_DELTA_COLUMNS = [
+    ('RealEnergyDelta', 'total_real_energy_delta'),
+    ('ReactiveEnergyDelta', 'total_reactive_energy_delta'),
+    ('ApparentEnergyDelta', 'total_apparent_energy_delta'),
+]
+
+# SQL Server accepts at most 2100 parameters per request and 1000 rows per VALUES list.
+SQL_PARAMETER_LIMIT = 2100
+MAX_VALUES_ROWS = 1000
+
+
+def rows_per_statement(column_count, batch_size):
+    return max(1, min(batch_size, MAX_VALUES_ROWS, (SQL_PARAMETER_LIMIT - 1) // column_count))
+
+
+class BulkWriter:
+    """Inserts samples as multi-row VALUES statements instead of one per row.
+
+    A row is identified by its Meter (if ``columns`` has it) and Timestamp:
+    rows already in the table are skipped by the statement itself and repeats
+    within a batch are dropped before sending, so replaying a batch is safe.
+    The unique index above keeps the existence check a seek instead of a
+    table scan. Statements
+    are cached per table and row count; ``placeholder`` is ``%s`` for pymssql
+    and ``?`` for pyodbc.
+    """
+
+    def __init__(self, columns=SQL_COLUMNS, batch_size=500, placeholder="%s"):
+        self.columns = columns
+        self.keys = [key for _, key in columns]
+        self.names = ", ".join(column for column, _ in columns)
+        names = [column for column, _ in columns]
+        self.key_columns = [column for column in ("Meter", "Timestamp") if column in names]
+        self.key_positions = [names.index(column) for column in self.key_columns]
+        self.chunk_size = rows_per_statement(len(columns), batch_size)
+        self.row_values = "(" + ", ".join([placeholder] * len(columns)) + ")"
+        self._statements = {}
+
+    def statement(self, table, row_count):
+        key = (table, row_count)
+        if key not in self._statements:
+            values = ", ".join([self.row_values] * row_count)
+            match = " AND ".join(f"t.{column} = v.{column}" for column in self.key_columns)
+            self._statements[key] = (
+                f"INSERT INTO {table} ({self.names}) "
+                f"SELECT * FROM (VALUES {values}) AS v ({self.names}) "
+                f"WHERE NOT EXISTS (SELECT 1 FROM {table} t WHERE {match})"
+            )
+        return self._statements[key]
+
+    def rows(self, samples):
+        keys = self.keys
+        return [tuple(sample.get(key) for key in keys) for sample in samples]
+
+    def unique(self, rows):
+        """``rows`` without repeats of an earlier row's Meter and Timestamp."""
+        seen = set()
+        kept = []
+        for row in rows:
+            key = tuple(row[position] for position in self.key_positions)
+            if key not in seen:
+                seen.add(key)
+                kept.append(row)
+        return kept
+
+    def insert(self, cursor, table, rows):
+        """Blocking: insert row tuples (ordered like ``columns``) in as few statements as allowed."""
+        rows = self.unique(rows)
+        for start in range(0, len(rows), self.chunk_size):
+            chunk = rows[start:start + self.chunk_size]
+            cursor.execute(self.statement(table, len(chunk)), tuple(itertools.chain.from_iterable(chunk)))
+        return len(rows)
+
+
+class MergeWriter:
+    """Upserts row tuples with multi-row ``MERGE`` statements.
+
+    Rows matching an existing row on ``keys`` update its other columns; the
+    rest are inserted, so re-sending the same rows is harmless.
+    """
+
+    def __init__(self, columns, keys, batch_size=500, placeholder="%s"):
+        self.columns = columns
+        self.keys = keys
+        self.names = ", ".join(columns)
+        self.chunk_size = rows_per_statement(len(columns), batch_size)
+        self.row_values = "(" + ", ".join([placeholder] * len(columns)) + ")"
+        self._statements = {}
+
+    def statement(self, table, row_count):
+        key = (table, row_count)
+        if key not in self._statements:
+            values = ", ".join([self.row_values] * row_count)
+            match = " AND ".join(f"t.{column} = s.{column}" for column in self.keys)
+            update = ", ".join(f"{column} = s.{column}" for column in self.columns if column not in self.keys)
+            inserted = ", ".join(f"s.{column}" for column in self.columns)
+            self._statements[key] = (
+                f"MERGE INTO {table} WITH (HOLDLOCK) AS t "
+                f"USING (VALUES {values}) AS s ({self.names}) ON {match} "
+                f"WHEN MATCHED THEN UPDATE SET {update} "
+                f"WHEN NOT MATCHED THEN INSERT ({self.names}) VALUES ({inserted});"
+            )
+        return self._statements[key]
+
+    def upsert(self, cursor, table, rows):
+        """Blocking: upsert row tuples (ordered like ``columns``)."""
+        for start in range(0, len(rows), self.chunk_size):
+            chunk = rows[start:start + self.chunk_size]
+            cursor.execute(self.statement(table, len(chunk)), tuple(itertools.chain.from_iterable(chunk)))
+        return len(rows)
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+
+
+class PoolTimeout(Exception):
+    """No connection became free within the checkout timeout."""
+
+
+class ConnectionPool:
+    """A small pool of DB-API connections shared by every SQL writer.
+
+    Connections are opened lazily, reused LIFO so the warmest one goes out
+    first, and checked with ``SELECT 1`` when they have sat idle longer than
+    ``health_check_interval`` seconds. A connection that raises while checked
+    out is rolled back, or dropped if even that fails, and replaced on the next
+    checkout.
+    """
+
+    def __init__(self, connect, size=2, checkout_timeout=10, health_check_interval=60,
+                 logger: logging.Logger = None):
+        self.connect = connect
+        self.size = size
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+        self.logger = logger or logging.getLogger(__name__)
+        self._slots = asyncio.Semaphore(size)
+        self._idle = []  # (connection, monotonic time it was returned)
+
+    @staticmethod
+    def _ping(conn):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    async def _checkout(self):
+        while self._idle:
+            conn, returned = self._idle.pop()
+            if time.monotonic() - returned < self.health_check_interval:
+                return conn
+            try:
+                await asyncio.to_thread(self._ping, conn)
+                return conn
+            except Exception as e:
+                self.logger.warning(f"Dropping stale SQL connection: {e}")
+                await asyncio.to_thread(self._close, conn)
+        conn = await asyncio.to_thread(self.connect)
+        self.logger.info("Opened new SQL connection.")
+        return conn
+
+    @asynccontextmanager
+    async def connection(self):
+        """Check out a connection for the duration of the ``async with`` block."""
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.checkout_timeout)
+        except asyncio.TimeoutError:
+            raise PoolTimeout(f"No SQL connection free after {self.checkout_timeout}s") from None
+        conn = None
+        try:
+            conn = await self._checkout()
+            yield conn
+        except BaseException:
+            if conn is not None:
+                try:
+                    await asyncio.to_thread(conn.rollback)
+                except Exception:
+                    await asyncio.to_thread(self._close, conn)
+                    conn = None
+            raise
+        finally:
+            if conn is not None:
+                self._idle.append((conn, time.monotonic()))
+            self._slots.release()
+
+    def close(self):
+        while self._idle:
+            self._close(self._idle.pop()[0])
@@ -0,0 +1,209 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from metrics import REGISTRY, SIZE_BUCKETS
+from tracing import TRACER, sample_id
+
+SQL_FLUSH_SECONDS = REGISTRY.histogram("rx380_sql_flush_seconds", "Time to insert one spooled batch.")
+SQL_BATCH_ROWS = REGISTRY.histogram("rx380_sql_batch_rows", "Rows per SQL insert batch.",
+                                    buckets=SIZE_BUCKETS)
+SQL_ERRORS = REGISTRY.counter("rx380_sql_errors_total", "Failed SQL insert batches.")
+SQL_DEAD_LETTERS = REGISTRY.counter("rx380_sql_dead_letters_total", "Rows moved to the dead-letter table.")
+
+
+def sample_key(sample):
+    """Idempotency key: one row per meter per timestamp."""
+    return f"{sample.get('meter', '')}|{sample['timestamp']}"
+
+
+class SqlSpool:
+    """Durable on-disk queue (SQLite in WAL mode) for rows bound for SQL Server.
+
+    Every sample is spooled before any SQL insert is attempted, so a network
+    outage only delays rows instead of losing them. Rows are keyed by meter and
+    timestamp; re-spooling the same sample is a no-op. Other rows can be
+    spooled under their own ``key``; with ``replace`` a row re-spooled under a
+    queued key replaces it (and moves to the back). When the spool outgrows
+    ``max_bytes`` the oldest rows are dropped first.
+
+    Rows SQL Server refuses outright are moved to the ``dead_letter`` table
+    of the same file, with the error. Once the cause is fixed, queue them
+    again with
+
+        sqlite3 ~/rx380_spool.sqlite3 "INSERT OR IGNORE INTO spool (key, row)
+            SELECT key, row FROM dead_letter; DELETE FROM dead_letter"
+    """
+
+    def __init__(self, path, max_bytes=200 * 1024 * 1024, logger: logging.Logger = None,
+                 key=sample_key, replace=False):
+        self.path = Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.key = key
+        self.insert = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+        self.logger = logger or logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS spool ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT UNIQUE NOT NULL, row TEXT NOT NULL)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS dead_letter ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL, row TEXT NOT NULL, "
+            "error TEXT, failed_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+        )
+        self.db.commit()
+        self.page_size = self.db.execute("PRAGMA page_size").fetchone()[0]
+        self.added = asyncio.Event()
+
+    def _used_bytes(self):
+        pages = self.db.execute("PRAGMA page_count").fetchone()[0]
+        free = self.db.execute("PRAGMA freelist_count").fetchone()[0]
+        return (pages - free) * self.page_size
+
+    def put(self, samples):
+        """Blocking: spool samples, from a worker thread (the event loop uses ``append``)."""
+        with self.lock, self.db:
+            self.db.executemany(
+                f"{self.insert} INTO spool (key, row) VALUES (?, ?)",
+                [(self.key(sample), json.dumps(sample)) for sample in samples]
+            )
+            dropped = 0
+            while self._used_bytes() > self.max_bytes:
+                # Freed pages are reused, so the file stops growing at the budget.
+                cursor = self.db.execute(
+                    "DELETE FROM spool WHERE id IN "
+                    "(SELECT id FROM spool ORDER BY id LIMIT MAX(1, (SELECT COUNT(*) FROM spool) / 10))"
+                )
+                if not cursor.rowcount:
+                    break
+                dropped += cursor.rowcount
+        if dropped:
+            self.logger.warning(f"SQL spool over its disk budget; dropped {dropped} oldest rows.")
+
+    def _peek(self, limit):
+        with self.lock:
+            rows = self.db.execute("SELECT id, row FROM spool ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return [row_id for row_id, _ in rows], [json.loads(row) for _, row in rows]
+
+    def _ack(self, ids):
+        with self.lock, self.db:
+            self.db.executemany("DELETE FROM spool WHERE id = ?", [(row_id,) for row_id in ids])
+
+    def _dead_letter(self, ids, error):
+        with self.lock, self.db:
+            for row_id in ids:
+                self.db.execute(
+                    "INSERT INTO dead_letter (key, row, error) SELECT key, row, ? FROM spool WHERE id = ?",
+                    (error, row_id)
+                )
+                self.db.execute("DELETE FROM spool WHERE id = ?", (row_id,))
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+
+    async def append(self, samples):
+        await asyncio.to_thread(TRACER.wrap("spool_append", self.put), samples)
+        self.added.set()
+
+    async def peek(self, limit):
+        """Oldest ``limit`` rows as (ids, samples); they stay queued until acked."""
+        return await asyncio.to_thread(self._peek, limit)
+
+    async def ack(self, ids):
+        await asyncio.to_thread(self._ack, ids)
+
+    async def dead_letter(self, ids, error):
+        """Move rows out of the queue into ``dead_letter``, noting ``error``."""
+        await asyncio.to_thread(self._dead_letter, ids, error)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class SpoolForwarder:
+    """Drains the spool into SQL Server in batches at a bounded row rate.
+
+    A failed batch stays in the spool and is retried after ``retry_interval``
+    seconds, doubling up to ``max_retry_interval`` while the server is down.
+    A batch the server refuses (``rejected(error)`` is true, e.g. a constraint
+    or conversion error) would fail the same way forever, so its rows are
+    retried one by one and those still refused go to the dead-letter table.
+    """
+
+    def __init__(self, spool, sql_manager, logger: logging.Logger, batch_size=500,
+                 max_rows_per_second=2000, retry_interval=30, max_retry_interval=600,
+                 rejected=None):
+        self.spool = spool
+        self.sql_manager = sql_manager
+        self.logger = logger
+        self.batch_size = batch_size
+        self.max_rows_per_second = max_rows_per_second
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.rejected = rejected or (lambda error: False)
+
+    async def run(self):
+        delay = self.retry_interval
+        while True:
+            self.spool.added.clear()
+            ids, samples = await self.spool.peek(self.batch_size)
+            if not ids:
+                await self.spool.added.wait()
+                continue
+            started = time.monotonic()
+            span = TRACER.span("sql_insert")
+            if TRACER.enabled:
+                span.set(samples=[sample_id(sample) for sample in samples])
+            try:
+                with span:
+                    await self.sql_manager.insert_rows(samples)
+            except Exception as e:
+                SQL_ERRORS.inc()
+                if self.rejected(e):
+                    self.logger.error(f"SQL Server rejected a batch of {len(ids)} rows, "
+                                      f"inserting them one by one: {e}")
+                    if await self.insert_each(ids, samples):
+                        delay = self.retry_interval
+                        continue
+                self.logger.error(f"SQL insert error, {len(self.spool)} rows spooled: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_retry_interval)
+                continue
+            delay = self.retry_interval
+            SQL_FLUSH_SECONDS.observe(time.monotonic() - started)
+            SQL_BATCH_ROWS.observe(len(ids))
+            await self.spool.ack(ids)
+            self.logger.info(f"Inserted {len(ids)} SQL records.")
+            pause = len(ids) / self.max_rows_per_second - (time.monotonic() - started)
+            if pause > 0:
+                await asyncio.sleep(pause)
+
+    async def insert_each(self, ids, samples):
+        """Insert rows one at a time, dead-lettering those the server refuses.
+
+        Returns False if another error cut it short; the rows not yet handled
+        stay spooled.
+        """
+        for row_id, sample in zip(ids, samples):
+            try:
+                await self.sql_manager.insert_rows([sample])
+            except Exception as e:
+                if not self.rejected(e):
+                    return False
+                await self.spool.dead_letter([row_id], str(e))
+                SQL_DEAD_LETTERS.inc()
+                self.logger.error(f"Row {sample_key(sample)} moved to the dead-letter table: {e}")
+            else:
+                await self.spool.ack([row_id])
+        return True
@@ -0,0 +1,191 @@
+"""Opt-in spans around the pipeline stages, dumped as a Chrome trace.
+
+Code wraps each stage in ``with TRACER.span("name", key=value):``. While
+tracing is off ``span`` returns a shared no-op object, so the hooks can stay
+in the hot path. While it is on, every finished span is appended to a
+bounded in-memory buffer (the newest ``capacity`` spans are kept) and
+nothing touches the disk until the buffer is dumped:
+
+    kill -USR1 <pid>          write ~/rx380_traces/rx380_trace_<time>.json
+    kill -USR2 <pid>          turn recording on or off
+    GET /trace                the same JSON from the HTTP API
+
+Open the file in chrome://tracing or https://ui.perfetto.dev. Spans run on
+the event loop appear per asyncio task, spans in worker threads per thread.
+Spans about samples carry their correlation id, ``<meter>@<timestamp>``,
+which is also the key of the stored CSV/SQL row, so one reading can be
+followed from its Modbus read through every store.
+"""
+import asyncio
+import json
+import logging
+import os
+import signal
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+
+
+def sample_id(sample):
+    """Correlation id of a sample: the meter and timestamp it is stored under."""
+    return f"{sample.get('meter')}@{sample.get('timestamp')}"
+
+
+class Span:
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def set(self, **args):
+        self.args.update(args)
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.record(self.name, self.start, time.perf_counter_ns(), self.args)
+
+
+class NoSpan:
+    """Stands in for a Span while tracing is off."""
+
+    def set(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+NO_SPAN = NoSpan()
+
+
+class Tracer:
+    def __init__(self, capacity=20000):
+        self.enabled = False
+        self.events = deque(maxlen=capacity)
+        self.recorded = 0
+        self.lock = threading.Lock()
+
+    def enable(self, capacity=None):
+        if capacity and capacity != self.events.maxlen:
+            with self.lock:
+                self.events = deque(self.events, maxlen=capacity)
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def span(self, name, **args):
+        return Span(self, name, args) if self.enabled else NO_SPAN
+
+    def wrap(self, name, function):
+        """``function`` run inside a span, for handing to a worker thread."""
+        if not self.enabled:
+            return function
+
+        def traced(*args, **kwargs):
+            with self.span(name):
+                return function(*args, **kwargs)
+        return traced
+
+    def record(self, name, start, end, args):
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:  # a worker thread, no event loop
+            task = None
+        if task is not None:
+            lane, lane_name = id(task), task.get_name()
+        else:
+            thread = threading.current_thread()
+            lane, lane_name = thread.ident, thread.name
+        with self.lock:
+            self.events.append((name, start, end - start, lane, lane_name, args or None))
+            self.recorded += 1
+
+    def clear(self):
+        with self.lock:
+            self.events.clear()
+            self.recorded = 0
+
+    def chrome_trace(self):
+        """The buffered spans in the Chrome trace event format."""
+        with self.lock:
+            events, recorded = list(self.events), self.recorded
+        pid = os.getpid()
+        lanes = {}  # (id, name) -> small tid; task ids are reused once a task is gone
+        trace = []
+        for name, start, duration, lane, lane_name, args in events:
+            tid = lanes.get((lane, lane_name))
+            if tid is None:
+                tid = lanes[lane, lane_name] = len(lanes) + 1
+                trace.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                              "args": {"name": lane_name}})
+            event = {"name": name, "ph": "X", "ts": start / 1000, "dur": duration / 1000,
+                     "pid": pid, "tid": tid}
+            if args:
+                event["args"] = args
+            trace.append(event)
+        return {"traceEvents": trace, "displayTimeUnit": "ms",
+                "otherData": {"spans": len(events), "dropped": recorded - len(events)}}
+
+    def dump(self, path):
+        """Write the Chrome trace to ``path`` (atomically); returns the number of spans."""
+        trace = self.chrome_trace()
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            json.dump(trace, f, separators=(",", ":"), default=str)
+        os.replace(tmp, path)
+        return trace["otherData"]["spans"]
+
+
+TRACER = Tracer()
+
+
+def install_signal_handlers(tracer, folder, logger: logging.Logger = None):
+    """SIGUSR1 dumps ``tracer`` into ``folder``, SIGUSR2 toggles recording.
+
+    Call from the event loop. Does nothing where these signals do not exist.
+    """
+    logger = logger or logging.getLogger(__name__)
+    loop = asyncio.get_running_loop()
+    pending = set()
+
+    async def dump():
+        path = Path(folder) / f"rx380_trace_{datetime.now():%Y%m%d_%H%M%S}.json"
+        try:
+            spans = await asyncio.to_thread(tracer.dump, path)
+            logger.info(f"Trace with {spans} spans written to {path}.")
+        except Exception as e:
+            logger.error(f"Error writing trace: {e}")
+
+    def on_dump():
+        if not tracer.enabled and not tracer.events:
+            logger.warning("Tracing is off; send SIGUSR2 to start recording.")
+            return
+        task = loop.create_task(dump())
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+
+    def on_toggle():
+        if tracer.enabled:
+            tracer.disable()
+        else:
+            tracer.enable()
+        logger.info(f"Tracing {'on' if tracer.enabled else 'off'}.")
+
+    try:
+        loop.add_signal_handler(signal.SIGUSR1, on_dump)
+        loop.add_signal_handler(signal.SIGUSR2, on_toggle)
+    except (AttributeError, NotImplementedError, RuntimeError, ValueError):
+        logger.info("Trace signals are not available on this platform.")